@@ -0,0 +1,353 @@
+"""
+a small json api over the last published parse run, for overlays and bots.
+
+    python src/api.py --port 8000
+
+    GET /h2h?a=S1234&b=S5678    record, game count and set history of a vs b
+    GET /players                the sheeted players and their records
+    GET /players/S1234          a player's record, and against every opponent
+    GET /tournaments/1234       a tournament's sheeted players, best placing first
+    GET /health                 the loaded version and what has been served
+
+players can be given by pgstats id or by tag. everything is answered from an
+in-memory index built from the views parse.py publishes (see views.py);
+a background thread swaps in a new index whenever a new run is published
+"""
+import json
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, unquote, urlparse
+
+import click
+from loguru import logger
+
+from views import (
+    META_VIEW,
+    PLAYERS_VIEW,
+    ROSTERS_VIEW,
+    TOURNAMENTS_VIEW,
+    current_version,
+    load_view,
+    load_views,
+    player_view_name,
+)
+
+# seconds between checks for a newly published run
+RELOAD_SECONDS = float(os.getenv("API_RELOAD_SECONDS", "5"))
+# encoded responses kept per index, least recently used dropped first
+ENCODED_CACHE_SIZE = 4096
+
+
+class NotFound(Exception):
+    pass
+
+
+class Index:
+    """every answer the api gives for one published run, keyed for direct lookup"""
+
+    def __init__(self, version: str):
+        self.version = version
+        self.loaded_at = time.time()
+        self.meta = load_view(version, META_VIEW) or dict()
+        self.players = load_view(version, PLAYERS_VIEW) or []
+        self.sheeted = {player["id"] for player in self.players}
+        rows = load_view(version, TOURNAMENTS_VIEW) or []
+        rosters = load_view(version, ROSTERS_VIEW) or dict()
+        self.tournaments = {
+            row["id"]: dict(row, roster=rosters.get(row["id"], [])) for row in rows
+        }
+        player_views = load_views(
+            version, [player_view_name(player["id"]) for player in self.players]
+        )
+        self.records = dict()
+        # (player id, opponent id) -> record, from the player's side
+        self.h2h = dict()
+        self.names = dict()
+        # everyone with at least one set against a sheeted player
+        self.known = set(self.sheeted)
+        self.display_names = dict()
+        for view in player_views.values():
+            if view is None:
+                continue
+            player_id = view["id"]
+            self.records[player_id] = self.player_record(view)
+            for opponent_id, opponent in view["opponents"].items():
+                self.h2h[(player_id, opponent_id)] = dict(
+                    player=dict(id=player_id, name=view["name"]),
+                    opponent=dict(id=opponent_id, name=opponent["name"]),
+                    wins=opponent["wins"],
+                    losses=opponent["losses"],
+                    games=opponent["games"],
+                    history=opponent["history"],
+                )
+                self.names.setdefault(opponent["name"].lower(), opponent_id)
+                self.known.add(opponent_id)
+                self.display_names.setdefault(opponent_id, opponent["name"])
+        # sheet names win over tags seen in sets
+        for player in self.players:
+            self.names[player["name"].lower()] = player["id"]
+        self.display_names.update((player["id"], player["name"]) for player in self.players)
+        # resolved request -> encoded response, built on first request
+        self.encoded = OrderedDict()
+        self.lock = threading.Lock()
+
+    def player_record(self, view: dict) -> dict:
+        def opponents(opponent_ids: list[str]) -> list[dict]:
+            return [
+                dict(
+                    id=opponent_id,
+                    name=view["opponents"][opponent_id]["name"],
+                    wins=view["opponents"][opponent_id]["wins"],
+                    losses=view["opponents"][opponent_id]["losses"],
+                    sheeted=opponent_id in self.sheeted,
+                )
+                for opponent_id in opponent_ids
+            ]
+
+        vs_sheet = [
+            view["opponents"][opponent_id]
+            for opponent_id in view["opponents"]
+            if opponent_id in self.sheeted
+        ]
+        return dict(
+            id=view["id"],
+            name=view["name"],
+            wins=view["wins"],
+            losses=view["losses"],
+            tournaments=view["tournaments"],
+            vs_sheet=dict(
+                wins=sum(opponent["wins"] for opponent in vs_sheet),
+                losses=sum(opponent["losses"] for opponent in vs_sheet),
+            ),
+            beat=opponents(view["beat"]),
+            lost_to=opponents(view["lost_to"]),
+        )
+
+    def player_id(self, query: Optional[str]) -> str:
+        if not query:
+            raise NotFound("no player given")
+        if query in self.known:
+            return query
+        player_id = self.names.get(query.lower())
+        if player_id is None:
+            raise NotFound(f"unknown player {query}")
+        return player_id
+
+    def resolve(self, path: str, query: dict) -> tuple:
+        """
+        what a request asks for, with players resolved to ids: ("h2h", a, b),
+        ("players",), ("player", id) or ("tournament", id)
+        """
+        parts = [unquote(part) for part in path.strip("/").split("/")]
+        if parts == ["h2h"]:
+            a, b = query.get("a", [None])[0], query.get("b", [None])[0]
+            return ("h2h", self.player_id(a), self.player_id(b))
+        if parts == ["players"]:
+            return ("players",)
+        if len(parts) == 2 and parts[0] == "players":
+            player_id = self.player_id(parts[1])
+            if player_id not in self.records:
+                raise NotFound(f"no records for {parts[1]}, only sheeted players have them")
+            return ("player", player_id)
+        if len(parts) == 2 and parts[0] == "tournaments":
+            if parts[1] not in self.tournaments:
+                raise NotFound(f"tournament {parts[1]} wasn't considered")
+            return ("tournament", parts[1])
+        raise NotFound(f"no such endpoint {path}")
+
+    def lookup(self, key: tuple):
+        kind = key[0]
+        if kind == "h2h":
+            return self.head_to_head(key[1], key[2])
+        if kind == "players":
+            return self.players
+        if kind == "player":
+            return self.records[key[1]]
+        return self.tournaments[key[1]]
+
+    def answer(self, path: str, query: dict):
+        return self.lookup(self.resolve(path, query))
+
+    def head_to_head(self, a: str, b: str) -> dict:
+        """a vs b, both already resolved to ids"""
+        record = self.h2h.get((a, b))
+        if record is not None:
+            return record
+        reverse = self.h2h.get((b, a))
+        if reverse is not None:
+            # b is sheeted and a isn't: only b's side of their sets is known
+            won_games, lost_games = reverse["games"]
+            return dict(
+                player=reverse["opponent"],
+                opponent=reverse["player"],
+                wins=reverse["losses"],
+                losses=reverse["wins"],
+                games=[lost_games, won_games],
+                history=[flip_history(line) for line in reverse["history"]],
+            )
+        return dict(
+            player=dict(id=a, name=self.display_names.get(a, a)),
+            opponent=dict(id=b, name=self.display_names.get(b, b)),
+            wins=0,
+            losses=0,
+            games=[0, 0],
+            history=[],
+        )
+
+    def encode(self, path: str, query: dict) -> bytes:
+        """
+        answer() as json bytes. requests that resolve to the same thing (a tag or
+        an id, extra query args) share one encoding, and only the most recently
+        used ENCODED_CACHE_SIZE are kept
+        """
+        key = self.resolve(path, query)
+        with self.lock:
+            body = self.encoded.get(key)
+            if body is not None:
+                self.encoded.move_to_end(key)
+                return body
+        body = json.dumps(self.lookup(key)).encode("utf-8")
+        with self.lock:
+            self.encoded[key] = body
+            if len(self.encoded) > ENCODED_CACHE_SIZE:
+                self.encoded.popitem(last=False)
+        return body
+
+
+def flip_history(line: str) -> str:
+    """a history line as seen by the other player: 'win 3-1 at ...' -> 'loss 1-3 at ...'"""
+    result, score, rest = line.split(" ", 2)
+    wins, _, losses = score.partition("-")
+    return f"{'loss' if result == 'win' else 'win'} {losses}-{wins} {rest}"
+
+
+class Api:
+    """holds the current index and replaces it when a new run is published"""
+
+    def __init__(self):
+        self.index = None
+        self.stats = Counter()
+        self.stats_lock = threading.Lock()
+        # a version whose views were found missing, so it is only logged once
+        self.missing = None
+        self.reload()
+
+    def reload(self) -> bool:
+        version = current_version()
+        if version is None or (self.index is not None and version == self.index.version):
+            return False
+        if None in load_views(version, [META_VIEW, PLAYERS_VIEW]).values():
+            # expired (or never fully written): keep serving what is loaded, if anything
+            if version != self.missing:
+                logger.warning(f"views of version {version} are missing, not loading it")
+                self.missing = version
+            return False
+        started = time.perf_counter()
+        index = Index(version)
+        # one assignment: requests in flight keep the index they started with
+        self.index = index
+        logger.info(
+            f"loaded version {version}: {len(index.records)} players, {len(index.h2h)} h2hs, "
+            f"{len(index.tournaments)} tournaments in {time.perf_counter() - started:.2f}s"
+        )
+        return True
+
+    def watch(self, interval: float = RELOAD_SECONDS) -> None:
+        while True:
+            time.sleep(interval)
+            try:
+                self.reload()
+            except Exception as e:
+                logger.error(f"could not reload: {e}")
+
+    def count(self, key: str) -> None:
+        with self.stats_lock:
+            self.stats[key] += 1
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body are separate writes; without this each keep-alive
+    # response waits out the client's delayed ack (~40ms)
+    disable_nagle_algorithm = True
+
+    @property
+    def api(self) -> Api:
+        return self.server.api
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        index = self.api.index
+        if url.path.rstrip("/") == "/health":
+            with self.api.stats_lock:
+                stats = dict(self.api.stats)
+            return self.send_json(
+                200,
+                dict(
+                    version=index and index.version,
+                    loaded_at=index and index.loaded_at,
+                    meta=index and index.meta,
+                    served=stats,
+                ),
+            )
+        if index is None:
+            self.api.count("status 503")
+            return self.send_json(503, {"error": "nothing published yet"})
+        try:
+            body = index.encode(url.path, parse_qs(url.query))
+        except NotFound as e:
+            self.api.count("status 404")
+            return self.send_json(404, {"error": str(e)})
+        self.api.count("status 200")
+        self.send_body(200, body)
+
+    def send_json(self, status: int, value) -> None:
+        self.send_body(status, json.dumps(value).encode("utf-8"))
+
+    def send_body(self, status: int, body: bytes) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        # overlays fetch from the browser
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+def serve(api: Api, host: str = "127.0.0.1", port: int = 8000) -> ThreadingHTTPServer:
+    """start serving in a background thread; call .shutdown() on the result to stop"""
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.api = api
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", default=int(os.getenv("PORT", "8000")), show_default=True)
+@click.option("--reload-seconds", default=RELOAD_SECONDS, show_default=True, help="how often to check for a new run")
+def main(host, port, reload_seconds):
+    api = Api()
+    if api.index is None:
+        logger.warning("nothing published yet, waiting for a parse run")
+    threading.Thread(target=api.watch, args=(reload_seconds,), daemon=True).start()
+    server = serve(api, host, port)
+    logger.info(f"serving on http://{host}:{server.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
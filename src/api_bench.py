@@ -0,0 +1,191 @@
+"""
+load-test api.py: requests per second and latency over http, and the cost of
+one lookup in the index itself.
+
+with no --url, a synthetic world (see bench.py) is parsed into fakeredis and
+served in-process, so nothing leaves the machine. the client threads then share
+the interpreter with the server; for server-only numbers point --url at a
+separate `python src/api.py`
+
+    python src/api_bench.py --players 800 --sheet-players 150 --connections 8
+    python src/api_bench.py --url http://127.0.0.1:8000 --seconds 30
+"""
+import os
+
+# never publish the synthetic views over the real ones
+os.environ["REDIS_URL"] = ""
+
+import http.client
+import json
+import random
+import threading
+import time
+from urllib.parse import quote, urlparse
+
+import click
+from loguru import logger
+
+# share of each kind of request in the mix
+QUERY_MIX = {"h2h": 0.6, "h2h by tag": 0.05, "player": 0.25, "tournament": 0.1}
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def make_queries(players: list[dict], tournament_ids: list[str], count: int, seed: int) -> list[str]:
+    """request paths in the QUERY_MIX proportions"""
+    rand = random.Random(seed)
+    kinds = rand.choices(list(QUERY_MIX), weights=list(QUERY_MIX.values()), k=count)
+    queries = []
+    for kind in kinds:
+        a, b = rand.sample(players, 2)
+        if kind == "h2h":
+            queries.append(f"/h2h?a={a['id']}&b={b['id']}")
+        elif kind == "h2h by tag":
+            queries.append(f"/h2h?a={quote(a['name'])}&b={quote(b['name'])}")
+        elif kind == "player" or not tournament_ids:
+            queries.append(f"/players/{a['id']}")
+        else:
+            queries.append(f"/tournaments/{rand.choice(tournament_ids)}")
+    return queries
+
+
+def get_json(host: str, port: int, path: str):
+    connection = http.client.HTTPConnection(host, port, timeout=10)
+    connection.request("GET", path)
+    return json.loads(connection.getresponse().read())
+
+
+def hammer(host: str, port: int, queries: list[str], deadline: float, latencies: list, statuses: dict) -> None:
+    """send queries over one keep-alive connection until `deadline`"""
+    connection = http.client.HTTPConnection(host, port, timeout=10)
+    mine = []
+    counts = dict()
+    i = 0
+    while time.perf_counter() < deadline:
+        path = queries[i % len(queries)]
+        i += 1
+        started = time.perf_counter()
+        connection.request("GET", path)
+        response = connection.getresponse()
+        response.read()
+        mine.append(time.perf_counter() - started)
+        counts[response.status] = counts.get(response.status, 0) + 1
+    connection.close()
+    latencies.extend(mine)
+    for status, count in counts.items():
+        statuses[status] = statuses.get(status, 0) + count
+
+
+def load_test(host: str, port: int, queries: list[str], connections: int, seconds: float) -> dict:
+    latencies = []
+    statuses = dict()
+    deadline = time.perf_counter() + seconds
+    threads = [
+        threading.Thread(
+            target=hammer,
+            args=(host, port, queries[i::connections] or queries, deadline, latencies, statuses),
+        )
+        for i in range(connections)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return dict(
+        requests=len(latencies),
+        requests_per_second=len(latencies) / elapsed,
+        statuses=statuses,
+        p50_ms=percentile(latencies, 0.5) * 1000,
+        p90_ms=percentile(latencies, 0.9) * 1000,
+        p99_ms=percentile(latencies, 0.99) * 1000,
+        max_ms=(latencies[-1] if latencies else 0) * 1000,
+    )
+
+
+def lookup_cost(index, queries: list[str]) -> dict:
+    """microseconds per query answered from the index, first without and then with the encoded cache"""
+    from urllib.parse import parse_qs
+
+    parsed = [(urlparse(q).path, parse_qs(urlparse(q).query)) for q in queries]
+    started = time.perf_counter()
+    for path, query in parsed:
+        json.dumps(index.answer(path, query))
+    uncached = (time.perf_counter() - started) / len(parsed)
+    for path, query in parsed:
+        index.encode(path, query)
+    started = time.perf_counter()
+    for path, query in parsed:
+        index.encode(path, query)
+    cached = (time.perf_counter() - started) / len(parsed)
+    return dict(answer_us=uncached * 1e6, cached_us=cached * 1e6)
+
+
+@click.command()
+@click.option("--url", default=None, help="a running api.py; by default one is started on a synthetic world")
+@click.option("--players", default=400, show_default=True, help="synthetic world: size of the player pool")
+@click.option("--sheet-players", default=100, show_default=True, help="synthetic world: players on the sheet")
+@click.option("--tournaments", default=300, show_default=True, help="synthetic world: tournaments")
+@click.option("--connections", default=8, show_default=True, help="concurrent keep-alive clients")
+@click.option("--seconds", default=10.0, show_default=True, help="how long to send requests")
+@click.option("--seed", default=0, show_default=True)
+@click.option("--json", "json_path", default=None, help="write the results to this file")
+def main(url, players, sheet_players, tournaments, connections, seconds, seed, json_path):
+    result = dict()
+    server = None
+    if url is None:
+        import bench
+        from api import Api, serve
+        from synthetic import SyntheticWorld
+
+        # parse logs every set
+        logger.remove()
+        world = SyntheticWorld(
+            players=players, sheet_players=sheet_players, tournaments=tournaments, seed=seed
+        )
+        bench.run(world)
+        api = Api()
+        server = serve(api, port=0)
+        host, port = "127.0.0.1", server.server_port
+    else:
+        parsed = urlparse(url)
+        host, port = parsed.hostname, parsed.port or 80
+
+    sheet = get_json(host, port, "/players")
+    health = get_json(host, port, "/health")
+    tournament_ids = []
+    if server is not None:
+        tournament_ids = list(api.index.tournaments)
+    queries = make_queries(sheet, tournament_ids, 5000, seed)
+    click.echo(f"version {health['version']}, {len(sheet)} sheeted players")
+    if server is not None:
+        result["lookup"] = lookup_cost(api.index, queries)
+        click.echo(
+            f"index lookup: {result['lookup']['answer_us']:.1f} us to answer, "
+            f"{result['lookup']['cached_us']:.1f} us once encoded"
+        )
+    result["http"] = load_test(host, port, queries, connections, seconds)
+    http = result["http"]
+    click.echo(
+        f"http: {http['requests']} requests in {seconds:.0f}s over {connections} connections, "
+        f"{http['requests_per_second']:.0f}/s, statuses {http['statuses']}"
+    )
+    click.echo(
+        f"latency p50 {http['p50_ms']:.2f} ms, p90 {http['p90_ms']:.2f} ms, "
+        f"p99 {http['p99_ms']:.2f} ms, max {http['max_ms']:.2f} ms"
+    )
+    if server is not None:
+        server.shutdown()
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+time every stage of a parse run against a synthetic world.
+
+the run is parse.publish itself, and the timings are its stage_seconds metrics.
+nothing leaves the process: the world comes from synthetic.py, redis is
+fakeredis and the output spreadsheet is sheet_writer's in-memory one.
+each invocation runs once from an empty redis, so compare runs with the
+same --seed and sizes (and --json to keep the numbers)
+
+    python src/bench.py --players 800 --sheet-players 150 --tournaments 600
+"""
+import os
+
+# never diff against or overwrite the real sheet state
+os.environ["REDIS_URL"] = ""
+
+import json
+import time
+import tracemalloc
+
+import click
+from loguru import logger
+
+import parse
+from database import r, setj_many
+from metrics import METRICS
+from scrape import use_sheet_snapshot
+from sheet_writer import LocalSpreadsheet
+from synthetic import SyntheticWorld
+
+
+def stage_timings() -> dict:
+    """{stage: seconds} of the last run, from the stage_seconds gauges, in the order they ran"""
+    return {
+        dict(labels)["stage"]: seconds
+        for (name, labels), seconds in METRICS.gauges.items()
+        if name == "stage_seconds"
+    }
+
+
+def run(world: SyntheticWorld) -> dict:
+    """one parse.publish of `world`'s whole period, through the same code as a real run"""
+    use_sheet_snapshot(world.sheet_snapshot())
+    # what a scrape of the world would have left in redis
+    setj_many({f"{player_id}:results": world.results(player_id) for player_id in world.scraped_ids})
+    r.mset({f"{player_id}:num_badges": count for player_id, count in world.badge_counts().items()})
+    context = parse.RunContext()
+    context.doc = LocalSpreadsheet(parse.DESIRED_SHEETS)
+    parse._CONTEXT = context
+
+    started = time.perf_counter()
+    # the sheet's periods tab has the world's whole span as "synthetic"
+    parse.publish(period="synthetic", with_periods=False)
+    total = time.perf_counter() - started
+    for name, seconds in stage_timings().items():
+        logger.info(f"{name}: {seconds:.3f}s")
+
+    spreadsheet = context.doc
+    return dict(
+        stages=stage_timings(),
+        total=total,
+        sets=len(parse.SET_STORE),
+        window_sets=len(parse.WINDOW_ROWS),
+        notes=sum(len(sheet["notes"]) for sheet in spreadsheet.to_dict().values()),
+        sheet_calls=spreadsheet.calls,
+        sheet_requests=spreadsheet.requests,
+        sheet_cells=spreadsheet.cells,
+    )
+
+
+@click.command()
+@click.option("--players", default=400, show_default=True, help="size of the player pool")
+@click.option("--sheet-players", default=100, show_default=True, help="players on the input sheet")
+@click.option("--tournaments", default=300, show_default=True)
+@click.option("--entrants", default=48, show_default=True, help="players per tournament")
+@click.option("--sets-per-tournament", default=60, show_default=True)
+@click.option("--combine-rate", default=0.05, show_default=True, help="share of sheeted players with an alt account")
+@click.option("--swap-rate", default=0.02, show_default=True, help="share of tournaments with a player swap")
+@click.option("--seed", default=0, show_default=True)
+@click.option("--memory", is_flag=True, default=False, help="also report peak python memory (slower)")
+@click.option("--json", "json_path", default=None, help="write the results to this file")
+@click.option("--verbose", is_flag=True, default=False, help="keep parse.py's logging")
+def main(
+    players,
+    sheet_players,
+    tournaments,
+    entrants,
+    sets_per_tournament,
+    combine_rate,
+    swap_rate,
+    seed,
+    memory,
+    json_path,
+    verbose,
+):
+    if not verbose:
+        # parse logs every tournament and set; that would be most of what gets timed
+        logger.remove()
+    params = dict(
+        players=players,
+        sheet_players=sheet_players,
+        tournaments=tournaments,
+        entrants=entrants,
+        sets_per_tournament=sets_per_tournament,
+        combine_rate=combine_rate,
+        swap_rate=swap_rate,
+        seed=seed,
+    )
+    generated = time.perf_counter()
+    world = SyntheticWorld(**params)
+    click.echo(f"generated world in {time.perf_counter() - generated:.2f}s")
+    if memory:
+        tracemalloc.start()
+    result = run(world)
+    if memory:
+        result["peak_memory_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    result["params"] = params
+
+    for name, seconds in result["stages"].items():
+        click.echo(f"{name:>22}  {seconds * 1000:10.1f} ms")
+    click.echo(f"{'total':>22}  {result['total'] * 1000:10.1f} ms")
+    click.echo(
+        f"{result['sets']} sets ({result['window_sets']} in window), {result['notes']} notes, "
+        f"{result['sheet_calls']} sheet calls / {result['sheet_requests']} requests / {result['sheet_cells']} cells"
+    )
+    if memory:
+        click.echo(f"peak memory {result['peak_memory_mb']:.1f} MB")
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,23 @@
 """
 """
 
+import os
+
 from dotenv import load_dotenv
 from gspread.utils import rowcol_to_a1
 
 load_dotenv()
 
+# point the scraper somewhere else, e.g. at fake_pgstats.py
+PGSTATS_API_URL = os.getenv("PGSTATS_API_URL", "https://api.pgstats.com").rstrip("/")
+
 
 def id_to_url(player_id: str) -> str:
-    return f"https://api.pgstats.com/players/data?playerId={player_id}&game=melee"
+    return f"{PGSTATS_API_URL}/players/data?playerId={player_id}&game=melee"
+
+
+def id_to_profile_url(player_id: str) -> str:
+    return f"{PGSTATS_API_URL}/players/profile?playerId={player_id}&game=melee"
 
 
 def url_to_id(player_id: str) -> str:
@@ -0,0 +1,289 @@
+"""
+keep the scraper and the sheet publisher warm, and run them on a schedule or on request.
+
+    python src/daemon.py run                    # the long-running worker
+    python src/daemon.py request publish        # republish the sheet now
+    python src/daemon.py request player S1234   # rescrape one player, then republish
+    python src/daemon.py request scrape         # full refresh now
+    python src/daemon.py status
+
+requests go on a redis list. a request that is already waiting is dropped,
+and everything that arrives while the daemon is busy (or within the debounce
+window after the first request) is coalesced into one run: at most one scrape,
+where a full refresh swallows single players, followed by one publish.
+the http session, google clients and sheet snapshot live as long as the process
+"""
+import contextlib
+import os
+import signal
+import threading
+import time
+import uuid
+from datetime import timedelta
+from typing import Optional
+
+import click
+import redis
+from loguru import logger
+
+import parse
+from database import getj, r, setj
+from metrics import recorded_run
+from scrape import (
+    DEFAULT_WORKERS,
+    get_and_parse_player,
+    refresh_sheet_snapshot,
+    run_scrape,
+)
+
+JOBS_KEY = "daemon:jobs"
+PENDING_KEY = "daemon:pending"
+STATUS_KEY = "daemon:status"
+LAST_REFRESH_KEY = "daemon:last_refresh"
+# when to try a scheduled refresh again after it failed
+REFRESH_RETRY_KEY = "daemon:refresh_retry_at"
+LOCK_KEY = "daemon:lock"
+
+REFRESH_INTERVAL = timedelta(hours=float(os.getenv("DAEMON_REFRESH_HOURS", "6")))
+# a failed scheduled refresh is tried again after this, not on the next loop
+REFRESH_RETRY = timedelta(minutes=float(os.getenv("DAEMON_REFRESH_RETRY_MINUTES", "30")))
+# how long to wait for more requests after the first one before running
+DEBOUNCE_SECONDS = float(os.getenv("DAEMON_DEBOUNCE_SECONDS", "5"))
+# scrape snapshots kept in jsons/, older ones are deleted after each refresh
+KEEP_SNAPSHOTS = int(os.getenv("DAEMON_KEEP_SNAPSHOTS", "12"))
+# only one daemon runs jobs; it renews the lock every third of this, also mid-run
+LOCK_TTL = 60
+POLL_SECONDS = 5
+
+JOB_KINDS = ["scrape", "player", "publish"]
+
+
+def job_name(kind: str, player_id: Optional[str] = None) -> str:
+    if kind == "player":
+        return f"player:{player_id}"
+    return kind
+
+
+def request_job(kind: str, player_id: Optional[str] = None) -> bool:
+    """queue a job unless the same one is already waiting. returns whether it was queued"""
+    name = job_name(kind, player_id)
+
+    def push(pipe) -> bool:
+        if pipe.sismember(PENDING_KEY, name):
+            return False
+        pipe.multi()
+        pipe.sadd(PENDING_KEY, name)
+        pipe.rpush(JOBS_KEY, name)
+        return True
+
+    # a name is in the pending set exactly while its job is on the list
+    if not r.transaction(push, PENDING_KEY, value_from_callable=True):
+        logger.info(f"{name} is already queued")
+        return False
+    logger.info(f"queued {name}")
+    return True
+
+
+def take_jobs(timeout: float, debounce: float = DEBOUNCE_SECONDS) -> list[str]:
+    """
+    wait up to `timeout` seconds for a job, then give a burst `debounce` seconds
+    to arrive and take everything queued
+    """
+    # only wait here: the job goes to the back of the list, not off it, so
+    # nothing is lost (or left in the pending set) if the daemon dies meanwhile
+    first = r.blmove(JOBS_KEY, JOBS_KEY, max(1, int(timeout)), "LEFT", "RIGHT")
+    if first is None:
+        return []
+    if debounce:
+        time.sleep(debounce)
+    # take the jobs and forget they're pending in one step; requests from now on
+    # start a new run, since they may have newer data to show
+    pipe = r.pipeline()
+    pipe.lrange(JOBS_KEY, 0, -1)
+    pipe.delete(JOBS_KEY)
+    pipe.delete(PENDING_KEY)
+    names, _, _ = pipe.execute()
+    return list(dict.fromkeys(name.decode() for name in [first] + names))
+
+
+def plan_run(names: list[str]) -> tuple[bool, list[str]]:
+    """(full scrape?, players to rescrape) for a batch of job names. every run ends in a publish"""
+    full_scrape = "scrape" in names
+    players = [] if full_scrape else [n.split(":", 1)[1] for n in names if n.startswith("player:")]
+    return full_scrape, players
+
+
+class Daemon:
+    def __init__(self, workers: int = DEFAULT_WORKERS, incremental: bool = True):
+        self.workers = workers
+        self.incremental = incremental
+        self.token = uuid.uuid4().hex
+        self.stopping = False
+
+    def stop(self, *args) -> None:
+        logger.info("stopping after the current job")
+        self.stopping = True
+
+    def hold_lock(self) -> bool:
+        """take or renew the lock that makes this the daemon that runs jobs"""
+        if r.set(LOCK_KEY, self.token, nx=True, ex=LOCK_TTL):
+            return True
+        return self.renew_lock()
+
+    def renew_lock(self) -> bool:
+        """push back the lock's expiry if this daemon still holds it. returns whether it does"""
+
+        def extend(pipe) -> bool:
+            holder = pipe.get(LOCK_KEY)
+            if holder is None or holder.decode() != self.token:
+                return False
+            pipe.multi()
+            pipe.expire(LOCK_KEY, LOCK_TTL)
+            return True
+
+        # the lock is watched, so it can't change hands between the check and the expire
+        return r.transaction(extend, LOCK_KEY, value_from_callable=True)
+
+    def release_lock(self) -> None:
+        def delete(pipe) -> None:
+            holder = pipe.get(LOCK_KEY)
+            if holder is not None and holder.decode() == self.token:
+                pipe.multi()
+                pipe.delete(LOCK_KEY)
+
+        r.transaction(delete, LOCK_KEY)
+
+    @contextlib.contextmanager
+    def keeping_lock(self):
+        """renew the lock from a background thread while the block runs, however long it takes"""
+        stop = threading.Event()
+
+        def heartbeat() -> None:
+            while not stop.wait(LOCK_TTL / 3):
+                try:
+                    if not self.renew_lock():
+                        logger.error("lost the daemon lock in the middle of a run")
+                except redis.RedisError as e:
+                    logger.error(f"could not renew the daemon lock: {e}")
+
+        beat = threading.Thread(target=heartbeat, daemon=True)
+        beat.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            beat.join()
+
+    def seconds_until_refresh(self) -> float:
+        last, retry_at = r.mget([LAST_REFRESH_KEY, REFRESH_RETRY_KEY])
+        due = 0.0 if last is None else float(last) + REFRESH_INTERVAL.total_seconds()
+        if retry_at is not None:
+            due = max(due, float(retry_at))
+        return max(0.0, due - time.time())
+
+    def set_status(self, state: str, **extra) -> None:
+        status = getj(STATUS_KEY) or dict()
+        status.update(state=state, updated_at=time.time(), **extra)
+        setj(STATUS_KEY, status)
+
+    def full_scrape(self) -> None:
+        started = time.time()
+        with recorded_run("scrape"):
+            run_scrape(
+                incremental=self.incremental, workers=self.workers, keep_snapshots=KEEP_SNAPSHOTS
+            )
+        r.set("time_taken_scrape", time.time() - started)
+        r.set(LAST_REFRESH_KEY, time.time())
+        r.delete(REFRESH_RETRY_KEY)
+
+    def scrape_players(self, player_ids: list[str]) -> None:
+        with recorded_run("scrape"):
+            for player_id in player_ids:
+                try:
+                    get_and_parse_player(player_id)
+                except Exception as e:
+                    logger.error(f"failed to rescrape {player_id}: {e}")
+
+    def run(self, names: list[str]) -> bool:
+        """run a batch of jobs, returning whether it succeeded"""
+        full_scrape, players = plan_run(names)
+        logger.info(f"running {names}")
+        self.set_status("running", jobs=names, started_at=time.time())
+        try:
+            with self.keeping_lock():
+                if full_scrape:
+                    # run_scrape starts from a fresh copy of the sheet itself
+                    self.full_scrape()
+                else:
+                    # the sheet may have been edited, which is often why a republish was asked for
+                    refresh_sheet_snapshot()
+                    if players:
+                        self.scrape_players(players)
+                parse.publish()
+        except Exception as e:
+            logger.exception(f"run of {names} failed")
+            self.set_status("idle", last_jobs=names, last_error=str(e), finished_at=time.time())
+            return False
+        self.set_status("idle", last_jobs=names, last_error=None, finished_at=time.time())
+        return True
+
+    def loop(self) -> None:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        logger.info(f"daemon up, refreshing every {REFRESH_INTERVAL}")
+        self.set_status("idle")
+        try:
+            while not self.stopping:
+                if not self.hold_lock():
+                    logger.info("another daemon holds the lock, waiting")
+                    time.sleep(LOCK_TTL / 2)
+                    continue
+                if self.seconds_until_refresh() == 0:
+                    if not self.run(["scrape"]):
+                        logger.warning(f"scheduled refresh failed, trying again in {REFRESH_RETRY}")
+                        r.set(REFRESH_RETRY_KEY, time.time() + REFRESH_RETRY.total_seconds())
+                    continue
+                names = take_jobs(min(POLL_SECONDS, self.seconds_until_refresh()))
+                if names:
+                    self.run(names)
+        finally:
+            self.release_lock()
+            self.set_status("stopped")
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.option("--workers", default=DEFAULT_WORKERS, show_default=True, help="players scraped concurrently")
+@click.option(
+    "--incremental/--full",
+    default=True,
+    help="scheduled refreshes only re-download players whose pgstats profile changed",
+)
+def run(workers, incremental):
+    """run scheduled refreshes and queued jobs until stopped"""
+    Daemon(workers=workers, incremental=incremental).loop()
+
+
+@cli.command()
+@click.argument("kind", type=click.Choice(JOB_KINDS))
+@click.argument("player_id", required=False)
+def request(kind, player_id):
+    """queue a job for the daemon"""
+    if kind == "player" and not player_id:
+        raise click.BadParameter("a player job needs a pgstats player id")
+    request_job(kind, player_id)
+
+
+@cli.command()
+def status():
+    """what the daemon is doing and what is queued"""
+    click.echo(getj(STATUS_KEY))
+    click.echo(f"queued: {[name.decode() for name in r.lrange(JOBS_KEY, 0, -1)]}")
+
+
+if __name__ == "__main__":
+    cli()
@@ -9,17 +9,62 @@ load_dotenv()
 
 import json
 import gzip
-from io import BytesIO
-from typing import Optional
+import threading
+from typing import Iterable, Optional
+import msgpack
 import redis
 import fakeredis
+import zstandard
+
+from metrics import METRICS
+
+
+class RoundTripCounter:
+    """counts every command, and every pipeline as one round trip, into METRICS"""
+
+    def execute_command(self, *args, **options):
+        METRICS.inc("redis_round_trips_total", command=str(args[0]).lower())
+        return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return CountedPipeline(super().pipeline(transaction, shard_hint))
+
+
+class CountedPipeline:
+    def __init__(self, pipe):
+        self.pipe = pipe
+
+    def __getattr__(self, name):
+        return getattr(self.pipe, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.pipe.reset()
+
+    def execute(self, *args, **kwargs):
+        METRICS.inc("redis_round_trips_total", command="pipeline")
+        METRICS.inc("redis_pipelined_commands_total", len(self.pipe.command_stack))
+        return self.pipe.execute(*args, **kwargs)
+
+
+class CountingRedis(RoundTripCounter, redis.Redis):
+    pass
+
+
+class CountingFakeRedis(RoundTripCounter, fakeredis.FakeRedis):
+    pass
+
 
 REDIS_URL = os.getenv("REDIS_URL")
-if REDIS_URL is None:
-    # use fakeredis
-    r = fakeredis.FakeRedis()
+if not REDIS_URL:
+    # use fakeredis (also when REDIS_URL is set but empty)
+    r = CountingFakeRedis()
 else:
-    r = redis.Redis.from_url(REDIS_URL, db=0)
+    r = CountingRedis.from_url(REDIS_URL, db=0)
+
+GZIP_MAGIC = b"\x1f\x8b"
 
 
 def decompressBytesToString(inputBytes):
@@ -27,16 +72,7 @@ def decompressBytesToString(inputBytes):
     decompress the given byte array (which must be valid
     compressed gzip data) and return the decoded text (utf-8).
     """
-    bio = BytesIO()
-    stream = BytesIO(inputBytes)
-    decompressor = gzip.GzipFile(fileobj=stream, mode="r")
-    while True:  # until EOF
-        chunk = decompressor.read(8192)
-        if not chunk:
-            decompressor.close()
-            bio.seek(0)
-            return bio.read().decode("utf-8")
-        bio.write(chunk)
+    return gzip.decompress(inputBytes).decode("utf-8")
 
 
 def compressStringToBytes(inputString):
@@ -44,30 +80,99 @@ def compressStringToBytes(inputString):
     read the given string, encode it in utf-8,
     compress the data and return it as a byte array.
     """
-    bio = BytesIO()
-    bio.write(inputString.encode("utf-8"))
-    bio.seek(0)
-    stream = BytesIO()
-    compressor = gzip.GzipFile(fileobj=stream, mode="w")
-    while True:  # until EOF
-        chunk = bio.read(8192)
-        if not chunk:  # EOF?
-            compressor.close()
-            return stream.getvalue()
-        compressor.write(chunk)
+    return gzip.compress(inputString.encode("utf-8"))
+
+
+class GzipJsonCodec:
+    """the original format: gzipped json with no header, so old readers still work"""
+
+    name = "gzip-json"
 
+    def encode(self, value) -> bytes:
+        return compressStringToBytes(json.dumps(value))
 
-def setj(key: str, value: dict) -> Optional[bool]:
-    """a wrapper around redis set that converts the value to compressed json"""
-    return r.set(key, compressStringToBytes(json.dumps(value)))
+    def decode(self, data: bytes):
+        return json.loads(decompressBytesToString(data))
+
+
+class ZstdMsgpackCodec:
+    """msgpack compressed with zstd, behind a one byte tag"""
+
+    name = "zstd-msgpack"
+    tag = b"\x01"
+
+    def __init__(self, level: int = 3):
+        self.level = level
+        # zstd (de)compressors must not be shared between threads
+        self.local = threading.local()
+
+    def compressor(self) -> zstandard.ZstdCompressor:
+        if not hasattr(self.local, "compressor"):
+            self.local.compressor = zstandard.ZstdCompressor(level=self.level)
+        return self.local.compressor
+
+    def decompressor(self) -> zstandard.ZstdDecompressor:
+        if not hasattr(self.local, "decompressor"):
+            self.local.decompressor = zstandard.ZstdDecompressor()
+        return self.local.decompressor
+
+    def encode(self, value) -> bytes:
+        packed = msgpack.packb(value, use_bin_type=True)
+        return self.tag + self.compressor().compress(packed)
+
+    def decode(self, data: bytes):
+        packed = self.decompressor().decompress(data[len(self.tag) :])
+        return msgpack.unpackb(packed, raw=False, strict_map_key=False)
+
+
+CODECS = {codec.name: codec for codec in [GzipJsonCodec(), ZstdMsgpackCodec()]}
+# the codec new values are written with. every codec can always be read
+CODEC = CODECS[os.getenv("REDIS_CODEC", ZstdMsgpackCodec.name)]
+
+
+def encode(value) -> bytes:
+    data = CODEC.encode(value)
+    METRICS.inc("encoded_bytes_total", len(data))
+    return data
+
+
+def decode(data: bytes):
+    """decode a value written by any codec"""
+    METRICS.inc("decoded_bytes_total", len(data))
+    if data.startswith(GZIP_MAGIC):
+        return CODECS[GzipJsonCodec.name].decode(data)
+    if data.startswith(ZstdMsgpackCodec.tag):
+        return CODECS[ZstdMsgpackCodec.name].decode(data)
+    raise ValueError(f"unknown value encoding {data[:4]!r}")
+
+
+def setj(key: str, value: dict, ex=None) -> Optional[bool]:
+    """a wrapper around redis set that stores the value compressed"""
+    return r.set(key, encode(value), ex=ex)
 
 
 def getj(key: str) -> Optional[dict]:
-    """a wrapper around redis get that converts the value from json"""
+    """a wrapper around redis get that decodes the value"""
     val = r.get(key)
     if val is None:
         return None
-    return json.loads(decompressBytesToString(val))
+    return decode(val)
+
+
+def setj_many(values: dict, ex=None) -> None:
+    """setj for every {key: value}, in one pipelined round trip"""
+    pipe = r.pipeline(transaction=False)
+    for key, value in values.items():
+        pipe.set(key, encode(value), ex=ex)
+    pipe.execute()
+
+
+def getj_many(keys: Iterable[str]) -> list[Optional[dict]]:
+    """getj for every key with a single MGET, None for missing keys"""
+    keys = list(keys)
+    if not keys:
+        return []
+    return [None if val is None else decode(val) for val in r.mget(keys)]
 
 
 def main():
@@ -1,5 +1,7 @@
 import pyAesCrypt
+import json
 import os
+from io import BytesIO
 
 from dotenv import load_dotenv
 
@@ -21,5 +23,21 @@ def get_service_account_file_path():
         pyAesCrypt.decryptFile(SERVICE_FILE_AES_PATH, SERVICE_FILE_PATH, password)
         return SERVICE_FILE_PATH
 
+
+def get_service_account_info() -> dict:
+    """the service account credentials, decrypted in memory (nothing is written to disk)"""
+    if os.path.exists(SERVICE_FILE_PATH):
+        with open(SERVICE_FILE_PATH) as f:
+            return json.load(f)
+    load_dotenv()
+    password = os.getenv("AES_PASSWORD")
+    if not password:
+        raise ValueError("AES_PASSWORD not set in env")
+    decrypted = BytesIO()
+    with open(SERVICE_FILE_AES_PATH, "rb") as f:
+        pyAesCrypt.decryptStream(f, decrypted, password)
+    return json.loads(decrypted.getvalue())
+
+
 if __name__ == "__main__":
     print(get_service_account_file_path())
@@ -0,0 +1,309 @@
+"""
+a local stand-in for api.pgstats.com to load-test the scraper against.
+
+serves /players/data and /players/profile from a synthetic world (see
+synthetic.py) or from a recorded scrape snapshot, with injected latency,
+server errors, 429 throttling, truncated bodies and padded payloads.
+GET /stats returns what has been served so far.
+
+    python src/fake_pgstats.py --latency-ms 150 --error-rate 0.05 --rate-limit 20
+    PGSTATS_API_URL=http://127.0.0.1:8765 python src/scrape.py --workers 16
+"""
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+import click
+from loguru import logger
+
+from scrape import TokenBucket
+from snapshot import SnapshotReader
+from synthetic import SyntheticWorld
+
+LATENCY_DISTRIBUTIONS = ["fixed", "uniform", "exponential", "lognormal"]
+SERVER_ERRORS = [500, 502, 503]
+
+
+def sample_latency(rand: random.Random, distribution: str, mean: float, sigma: float) -> float:
+    """seconds to wait before answering, averaging `mean`"""
+    if mean <= 0:
+        return 0.0
+    if distribution == "uniform":
+        return rand.uniform(0, 2 * mean)
+    if distribution == "exponential":
+        return rand.expovariate(1 / mean)
+    if distribution == "lognormal":
+        # mu chosen so the mean stays `mean` whatever the spread
+        return rand.lognormvariate(math.log(mean) - sigma**2 / 2, sigma)
+    return mean
+
+
+class WorldSource:
+    """payloads from a synthetic world. ids it doesn't know borrow one of its players"""
+
+    def __init__(self, world: SyntheticWorld):
+        self.world = world
+        self.known = world.scraped_ids
+
+    def resolve(self, player_id: str) -> str:
+        if player_id in self.world.tags:
+            return player_id
+        digest = hashlib.sha1(player_id.encode("utf-8")).digest()
+        return self.known[int.from_bytes(digest[:4], "big") % len(self.known)]
+
+    def results(self, player_id: str) -> Optional[dict]:
+        return self.world.results(self.resolve(player_id))
+
+    def profile(self, player_id: str) -> Optional[dict]:
+        return self.world.profile(self.resolve(player_id))
+
+
+class SnapshotSource:
+    """payloads recorded by a scrape. profiles there are trimmed, so badges are made up from num_badges"""
+
+    def __init__(self, path: str):
+        self.snapshot = SnapshotReader(path)
+
+    def results(self, player_id: str) -> Optional[dict]:
+        return self.snapshot.get(f"{player_id}:results")
+
+    def profile(self, player_id: str) -> Optional[dict]:
+        profile = self.snapshot.get(f"{player_id}:profile")
+        if profile is None:
+            return None
+        profile = dict(profile)
+        num_badges = profile.pop("num_badges", 0)
+        profile["badges"] = dict(by_events=[dict(online=False)] * num_badges)
+        profile["placings"] = []
+        return profile
+
+
+class FakePgstats:
+    """what to serve and how badly to serve it"""
+
+    def __init__(
+        self,
+        source,
+        latency_ms: float = 0,
+        latency_distribution: str = "fixed",
+        latency_sigma: float = 0.5,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        rate_limit: float = 0.0,
+        burst: float = 10,
+        truncate_rate: float = 0.0,
+        pad_bytes: int = 0,
+        seed: int = 0,
+    ):
+        self.source = source
+        self.latency = latency_ms / 1000
+        self.latency_distribution = latency_distribution
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.limiter = TokenBucket(rate_limit, burst) if rate_limit > 0 else None
+        self.truncate_rate = truncate_rate
+        self.pad_bytes = pad_bytes
+        self.random = random.Random(seed)
+        self.stats = Counter()
+        self.bodies = dict()
+        self.lock = threading.Lock()
+
+    def roll(self) -> float:
+        with self.lock:
+            return self.random.random()
+
+    def delay(self) -> float:
+        with self.lock:
+            return sample_latency(
+                self.random, self.latency_distribution, self.latency, self.latency_sigma
+            )
+
+    def count(self, key: str, amount: int = 1) -> None:
+        with self.lock:
+            self.stats[key] += amount
+
+    def body(self, kind: str, player_id: str) -> Optional[bytes]:
+        """the encoded response for one player, built once"""
+        key = (kind, player_id)
+        with self.lock:
+            if key in self.bodies:
+                return self.bodies[key]
+        if kind == "data":
+            result = self.source.results(player_id)
+            if result is not None and self.pad_bytes:
+                result = self.pad(result)
+        else:
+            result = self.source.profile(player_id)
+        body = None if result is None else json.dumps({"result": result}).encode("utf-8")
+        with self.lock:
+            self.bodies[key] = body
+        return body
+
+    def pad(self, results: dict) -> dict:
+        """bloat every set with a field the scraper's projection should drop"""
+        filler = "x" * self.pad_bytes
+        return {
+            tournament_id: dict(
+                tournament,
+                sets=[dict(set_data, padding=filler) for set_data in tournament["sets"]],
+            )
+            for tournament_id, tournament in results.items()
+        }
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def fake(self) -> FakePgstats:
+        return self.server.fake
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/stats":
+            with self.fake.lock:
+                stats = dict(self.fake.stats)
+            return self.send_json(200, stats)
+        kind = {"/players/data": "data", "/players/profile": "profile"}.get(url.path)
+        player_id = parse_qs(url.query).get("playerId", [None])[0]
+        if kind is None or player_id is None:
+            return self.send_json(404, {"error": "not found"})
+        self.fake.count(f"requests {kind}")
+
+        delay = self.fake.delay()
+        self.fake.count("latency ms", int(1000 * delay))
+        time.sleep(delay)
+        if self.fake.limiter is not None:
+            wait = self.fake.limiter.try_acquire()
+            if wait:
+                return self.send_json(429, {"error": "slow down"}, retry_after=math.ceil(wait))
+        if self.fake.roll() < self.fake.throttle_rate:
+            return self.send_json(429, {"error": "slow down"}, retry_after=1)
+        if self.fake.roll() < self.fake.error_rate:
+            status = SERVER_ERRORS[int(self.fake.roll() * len(SERVER_ERRORS))]
+            return self.send_json(status, {"error": "injected"})
+        body = self.fake.body(kind, player_id)
+        if body is None:
+            return self.send_json(404, {"error": f"unknown player {player_id}"})
+        if self.fake.roll() < self.fake.truncate_rate:
+            # promise the whole body, send half, hang up
+            self.fake.count("status truncated")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body[: len(body) // 2])
+            self.close_connection = True
+            return
+        self.send_body(200, body)
+
+    def send_json(self, status: int, value, retry_after: Optional[int] = None) -> None:
+        self.send_body(status, json.dumps(value).encode("utf-8"), retry_after)
+
+    def send_body(self, status: int, body: bytes, retry_after: Optional[int] = None) -> None:
+        self.fake.count(f"status {status}")
+        self.fake.count("bytes sent", len(body))
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if retry_after is not None:
+            self.send_header("Retry-After", str(retry_after))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+def serve(fake: FakePgstats, host: str = "127.0.0.1", port: int = 8765) -> ThreadingHTTPServer:
+    """start serving in a background thread; call .shutdown() on the result to stop"""
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.fake = fake
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", default=8765, show_default=True)
+@click.option("--snapshot", "snapshot_path", default=None, help="serve the players recorded in this scrape snapshot")
+@click.option("--players", default=400, show_default=True, help="synthetic world: size of the player pool")
+@click.option("--sheet-players", default=100, show_default=True, help="synthetic world: players with results")
+@click.option("--tournaments", default=300, show_default=True, help="synthetic world: tournaments")
+@click.option("--sets-per-tournament", default=60, show_default=True, help="synthetic world: sets per tournament")
+@click.option("--latency-ms", default=100.0, show_default=True, help="mean response latency")
+@click.option("--latency-distribution", type=click.Choice(LATENCY_DISTRIBUTIONS), default="lognormal", show_default=True)
+@click.option("--latency-sigma", default=0.5, show_default=True, help="spread of the lognormal latency")
+@click.option("--error-rate", default=0.0, show_default=True, help="share of requests answered with a 5xx")
+@click.option("--throttle-rate", default=0.0, show_default=True, help="share of requests answered with a 429")
+@click.option("--rate-limit", default=0.0, show_default=True, help="requests per second before 429s (0 for no limit)")
+@click.option("--burst", default=10.0, show_default=True, help="requests allowed at once under --rate-limit")
+@click.option("--truncate-rate", default=0.0, show_default=True, help="share of bodies cut off halfway")
+@click.option("--pad-bytes", default=0, show_default=True, help="junk bytes added to every set of a results payload")
+@click.option("--seed", default=0, show_default=True)
+def main(
+    host,
+    port,
+    snapshot_path,
+    players,
+    sheet_players,
+    tournaments,
+    sets_per_tournament,
+    latency_ms,
+    latency_distribution,
+    latency_sigma,
+    error_rate,
+    throttle_rate,
+    rate_limit,
+    burst,
+    truncate_rate,
+    pad_bytes,
+    seed,
+):
+    if snapshot_path:
+        source = SnapshotSource(snapshot_path)
+    else:
+        source = WorldSource(
+            SyntheticWorld(
+                players=players,
+                sheet_players=sheet_players,
+                tournaments=tournaments,
+                sets_per_tournament=sets_per_tournament,
+                seed=seed,
+            )
+        )
+    fake = FakePgstats(
+        source,
+        latency_ms=latency_ms,
+        latency_distribution=latency_distribution,
+        latency_sigma=latency_sigma,
+        error_rate=error_rate,
+        throttle_rate=throttle_rate,
+        rate_limit=rate_limit,
+        burst=burst,
+        truncate_rate=truncate_rate,
+        pad_bytes=pad_bytes,
+        seed=seed,
+    )
+    server = serve(fake, host, port)
+    logger.info(f"serving fake pgstats, export PGSTATS_API_URL=http://{host}:{server.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        logger.info(f"served {dict(fake.stats)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+head-to-head matrices for a list of players, built from the set store with
+numpy scatter-adds over the window's rows instead of a python loop per set
+"""
+from array import array
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+
+from setstore import LOSER_SEEN, NO_SCORE, WINNER_SEEN, SetStore
+
+
+def scatter_add(cells: np.ndarray, size: int, weights: Optional[np.ndarray] = None) -> np.ndarray:
+    """counts (or summed `weights`) per flat cell index, as a length `size` int array"""
+    totals = np.bincount(cells, weights=weights, minlength=size)
+    return totals.astype(np.int64)
+
+
+class H2HMatrix:
+    """
+    flat n*n count matrices for `player_ids`, where cell (i, j) is player i vs player j.
+    a win only counts if the winner's results contained the set (and a loss if
+    the loser's did), matching how the wins/losses sheets are built.
+    game counts include every set between the two with a known score
+    """
+
+    def __init__(self, player_ids: list[str]):
+        self.player_ids = player_ids
+        self.position = {player_id: idx for idx, player_id in enumerate(player_ids)}
+        n = self.n = len(player_ids)
+        self.wins = np.zeros(n * n, dtype=np.int64)
+        self.losses = np.zeros(n * n, dtype=np.int64)
+        self.games_won = np.zeros(n * n, dtype=np.int64)
+        # sorted flat indices of every cell (in both directions) that has a set behind it
+        self.touched = np.zeros(0, dtype=np.int64)
+
+    @classmethod
+    def from_store(
+        cls, store: SetStore, player_ids: list[str], rows: Optional[Iterable[int]] = None
+    ) -> "H2HMatrix":
+        """scatter every non-dq set in `rows` (default: all) into the matrices"""
+        matrix = cls(player_ids)
+        n = matrix.n
+        size = n * n
+        # interned player -> matrix position, -1 for players not in the list
+        lookup = np.full(len(store.players), -1, dtype=np.int64)
+        for player_id, idx in matrix.position.items():
+            interned = store.players.get(player_id)
+            if interned is not None:
+                lookup[interned] = idx
+        if rows is None:
+            rows = np.arange(len(store), dtype=np.int64)
+        elif isinstance(rows, array):
+            rows = np.frombuffer(rows, dtype=np.dtype(rows.typecode)).astype(np.int64)
+        else:
+            rows = np.fromiter(rows, dtype=np.int64)
+
+        def column(name: str) -> np.ndarray:
+            # indexing copies, so no view is left pinning the store's arrays (they couldn't grow)
+            values = getattr(store, name)
+            return np.frombuffer(values, dtype=np.dtype(values.typecode))[rows].astype(np.int64)
+
+        w = lookup[column("winner")]
+        l = lookup[column("loser")]
+        keep = (w >= 0) & (l >= 0) & (column("dq") == 0)
+        seen = column("seen")[keep]
+        winner_score = column("winner_score")[keep]
+        loser_score = column("loser_score")[keep]
+        w, l = w[keep], l[keep]
+        won_cells, lost_cells = w * n + l, l * n + w
+
+        matrix.touched = np.flatnonzero(
+            scatter_add(won_cells, size) + scatter_add(lost_cells, size)
+        )
+        matrix.wins = scatter_add(won_cells[(seen & WINNER_SEEN) != 0], size)
+        matrix.losses = scatter_add(lost_cells[(seen & LOSER_SEEN) != 0], size)
+        scored = winner_score != NO_SCORE
+        matrix.games_won = scatter_add(won_cells[scored], size, winner_score[scored])
+        matrix.games_won += scatter_add(lost_cells[scored], size, loser_score[scored])
+        return matrix
+
+    def record(self, i: int, j: int) -> tuple[int, int]:
+        """(wins, losses) of player i against player j"""
+        return int(self.wins[i * self.n + j]), int(self.losses[i * self.n + j])
+
+    def games(self, i: int, j: int) -> tuple[int, int]:
+        """(games won, games lost) of player i against player j"""
+        return int(self.games_won[i * self.n + j]), int(self.games_won[j * self.n + i])
+
+    def nonempty_cells(self) -> Iterator[tuple[int, int]]:
+        """(i, j) of every pair that has a set between them, in row-major order"""
+        for cell in self.touched.tolist():
+            yield divmod(cell, self.n)
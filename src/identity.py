@@ -0,0 +1,81 @@
+"""
+who a player id in a set really is.
+
+built once per run from the input sheet: banned tournaments as a set, swaps
+keyed by (tournament id, bracket player id), and duplicate accounts flattened
+so every id points straight at its main account, even when "^" rows chain
+through several accounts. resolving a set is then a few dict lookups
+"""
+from typing import Iterable, Optional
+
+from loguru import logger
+
+
+def flatten_combines(duplicate_of: dict) -> dict:
+    """
+    {account: main account}, union-find style: every account linked to others by
+    "^" rows (directly or through a chain) maps to the one main of its group. the
+    main is the group's account that isn't itself a duplicate; a group that only
+    loops back on itself has none, so its smallest id is used
+
+    >>> flatten_combines({"a": "b", "b": "c"})
+    {'a': 'c', 'b': 'c'}
+    >>> flatten_combines({"a": "b", "b": "a"})
+    {'a': 'a', 'b': 'a'}
+    >>> flatten_combines({"d": "a", "a": "b", "b": "c", "c": "a"})
+    {'d': 'a', 'a': 'a', 'b': 'a', 'c': 'a'}
+    """
+    parent = dict()
+
+    def find(player_id: str) -> str:
+        root = player_id
+        while parent[root] != root:
+            root = parent[root]
+        while parent[player_id] != root:
+            parent[player_id], player_id = root, parent[player_id]
+        return root
+
+    for account, main in duplicate_of.items():
+        parent.setdefault(account, account)
+        parent.setdefault(main, main)
+        a, b = find(account), find(main)
+        if a != b:
+            # the smaller id becomes the root, so groups don't depend on row order
+            parent[max(a, b)] = min(a, b)
+
+    mains = dict()
+    for player_id in parent:
+        if player_id not in duplicate_of:
+            mains[find(player_id)] = player_id
+    for root in sorted({find(account) for account in duplicate_of} - mains.keys()):
+        logger.warning(f"duplicate accounts loop back on themselves, using {root} as the main")
+        mains[root] = root
+    return {account: mains[find(account)] for account in duplicate_of}
+
+
+class IdentityIndex:
+    def __init__(
+        self,
+        banned_tournament_ids: Iterable[str] = (),
+        swaps: Optional[dict] = None,
+        duplicate_of: Optional[dict] = None,
+    ):
+        self.banned = frozenset(banned_tournament_ids)
+        # (tournament id, bracket player id) -> actual player id, first row wins
+        self.swaps = dict()
+        for tournament_id, pairs in (swaps or {}).items():
+            for bracket_id, actual_id in pairs:
+                self.swaps.setdefault((tournament_id, bracket_id), actual_id)
+        self.main_account = flatten_combines(duplicate_of or {})
+
+    def is_banned(self, tournament_id: str) -> bool:
+        return tournament_id in self.banned
+
+    def canonical(self, player_id: str) -> str:
+        """the main account of `player_id`"""
+        return self.main_account.get(player_id, player_id)
+
+    def resolve(self, tournament_id: str, player_id: str) -> str:
+        """who actually played as `player_id` at `tournament_id`"""
+        player_id = self.main_account.get(player_id, player_id)
+        return self.swaps.get((tournament_id, player_id), player_id)
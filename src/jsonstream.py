@@ -0,0 +1,127 @@
+"""
+incremental decoding of big json objects.
+
+iter_object_items() walks down to one object inside a json document and yields
+its members one at a time as the text arrives, so only the member being decoded
+(not the whole document) has to be held in memory
+"""
+import codecs
+import json
+from typing import Iterable, Iterator
+
+WHITESPACE = " \t\n\r"
+# what may follow a value inside an object or array
+DELIMITERS = WHITESPACE + ",]}"
+
+
+def is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class JsonStreamBuffer:
+    """a text buffer over byte chunks that decodes one json value at a time"""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.json_decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.exhausted = False
+
+    def fill(self) -> bool:
+        """read another chunk, dropping what's been consumed. False at the end of input"""
+        if self.exhausted:
+            return False
+        try:
+            chunk = next(self.chunks)
+        except StopIteration:
+            self.exhausted = True
+            self.buf = self.buf[self.pos :] + self.decoder.decode(b"", final=True)
+        else:
+            self.buf = self.buf[self.pos :] + self.decoder.decode(chunk)
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """the next non-whitespace character, without consuming it"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                raise ValueError("unexpected end of json input")
+
+    def expect(self, char: str) -> None:
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"expected {char!r} in json input, found {found!r}")
+        self.pos += 1
+
+    def value(self):
+        """decode the next complete json value, reading more input as needed"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            # a number only ends at a delimiter: "3" or "3." at the end of a chunk may go on in the next
+            if is_number(value) and not self.exhausted and (
+                end == len(self.buf) or self.buf[end] not in DELIMITERS
+            ):
+                self.fill()
+                continue
+            self.pos = end
+            return value
+
+    def object_items(self) -> Iterator[tuple[str, "JsonStreamBuffer"]]:
+        """
+        walk the members of the object at the current position, yielding (key, self)
+        with the buffer positioned at the member's value. the consumer must consume
+        (or skip) the value before asking for the next member
+        """
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key, self
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("}")
+            return
+
+
+def iter_object_items(chunks: Iterable[bytes], path: tuple[str, ...] = ()) -> Iterator[tuple[str, object]]:
+    """
+    yield (key, decoded value) for every member of the object found by following
+    `path` from the top-level object, e.g. path=("result",) for {"result": {...}}.
+    raises ValueError if `path` doesn't lead to an object
+    """
+    stream = JsonStreamBuffer(chunks)
+    yield from _walk(stream, path)
+
+
+def _walk(stream: JsonStreamBuffer, path: tuple[str, ...]) -> Iterator[tuple[str, object]]:
+    if not path:
+        for key, _ in stream.object_items():
+            yield key, stream.value()
+        return
+    found = False
+    for key, _ in stream.object_items():
+        if key == path[0] and not found:
+            if stream.peek() != "{":
+                raise ValueError(f"expected an object at {key!r}, found {stream.value()!r}")
+            found = True
+            yield from _walk(stream, path[1:])
+        else:
+            stream.value()
+    if not found:
+        raise ValueError(f"no {path[0]!r} object in json input")
@@ -0,0 +1,259 @@
+"""
+counters, gauges and histograms for one scrape or parse run.
+
+everything records into the process-wide METRICS. main() of scrape.py and
+parse.py start a run, and save it to redis under metrics:{kind}:{run id} when
+they finish, with metrics:{kind}:latest naming the newest. a saved run can
+be printed as json or prometheus text:
+
+    python src/metrics.py parse --format prometheus
+"""
+import cProfile
+import contextlib
+import io
+import json
+import pstats
+import threading
+import time
+from bisect import bisect_left
+from datetime import timedelta
+from typing import Optional
+
+import click
+from loguru import logger
+
+METRICS_KEY_PREFIX = "metrics"
+METRICS_TTL = timedelta(days=30)
+# how many run ids to remember per kind
+METRICS_HISTORY = 100
+NAMESPACE = "ranker"
+# seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def label_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        # counts[i] is observations <= buckets[i], the last one is +Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    def __init__(self, kind: str = "adhoc"):
+        self.lock = threading.Lock()
+        self.reset(kind)
+
+    def reset(self, kind: str) -> None:
+        """start recording a new run"""
+        with self.lock:
+            self.kind = kind
+            self.run_id = time.strftime("%Y%m%dT%H%M%S", time.gmtime())
+            self.started_at = time.time()
+            self.counters = dict()
+            self.gauges = dict()
+            self.histograms = dict()
+
+    def inc(self, name: str, amount: float = 1, **labels) -> None:
+        key = (name, label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set(self, name: str, value: float, **labels) -> None:
+        with self.lock:
+            self.gauges[(name, label_key(labels))] = value
+
+    def observe(self, name: str, value: float, buckets=LATENCY_BUCKETS, **labels) -> None:
+        key = (name, label_key(labels))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(buckets)
+            self.histograms[key].observe(value)
+
+    @contextlib.contextmanager
+    def timer(self, name: str, **labels):
+        """observe how long the block took, in seconds, into the histogram `name`"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """time one stage of the run into the gauge stage_seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.set("stage_seconds", time.perf_counter() - start, stage=name)
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return dict(
+                kind=self.kind,
+                run=self.run_id,
+                started_at=self.started_at,
+                duration=time.time() - self.started_at,
+                counters=[
+                    dict(name=name, labels=dict(labels), value=value)
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+                gauges=[
+                    dict(name=name, labels=dict(labels), value=value)
+                    for (name, labels), value in sorted(self.gauges.items())
+                ],
+                histograms=[
+                    dict(
+                        name=name,
+                        labels=dict(labels),
+                        buckets=list(h.buckets),
+                        counts=list(h.counts),
+                        sum=h.sum,
+                        count=h.count,
+                    )
+                    for (name, labels), h in sorted(self.histograms.items())
+                ],
+            )
+
+    def save(self) -> dict:
+        """store this run in redis and make it the latest of its kind"""
+        # imported here: database records into METRICS, so it imports this module
+        from database import r, setj
+
+        run = self.to_dict()
+        key = run_key(run["kind"], run["run"])
+        setj(key, run, ex=METRICS_TTL)
+        r.set(latest_key(run["kind"]), run["run"])
+        r.lpush(runs_key(run["kind"]), run["run"])
+        r.ltrim(runs_key(run["kind"]), 0, METRICS_HISTORY - 1)
+        logger.info(f"saved metrics to {key}")
+        return run
+
+
+METRICS = Metrics()
+
+
+def run_key(kind: str, run_id: str) -> str:
+    return f"{METRICS_KEY_PREFIX}:{kind}:{run_id}"
+
+
+def latest_key(kind: str) -> str:
+    return f"{METRICS_KEY_PREFIX}:{kind}:latest"
+
+
+def runs_key(kind: str) -> str:
+    return f"{METRICS_KEY_PREFIX}:{kind}:runs"
+
+
+def load_run(kind: str, run_id: Optional[str] = None) -> Optional[dict]:
+    """a saved run, the latest of its kind by default"""
+    from database import getj, r
+
+    if run_id is None:
+        latest = r.get(latest_key(kind))
+        if latest is None:
+            return None
+        run_id = latest.decode()
+    return getj(run_key(kind, run_id))
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+
+    def escape(value) -> str:
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def to_prometheus(run: dict) -> str:
+    """a saved run in the prometheus text exposition format"""
+    run_labels = dict(kind=run["kind"], run=run["run"])
+    lines = []
+    typed = set()
+
+    def declare(name: str, kind: str) -> None:
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} {kind}")
+
+    for counter in run["counters"]:
+        name = f"{NAMESPACE}_{counter['name']}"
+        declare(name, "counter")
+        labels = {**run_labels, **counter["labels"]}
+        lines.append(f"{name}{format_labels(labels)} {counter['value']}")
+    for gauge in run["gauges"]:
+        name = f"{NAMESPACE}_{gauge['name']}"
+        declare(name, "gauge")
+        labels = {**run_labels, **gauge["labels"]}
+        lines.append(f"{name}{format_labels(labels)} {gauge['value']}")
+    for hist in run["histograms"]:
+        name = f"{NAMESPACE}_{hist['name']}"
+        declare(name, "histogram")
+        labels = {**run_labels, **hist["labels"]}
+        cumulative = 0
+        for le, count in zip(list(hist["buckets"]) + ["+Inf"], hist["counts"]):
+            cumulative += count
+            lines.append(f"{name}_bucket{format_labels({**labels, 'le': le})} {cumulative}")
+        lines.append(f"{name}_sum{format_labels(labels)} {hist['sum']}")
+        lines.append(f"{name}_count{format_labels(labels)} {hist['count']}")
+    return "\n".join(lines) + "\n"
+
+
+@contextlib.contextmanager
+def recorded_run(kind: str, save: bool = True):
+    """record the block as a new run of `kind` and save it (unless not `save`), even if it fails"""
+    METRICS.reset(kind)
+    try:
+        yield METRICS
+    finally:
+        if save:
+            METRICS.save()
+
+
+@contextlib.contextmanager
+def profiled(path: Optional[str], top: int = 30):
+    """run the block under cProfile, dump the stats to `path` and log the top entries"""
+    if path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(top)
+        logger.info(f"profile written to {path}\n{out.getvalue()}")
+
+
+@click.command()
+@click.argument("kind", type=click.Choice(["scrape", "parse"]))
+@click.option("--run", "run_id", default=None, help="run id, the latest run by default")
+@click.option("--format", "output_format", type=click.Choice(["json", "prometheus"]), default="json")
+def main(kind, run_id, output_format):
+    run = load_run(kind, run_id)
+    if run is None:
+        raise click.ClickException(f"no saved {kind} metrics")
+    if output_format == "prometheus":
+        click.echo(to_prometheus(run), nl=False)
+    else:
+        click.echo(json.dumps(run, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,52 @@
 from collections import Counter, defaultdict
-from datetime import datetime
+from datetime import datetime, timedelta
+import hashlib
+import json
+import os
 import time
+from typing import Optional
 
+import click
 from pytz import timezone
 from copy import deepcopy
+from functools import cached_property
 
 from common import hex_to_rgb, url_to_id, xy_to_sheet
 from scrape import (
-    get_or_set_player_badge_count,
+    JSON_DIR,
+    BadgeCountResolver,
     get_player_tags_urls_list,
     get_duplicate_dict_from_sheet,
     get_banned_tournament_ids,
     get_player_swapper_dict,
+    get_ranking_periods,
+    use_sheet_snapshot,
 )
 import gspread
 from gspread_formatting import *
-from database import getj
-from encryption import get_service_account_file_path
+from database import decode, getj, r, setj
+from h2h import H2HMatrix
+from metrics import METRICS, profiled, recorded_run
+from identity import IdentityIndex
+from sheet_writer import LocalSpreadsheet, SheetBatch, forget_sheet_state
+from views import (
+    META_VIEW,
+    PLAYERS_VIEW,
+    ROSTERS_VIEW,
+    TOURNAMENTS_VIEW,
+    player_view_name,
+    publish_views,
+)
+from snapshot import (
+    BADGE_COUNTS_KEY,
+    COPY_BADGE_COUNT_KEY,
+    SHEET_KEY,
+    SnapshotReader,
+    latest_snapshot,
+)
+from setstore import LOSER_SEEN, NO_SCORE, WINNER_SEEN, DateIndex, SetStore, to_epoch
+from windows import CUT_OFF_DATE_END, CUT_OFF_DATE_START, RankingPeriod, RankingWindows
+from encryption import get_service_account_info
 
 
 from loguru import logger
@@ -24,8 +54,6 @@ from loguru import logger
 # These are the sheets that we want to create if they don't exist
 DESIRED_SHEETS = ["wins", "losses", "h2h", "meta", "tournaments considered"]
 
-gc = gspread.service_account(filename=get_service_account_file_path())
-
 # color schemes
 bad = Color(*hex_to_rgb("#FF8696"))
 badbad = Color(*hex_to_rgb("#FF3333"))
@@ -34,43 +62,138 @@ goodgood = Color(*hex_to_rgb("#00CC00"))
 equal = Color(0.988, 0.91, 0.698)
 
 # TODO: don't hardcode the sheet name value
-logger.info("creating sheets if nonexistent")
-relevant_doc = gc.open("Current Norcal PR Data")
-present_titles = [w.title for w in relevant_doc.worksheets()]
-for sheet_name in DESIRED_SHEETS:
-    if sheet_name not in present_titles:
-        relevant_doc.add_worksheet(title=sheet_name, rows=200, cols=200)
-        logger.info(f"created sheet {sheet_name}")
-    else:
-        logger.info(f"found sheet {sheet_name}")
-
-# Open a sheet from a spreadsheet in one go
-wins_sheet = relevant_doc.worksheet("wins")
-losses_sheet = relevant_doc.worksheet("losses")
-h2h_sheet = relevant_doc.worksheet("h2h")
-meta_sheet = relevant_doc.worksheet("meta")
-tournaments_considered_sheet = relevant_doc.worksheet("tournaments considered")
-
-
-CUT_OFF_DATE_START = datetime(2024, 1, 1)
-CUT_OFF_DATE_END = datetime(2024, 7, 1)
+OUTPUT_DOC_NAME = "Current Norcal PR Data"
+
+
+class RunContext:
+    """
+    the api clients and sheet lookups a parse run needs.
+    nothing is downloaded or authenticated until a property is first used,
+    so importing this module does no network i/o. a dry run writes to an
+    in-memory spreadsheet instead of the output doc
+    """
+
+    def __init__(self):
+        self.dry_run = False
+
+    @cached_property
+    def gc(self) -> gspread.Client:
+        return gspread.service_account_from_dict(get_service_account_info())
+
+    @cached_property
+    def doc(self) -> gspread.Spreadsheet:
+        if self.dry_run:
+            return LocalSpreadsheet(DESIRED_SHEETS)
+        logger.info("creating sheets if nonexistent")
+        relevant_doc = self.gc.open(OUTPUT_DOC_NAME)
+        present_titles = [w.title for w in relevant_doc.worksheets()]
+        for sheet_name in DESIRED_SHEETS:
+            if sheet_name not in present_titles:
+                relevant_doc.add_worksheet(title=sheet_name, rows=200, cols=200)
+                logger.info(f"created sheet {sheet_name}")
+            else:
+                logger.info(f"found sheet {sheet_name}")
+        return relevant_doc
+
+    @cached_property
+    def worksheets(self) -> dict:
+        return {title: self.doc.worksheet(title) for title in DESIRED_SHEETS}
+
+    @cached_property
+    def batch(self) -> SheetBatch:
+        """every sheet write of the run, sent together by flush()"""
+        return SheetBatch(self.doc, saved_state=not self.dry_run)
+
+    def start_run(self, dry_run: bool = False) -> None:
+        """forget what belongs to the last run, keep the authenticated clients"""
+        names = ["batch", "identity"]
+        if dry_run != self.dry_run:
+            names += ["doc", "worksheets"]
+        self.dry_run = dry_run
+        for name in names:
+            self.__dict__.pop(name, None)
+
+    @cached_property
+    def identity(self) -> IdentityIndex:
+        """bans, swaps and duplicate accounts from the input sheet"""
+        return IdentityIndex(
+            banned_tournament_ids=get_banned_tournament_ids(),
+            swaps=get_player_swapper_dict(),
+            duplicate_of=get_duplicate_dict_from_sheet(),
+        )
+
+
+_CONTEXT = None
+
+
+def get_context() -> RunContext:
+    global _CONTEXT
+    if _CONTEXT is None:
+        _CONTEXT = RunContext()
+    return _CONTEXT
+
+
+def worksheet(title: str) -> gspread.Worksheet:
+    return get_context().worksheets[title]
+
+
+# besides the periods tab, records are also kept for the last N days
+ROLLING_WINDOW_DAYS = [90, 180, 365]
 
 PLAYER_TO_WINS = defaultdict(Counter)
 PLAYER_TO_LOSSES = defaultdict(Counter)
 PLAYERS_SETS = defaultdict(set)
 P2P_GAME_COUNTS = defaultdict(lambda: [0, 0])
-ALL_SETS_EVER = dict()
+SET_STORE = SetStore()
+# parsed start times, and every sheeted player's tournaments in date order
+DATE_INDEX = DateIndex()
+RANKING_WINDOWS = None
+# the SET_STORE rows of the period being published, by date
+WINDOW_ROWS = None
+WINDOW_PLAYER_IDS = set()
 TOURNAMENT_INFOS = dict()
 TOURNAMENT_ATTENDEES_SHEETED = defaultdict(set)
 PLAYER_TOURNAMENT_BEST_STANDING = defaultdict(lambda: 999999999)
 ID_TO_NAME = {}
+SHEET_PLAYER_IDS = set()
 ID_TO_NUM_TOURNAMENTS = defaultdict(int)
 ID_TO_NUM_TOTAL_SETS = defaultdict(int)
 trny_history_strs = defaultdict(list)
 UNIQUE_SET_COUNT = 0
-
-BANNED_TOURNAMENT_IDS = get_banned_tournament_ids()
-PLAYER_SWAPPER_DICT = get_player_swapper_dict()
+BADGE_COUNTS = BadgeCountResolver()
+
+# the ingested sets, kept between runs so a run only ingests tournaments it hasn't seen
+PARSE_STATE_KEY = "parse:state"
+# bump whenever the saved state can't be read by the new code
+PARSE_STATE_VERSION = 1
+
+
+def reset_run_state(dry_run: bool = False) -> None:
+    """empty every aggregate above, so a long-running process can parse again"""
+    global SET_STORE, DATE_INDEX, RANKING_WINDOWS, WINDOW_ROWS, UNIQUE_SET_COUNT, BADGE_COUNTS
+    for aggregate in [
+        PLAYER_TO_WINS,
+        PLAYER_TO_LOSSES,
+        PLAYERS_SETS,
+        P2P_GAME_COUNTS,
+        WINDOW_PLAYER_IDS,
+        TOURNAMENT_INFOS,
+        TOURNAMENT_ATTENDEES_SHEETED,
+        PLAYER_TOURNAMENT_BEST_STANDING,
+        ID_TO_NAME,
+        SHEET_PLAYER_IDS,
+        ID_TO_NUM_TOURNAMENTS,
+        ID_TO_NUM_TOTAL_SETS,
+        trny_history_strs,
+    ]:
+        aggregate.clear()
+    SET_STORE = SetStore()
+    DATE_INDEX = DateIndex()
+    RANKING_WINDOWS = None
+    WINDOW_ROWS = None
+    UNIQUE_SET_COUNT = 0
+    BADGE_COUNTS = BadgeCountResolver()
+    get_context().start_run(dry_run)
 
 
 def add_tag(player_id: str, tag: str):
@@ -83,9 +206,6 @@ def add_tag(player_id: str, tag: str):
         ID_TO_NAME[player_id] = tag
 
 
-COMBINE_LOOKUP = get_duplicate_dict_from_sheet()
-
-
 def player_to_player_history(player_id, opponent_id):
     results = getj(f"{player_id}:results")
 
@@ -93,15 +213,13 @@ def player_to_player_history(player_id, opponent_id):
 def is_valid_tournament(
     tournament: dict, CUT_OFF_DATE_START: datetime, CUT_OFF_DATE_END: datetime
 ) -> bool:
-    if tournament["info"]["id"] in BANNED_TOURNAMENT_IDS:
+    if get_context().identity.is_banned(tournament["info"]["id"]):
         logger.info(f"banned tournament found, skipping {tournament['info']['id']}")
         return False
     if tournament["info"].get("online"):
         return False
-    start_time = tournament["info"]["start_time"]
-    # parse date
-    date = datetime.strptime(start_time, "%Y-%m-%dT%H:%M:%S")
-    if date < CUT_OFF_DATE_START or date > CUT_OFF_DATE_END:
+    date = DATE_INDEX.epoch(tournament["info"])
+    if date < to_epoch(CUT_OFF_DATE_START) or date > to_epoch(CUT_OFF_DATE_END):
         return False
     return True
 
@@ -112,119 +230,107 @@ def rewrite_ids(set_data: dict) -> dict:
     or players entering brackets under someone else's account
     """
 
+    identity = get_context().identity
     for key in ["p1_id", "p2_id", "winner_id"]:
-        if set_data[key] in COMBINE_LOOKUP:
-            set_data[key] = COMBINE_LOOKUP[set_data[key]]
-        set_data[key] = player_at_tournament_swap(set_data["event_id"], set_data[key])
+        set_data[key] = identity.resolve(set_data["event_id"], set_data[key])
     return set_data
 
 
-def player_at_tournament_swap(tournament_id, player_id):
-    swaps_at_tournament = PLAYER_SWAPPER_DICT.get(tournament_id, [])
-    for swap in swaps_at_tournament:
-        if swap[0] == player_id:
-            print("SWAPPING", player_id, "TO", swap[1])
-            return swap[1]
-    return player_id
-
-
 def parse_tournament(tournament: dict, player_id=None) -> None:
-    # collect all wins and losses
+    """add a tournament's sets to SET_STORE as seen by the sheeted player `player_id`"""
+    player_id = get_context().identity.canonical(player_id)
+    t_id = tournament["info"]["id"]
+    SET_STORE.add_tournament(player_id, tournament["info"], DATE_INDEX.epoch(tournament["info"]))
     for set_data in tournament["sets"]:
-        if player_id in COMBINE_LOOKUP:
-            player_id = COMBINE_LOOKUP[player_id]
-        set_data = rewrite_ids(deepcopy(set_data))
-        add_tag(set_data["p1_id"], set_data["p1_tag"])
-        add_tag(set_data["p2_id"], set_data["p2_tag"])
-        get_or_set_player_badge_count(set_data["p1_id"])
-        get_or_set_player_badge_count(set_data["p2_id"])
-        if tournament["info"]["tournament_name"] is not None:
-            short_trny = tournament["info"]["tournament_name"][:50]
-        else:
-            short_trny = "unknown"
-        TOURNAMENT_INFOS[tournament["info"]["id"]] = tournament["info"]
-        t_id = tournament["info"]["id"]
-        winner_id = set_data["winner_id"]
-        loser_id = (
-            set([set_data["p1_id"], set_data["p2_id"]]) - set([set_data["winner_id"]])
-        ).pop()
-        if set_data["p1_score"] is None or set_data["p2_score"] is None:
-            winner_score, loser_score = "?", "?"
-        else:
-            winner_score = max(set_data["p1_score"], set_data["p2_score"])
-            loser_score = min(set_data["p1_score"], set_data["p2_score"])
-        PLAYER_TOURNAMENT_BEST_STANDING[(t_id, set_data["p1_id"])] = min(
-            PLAYER_TOURNAMENT_BEST_STANDING[(t_id, set_data["p1_id"])],
-            set_data["p1_standing"],
+        key = (t_id, set_data["id"])
+        if key not in SET_STORE:
+            set_data = rewrite_ids(deepcopy(set_data))
+            add_tag(set_data["p1_id"], set_data["p1_tag"])
+            add_tag(set_data["p2_id"], set_data["p2_tag"])
+        if not SET_STORE.add_set(key, set_data, player_id):
+            logger.error("unknown result, no valid winner_id found")
+            logger.info(set_data)
+
+
+def aggregate_sets(start: datetime, end: datetime) -> None:
+    """
+    derive wins, losses, game counts, histories and standings from the
+    SET_STORE sets in [start, end]. every unique set is processed once,
+    no matter how many sheeted players played in it
+    """
+    global UNIQUE_SET_COUNT, WINDOW_ROWS
+    store = SET_STORE
+    player_ids = store.players
+    now = datetime.now()
+    tournament_strs = dict()
+    WINDOW_ROWS = RANKING_WINDOWS.rows_between(start, end)
+    start_ts, end_ts = to_epoch(start), to_epoch(end)
+    for player, attended in store.player_tournaments.items():
+        ID_TO_NUM_TOURNAMENTS[player_ids[player]] = sum(
+            start_ts <= store.tournament_dates[t_idx] <= end_ts for t_idx in attended
+        )
+    for row in WINDOW_ROWS:
+        t_idx = store.tournament[row]
+        t_id = store.tournaments[t_idx]
+        TOURNAMENT_INFOS[t_id] = store.tournament_infos[t_idx]
+        winner_id = player_ids[store.winner[row]]
+        loser_id = player_ids[store.loser[row]]
+        WINDOW_PLAYER_IDS.update((winner_id, loser_id))
+        PLAYER_TOURNAMENT_BEST_STANDING[(t_id, winner_id)] = min(
+            PLAYER_TOURNAMENT_BEST_STANDING[(t_id, winner_id)],
+            store.winner_standing[row],
         )
-        PLAYER_TOURNAMENT_BEST_STANDING[(t_id, set_data["p2_id"])] = min(
-            PLAYER_TOURNAMENT_BEST_STANDING[(t_id, set_data["p2_id"])],
-            set_data["p2_standing"],
+        PLAYER_TOURNAMENT_BEST_STANDING[(t_id, loser_id)] = min(
+            PLAYER_TOURNAMENT_BEST_STANDING[(t_id, loser_id)],
+            store.loser_standing[row],
         )
         logger.debug(f"{ID_TO_NAME[winner_id]} beats {ID_TO_NAME[loser_id]}")
-        if set_data["dq"]:
+        if store.dq[row]:
             logger.info(
-                f'dq found, skipping {set_data["p1_tag"]} vs {set_data["p2_tag"]}'
+                f"dq found, skipping {ID_TO_NAME[winner_id]} vs {ID_TO_NAME[loser_id]}"
             )
             continue
-        ID_TO_NUM_TOTAL_SETS[player_id] += 1
-        set_identifier = (
-            f"{winner_id}-{loser_id}-{tournament['info']['id']}-{set_data['id']}"
-        )
-        set_seen_before = set_identifier in ALL_SETS_EVER
-        ALL_SETS_EVER[set_identifier] = set_data
-        if not set_seen_before:
-            global UNIQUE_SET_COUNT
-            UNIQUE_SET_COUNT += 1
-            # add the game counts
-            try:
-                P2P_GAME_COUNTS[(winner_id, loser_id)][0] += int(winner_score)
-                P2P_GAME_COUNTS[(loser_id, winner_id)][1] += int(winner_score)
-                P2P_GAME_COUNTS[(winner_id, loser_id)][1] += int(loser_score)
-                P2P_GAME_COUNTS[(loser_id, winner_id)][0] += int(loser_score)
-            except ValueError:
-                logger.error(f"invalid score found: {winner_score}-{loser_score}")
-        t_date = datetime.strptime(
-            tournament["info"]["start_time"], "%Y-%m-%dT%H:%M:%S"
-        )
-        ymd = t_date.strftime("%Y-%m-%d")
-        days_ago = (datetime.now() - t_date).days
-
-        if winner_id == player_id:
-            # player won
-            PLAYER_TO_WINS[player_id][loser_id] += 1
-            trny_history_strs[(player_id, loser_id)].append(
-                f"win {winner_score}-{loser_score} at {short_trny} {ymd} ({days_ago}d) [{t_id}]\n\n"
+        UNIQUE_SET_COUNT += 1
+        # add the game counts
+        if store.winner_score[row] == NO_SCORE:
+            winner_score, loser_score = "?", "?"
+            logger.error(f"invalid score found: {winner_score}-{loser_score}")
+        else:
+            winner_score = store.winner_score[row]
+            loser_score = store.loser_score[row]
+            P2P_GAME_COUNTS[(winner_id, loser_id)][0] += winner_score
+            P2P_GAME_COUNTS[(loser_id, winner_id)][1] += winner_score
+            P2P_GAME_COUNTS[(winner_id, loser_id)][1] += loser_score
+            P2P_GAME_COUNTS[(loser_id, winner_id)][0] += loser_score
+        if t_idx not in tournament_strs:
+            tournament_info = store.tournament_infos[t_idx]
+            if tournament_info["tournament_name"] is not None:
+                short_trny = tournament_info["tournament_name"][:50]
+            else:
+                short_trny = "unknown"
+            t_date = datetime(1970, 1, 1) + timedelta(seconds=store.date[row])
+            ymd = t_date.strftime("%Y-%m-%d")
+            days_ago = (now - t_date).days
+            tournament_strs[t_idx] = f"at {short_trny} {ymd} ({days_ago}d) [{t_id}]"
+        at_trny = tournament_strs[t_idx]
+
+        if store.seen[row] & WINNER_SEEN:
+            # sheeted player won
+            ID_TO_NUM_TOTAL_SETS[winner_id] += 1
+            PLAYER_TO_WINS[winner_id][loser_id] += 1
+            trny_history_strs[(winner_id, loser_id)].append(
+                f"win {winner_score}-{loser_score} {at_trny}\n\n"
             )
-            PLAYERS_SETS[frozenset((winner_id, loser_id))].add(set_identifier)
+            PLAYERS_SETS[frozenset((winner_id, loser_id))].add(row)
             TOURNAMENT_ATTENDEES_SHEETED[t_id].add(winner_id)
-
-        elif loser_id == player_id:
-            # player lost
-            PLAYER_TO_LOSSES[player_id][winner_id] += 1
-            trny_history_strs[(player_id, winner_id)].append(
-                f"loss {loser_score}-{winner_score} at {short_trny} {ymd} ({days_ago}d) [{t_id}]\n\n"
+        if store.seen[row] & LOSER_SEEN:
+            # sheeted player lost
+            ID_TO_NUM_TOTAL_SETS[loser_id] += 1
+            PLAYER_TO_LOSSES[loser_id][winner_id] += 1
+            trny_history_strs[(loser_id, winner_id)].append(
+                f"loss {loser_score}-{winner_score} {at_trny}\n\n"
             )
             TOURNAMENT_ATTENDEES_SHEETED[t_id].add(loser_id)
-        else:
-            logger.error("unknown result, no valid winner_id found")
-            logger.info(set_data)
-    ID_TO_NUM_TOURNAMENTS[player_id] += 1
-
-
-def clear_and_update_notes(cur_sheet, range_: str, notes_to_add: dict) -> None:
-    logger.info(f"updating notes for {range_} on {cur_sheet}")
-    if notes_to_add:
-        logger.info(f"clearing notes f{range_}")
-        try:
-            cur_sheet.clear_notes(range_)
-        except Exception as e:
-            logger.error(e)
-        logger.info("updating notes")
-        try:
-            cur_sheet.update_notes(notes_to_add)
-        except Exception as e:
-            logger.error(e)
 
 
 def get_h2h_record_str(player_id, opponent_id) -> str:
@@ -243,11 +349,12 @@ def leftmost_colum_gen(player_id) -> str:
     return f"{pname} ({set_count}s | {trny_count}t)"
 
 
-def write_wins_and_losses_to_sheet():
+def write_wins_and_losses_to_sheet(notes: dict):
+    """the wins and losses sheets, with `notes` from pvp_notes()"""
     def sorted_opponent_ids(player_id, sets, rev_good_bad_order=False) -> str:
         for opponent_id, count in sorted(
             sets.items(),
-            key=lambda x: get_or_set_player_badge_count(x[0]),
+            key=lambda x: BADGE_COUNTS.get(x[0]),
             reverse=not rev_good_bad_order,
         ):
             yield opponent_id
@@ -256,18 +363,15 @@ def write_wins_and_losses_to_sheet():
         for opponent_id in opponent_ids:
             yield f"{get_h2h_record_str(player_id, opponent_id)} {ID_TO_NAME[opponent_id]}"
 
-    def apply_formatting_win_loss(
-        cur_sheet, res_array_2d, results_dict, notes_to_add: dict = {}
-    ):
-        rules = get_conditional_format_rules(cur_sheet)
+    def apply_formatting_win_loss(cur_sheet, res_array_2d, results_dict):
+        rules = []
         # results cells
-        set_column_width(cur_sheet, "B:BB", 80)
+        batch.set_column_width(cur_sheet, "B:BB", 80)
         # player name on the left
-        set_column_width(cur_sheet, "A:A", 200)
+        batch.set_column_width(cur_sheet, "A:A", 200)
         # records are `L-R` i.e. 2-3
         L = 'INDEX(SPLIT(B1, " - "), 1)'
         R = 'INDEX(SPLIT(INDEX(SPLIT(B1, " - "), 2)," "),1)'
-        rules.clear()
         formula_colors = [
             (f"=AND({L} < {R}, ({R} - {L} >= 2))", badbad),
             (f"=AND({L} < {R}, ({R} - {L} <  2))", bad),
@@ -279,7 +383,7 @@ def write_wins_and_losses_to_sheet():
         bottom_right = xy_to_sheet(
             len(results_dict) - 1, max([len(x) for x in res_array_2d]) - 1
         )
-        cur_sheet.format(f"A1:{bottom_right}", {"wrapStrategy": "clip"})
+        batch.format(cur_sheet, f"A1:{bottom_right}", {"wrapStrategy": "CLIP"})
         for formula, color in formula_colors:
             rule = ConditionalFormatRule(
                 ranges=[
@@ -292,17 +396,19 @@ def write_wins_and_losses_to_sheet():
             )
             rules.append(rule)
 
-        cur_sheet.freeze(cols=1)
-        rules.save()
-        clear_and_update_notes(cur_sheet, f":{top_left}:{bottom_right}", notes_to_add)
+        batch.freeze(cur_sheet, cols=1)
+        batch.set_conditional_format_rules(cur_sheet, rules)
 
+    batch = get_context().batch
+    wins_sheet = worksheet("wins")
+    losses_sheet = worksheet("losses")
     res_array_2d = []
     # WINS
     win_notes = {}
     for yidx, (player_id, wins) in enumerate(
         sorted(
             PLAYER_TO_WINS.items(),
-            key=lambda x: get_or_set_player_badge_count(x[0]),
+            key=lambda x: BADGE_COUNTS.get(x[0]),
             reverse=True,
         )
     ):
@@ -311,13 +417,10 @@ def write_wins_and_losses_to_sheet():
             wins_losses_to_string(player_id, opponents)
         )
         for xidx, opponent_id in enumerate(opponents):
-            win_notes[xy_to_sheet(yidx, xidx + 1)] = get_pvp_note_str(
-                player_id, opponent_id
-            )
+            win_notes[xy_to_sheet(yidx, xidx + 1)] = notes[player_id, opponent_id]
         res_array_2d.append(cur)
-    wins_sheet.clear()
-    wins_sheet.update("A1", res_array_2d)
-    apply_formatting_win_loss(wins_sheet, res_array_2d, PLAYER_TO_WINS, win_notes)
+    batch.write_grid(wins_sheet, res_array_2d, win_notes)
+    apply_formatting_win_loss(wins_sheet, res_array_2d, PLAYER_TO_WINS)
 
     # LOSSES
     loss_notes = {}
@@ -325,7 +428,7 @@ def write_wins_and_losses_to_sheet():
     for yidx, (player_id, losses) in enumerate(
         sorted(
             PLAYER_TO_LOSSES.items(),
-            key=lambda x: get_or_set_player_badge_count(x[0]),
+            key=lambda x: BADGE_COUNTS.get(x[0]),
             reverse=True,
         )
     ):
@@ -334,83 +437,141 @@ def write_wins_and_losses_to_sheet():
             wins_losses_to_string(player_id, opponents)
         )
         for xidx, opponent_id in enumerate(opponents):
-            loss_notes[xy_to_sheet(yidx, xidx + 1)] = get_pvp_note_str(
-                player_id, opponent_id
-            )
+            loss_notes[xy_to_sheet(yidx, xidx + 1)] = notes[player_id, opponent_id]
         res_array_2d.append(cur)
-    losses_sheet.clear()
-    losses_sheet.update("A1", res_array_2d)
-    apply_formatting_win_loss(losses_sheet, res_array_2d, PLAYER_TO_LOSSES, loss_notes)
-
-
-def parse_good_player(player_id: str) -> None:
-    player_tournaments = getj(f"{player_id}:results")
-
-    def data_to_start_time(data):
-        return datetime.strptime(data["info"]["start_time"], "%Y-%m-%dT%H:%M:%S")
-
-    for tournament_id, tournament_data in sorted(
-        player_tournaments.items(), key=lambda x: data_to_start_time(x[1])
-    ):
+    batch.write_grid(losses_sheet, res_array_2d, loss_notes)
+    apply_formatting_win_loss(losses_sheet, res_array_2d, PLAYER_TO_LOSSES)
+
+
+def parse_good_player(
+    player_id: str,
+    start: datetime = CUT_OFF_DATE_START,
+    end: datetime = CUT_OFF_DATE_END,
+    player_tournaments: Optional[dict] = None,
+) -> None:
+    """ingest a sheeted player's results, read from redis unless already loaded"""
+    if player_tournaments is None:
+        player_tournaments = getj(f"{player_id}:results")
+    if player_tournaments is None:
+        logger.error(f"no results stored for {player_id}, skipping")
+        return
+
+    DATE_INDEX.index_player(player_id, player_tournaments)
+    canonical_id = get_context().identity.canonical(player_id)
+    for tournament_id in DATE_INDEX.between(player_id, to_epoch(start), to_epoch(end)):
+        tournament_data = player_tournaments[tournament_id]
         info = tournament_data["info"]
-        if not is_valid_tournament(
-            tournament_data, CUT_OFF_DATE_START, CUT_OFF_DATE_END
-        ):
+        if already_ingested(canonical_id, tournament_data):
+            continue
+        if not is_valid_tournament(tournament_data, start, end):
             continue
         logger.info(f"adding tournament {info['tournament_name']}")
+        METRICS.inc("tournaments_ingested_total")
         parse_tournament(tournament_data, player_id)
 
 
+def already_ingested(player_id: str, tournament: dict) -> bool:
+    """whether an earlier run (see load_parse_state) ingested every set of this tournament for the player"""
+    t_id = tournament["info"]["id"]
+    return SET_STORE.attended(player_id, t_id) and all(
+        (t_id, set_data["id"]) in SET_STORE for set_data in tournament["sets"]
+    )
+
+
 def get_pvp_note_str(player_id, opponent_id):
-    won_games, lost_games = P2P_GAME_COUNTS[(player_id, opponent_id)]
+    won_games, lost_games = P2P_GAME_COUNTS.get((player_id, opponent_id), (0, 0))
     if won_games == 0 and lost_games == 0:
         return ""
     player_name = ID_TO_NAME[player_id].upper()
     opponent_name = ID_TO_NAME[opponent_id]
-    total_sets_between = (PLAYER_TO_WINS[player_id][opponent_id]) + (
-        PLAYER_TO_LOSSES[player_id][opponent_id]
-    )
+    # only .get: notes are built before the sheets, and must not give them empty rows
+    wins = PLAYER_TO_WINS.get(player_id, Counter())[opponent_id]
+    losses = PLAYER_TO_LOSSES.get(player_id, Counter())[opponent_id]
     out = f"{player_name} vs {opponent_name} "
-    out += f"({get_h2h_record_str(player_id, opponent_id)})"
-    out += f"\ngame count: {won_games}-{lost_games} in {total_sets_between} sets\n\n"
+    out += f"({wins}-{losses})"
+    out += f"\ngame count: {won_games}-{lost_games} in {wins + losses} sets\n\n"
+    out += f"""{"".join(trny_history_strs.get((player_id, opponent_id), [])[::-1])}""".strip()
+    return out
+
+
+def pvp_notes() -> dict:
+    """{(player id, opponent id): note} for every cell of the wins and losses sheets"""
+    return {
+        (player_id, opponent_id): get_pvp_note_str(player_id, opponent_id)
+        for records in (PLAYER_TO_WINS, PLAYER_TO_LOSSES)
+        for player_id, opponents in records.items()
+        for opponent_id in opponents
+    }
+
+
+def h2h_note_str(matrix: H2HMatrix, i: int, j: int) -> str:
+    """get_pvp_note_str, read from an h2h matrix"""
+    won_games, lost_games = matrix.games(i, j)
+    if won_games == 0 and lost_games == 0:
+        return ""
+    player_id, opponent_id = matrix.player_ids[i], matrix.player_ids[j]
+    wins, losses = matrix.record(i, j)
+    out = f"{ID_TO_NAME[player_id].upper()} vs {ID_TO_NAME[opponent_id]} "
+    out += f"({wins}-{losses})"
+    out += f"\ngame count: {won_games}-{lost_games} in {wins + losses} sets\n\n"
     out += f"""{"".join(trny_history_strs[player_id, opponent_id][::-1])}""".strip()
     return out
 
 
-def write_h2h_to_sheet():
+def h2h_player_list() -> list[str]:
+    """the h2h sheet's rows (and columns), most badges first"""
     player_list = [
         url_to_id(x[1]) for x in get_player_tags_urls_list(include_duplicates=False)
     ]
-    player_list = sorted(
+    return sorted(
         player_list,
-        key=get_or_set_player_badge_count,
+        key=BADGE_COUNTS.get,
         reverse=True,
     )
+
+
+def build_h2h_matrix(player_list: list[str]) -> H2HMatrix:
+    """all counts in one pass over the window's sets"""
+    return H2HMatrix.from_store(
+        SET_STORE, list(dict.fromkeys(player_list)), rows=WINDOW_ROWS
+    )
+
+
+def h2h_notes(matrix: H2HMatrix) -> dict:
+    """{(i, j): note} for every matrix cell with a set behind it"""
+    return {(i, j): h2h_note_str(matrix, i, j) for i, j in matrix.nonempty_cells()}
+
+
+def write_h2h_to_sheet(player_list: list[str], matrix: H2HMatrix, notes: dict):
+    """the h2h sheet, with `notes` from h2h_notes(). only cells that have sets are touched"""
+    batch = get_context().batch
+    h2h_sheet = worksheet("h2h")
     top_left = "B2"
     bottom_right = xy_to_sheet(len(player_list), len(player_list))
+    # matrix position -> the sheet row/column(s) that player occupies
+    sheet_positions = defaultdict(list)
+    for idx, player_id in enumerate(player_list):
+        sheet_positions[matrix.position[player_id]].append(idx)
+    names = [ID_TO_NAME[player_id] for player_id in player_list]
+    res_array_2d = [[""] + names]
+    res_array_2d += [[name] + [""] * len(player_list) for name in names]
     notes_to_add = {}
-    res_array_2d = []
-    res_array_2d.append([""] + [ID_TO_NAME[player_id] for player_id in player_list])
-    for yidx, main_player in enumerate(player_list):
-        row = [ID_TO_NAME[main_player]]
-        for xidx, opponent in enumerate(player_list):
-            h2h_str = get_h2h_record_str(main_player, opponent)
-            if h2h_str == "0-0":
-                h2h_str = ""
-            row.append(h2h_str)
-            notes_to_add[xy_to_sheet(yidx + 1, xidx + 1)] = get_pvp_note_str(
-                main_player, opponent
-            )
-        res_array_2d.append(row)
-    h2h_sheet.clear()
-    h2h_sheet.update("A1", res_array_2d)
-    h2h_sheet.freeze(rows=1, cols=1)
+    for i, j in matrix.nonempty_cells():
+        wins, losses = matrix.record(i, j)
+        note = notes[i, j]
+        for yidx in sheet_positions[i]:
+            for xidx in sheet_positions[j]:
+                if wins or losses:
+                    res_array_2d[yidx + 1][xidx + 1] = f"{wins}-{losses}"
+                if note:
+                    notes_to_add[xy_to_sheet(yidx + 1, xidx + 1)] = note
+    batch.write_grid(h2h_sheet, res_array_2d, notes_to_add)
+    batch.freeze(h2h_sheet, rows=1, cols=1)
 
     # --- Formatting  ---
 
-    rules = get_conditional_format_rules(h2h_sheet)
-    set_column_width(h2h_sheet, "A:BB", 40)
-    rules.clear()
+    rules = []
+    batch.set_column_width(h2h_sheet, "A:BB", 40)
     L = 'INDEX(SPLIT(B2, " - "), 1)'
     R = 'INDEX(SPLIT(B2, " - "), 2)'
     formula_colors = [
@@ -431,8 +592,7 @@ def write_h2h_to_sheet():
             ),
         )
         rules.append(rule)
-    rules.save()
-    clear_and_update_notes(h2h_sheet, f":{top_left}:{bottom_right}", notes_to_add)
+    batch.set_conditional_format_rules(h2h_sheet, rules)
 
 
 def write_meta_to_sheet():
@@ -442,13 +602,14 @@ def write_meta_to_sheet():
     updated_time = sa_time.strftime("%Y-%m-%d %I:%M:%S %p")
     update_string = f"last updated {updated_time}"
     vals.append(update_string)
-    vals.append(f"total number of players: {len(ID_TO_NAME)}")
+    vals.append(f"total number of players: {len(SHEET_PLAYER_IDS | WINDOW_PLAYER_IDS)}")
     vals.append(f"total sets considered: {UNIQUE_SET_COUNT}")
-    meta_sheet.update("A1", [vals])
+    get_context().batch.update(worksheet("meta"), "A1", [vals])
     logger.info(f"successfully updated sheet at {updated_time}")
 
 
-def write_tournament_info_to_sheet():
+def tournament_rows() -> list[list]:
+    """the tournaments considered table, header first, newest tournament first"""
     columns = [
         "start_time",
         "tournament_name",
@@ -460,6 +621,8 @@ def write_tournament_info_to_sheet():
     ]
     vals = [columns]
     for trny_info in sorted(TOURNAMENT_INFOS.values(), key=lambda t: t["start_time"], reverse=True):
+        # a copy: the info in SET_STORE is saved for the next run as it came from pgstats
+        trny_info = dict(trny_info)
         tournament_id = trny_info["id"]
         attendees = TOURNAMENT_ATTENDEES_SHEETED[tournament_id]
 
@@ -482,33 +645,369 @@ def write_tournament_info_to_sheet():
         for key in columns:
             inner_val.append(trny_info.get(key, ""))
         vals.append(inner_val)
-    from pprint import pprint
+    return vals
+
+
+def write_tournament_info_to_sheet():
+    vals = tournament_rows()
+    get_context().batch.write_grid(worksheet("tournaments considered"), vals)
+
+
+def player_view(player_id: str) -> dict:
+    """a player's records, game counts and set history against everyone they played"""
+    wins = PLAYER_TO_WINS.get(player_id, Counter())
+    losses = PLAYER_TO_LOSSES.get(player_id, Counter())
+    opponents = dict()
+    for opponent_id in list(wins) + [o for o in losses if o not in wins]:
+        won_games, lost_games = P2P_GAME_COUNTS.get((player_id, opponent_id), (0, 0))
+        history = trny_history_strs.get((player_id, opponent_id), [])
+        opponents[opponent_id] = dict(
+            name=ID_TO_NAME[opponent_id],
+            wins=wins[opponent_id],
+            losses=losses[opponent_id],
+            games=[won_games, lost_games],
+            # newest first, like the sheet notes
+            history=[line.strip() for line in reversed(history)],
+        )
+    return dict(
+        id=player_id,
+        name=ID_TO_NAME.get(player_id, player_id),
+        wins=sum(wins.values()),
+        losses=sum(losses.values()),
+        tournaments=ID_TO_NUM_TOURNAMENTS.get(player_id, 0),
+        opponents=opponents,
+        # opponent ids in the order of the wins and losses sheets
+        beat=sorted(wins, key=BADGE_COUNTS.get, reverse=True),
+        lost_to=sorted(losses, key=BADGE_COUNTS.get),
+    )
+
+
+def build_views(period: RankingPeriod) -> dict:
+    """everything the sheet shows, as {name: view} for ui.py and api.py"""
+    sheet_players = [
+        url_to_id(x[1]) for x in get_player_tags_urls_list(include_duplicates=False)
+    ]
+    sheet_players = list(dict.fromkeys(sorted(sheet_players, key=BADGE_COUNTS.get, reverse=True)))
+    player_ids = sheet_players + [
+        player_id
+        for player_id in list(PLAYER_TO_WINS) + list(PLAYER_TO_LOSSES)
+        if player_id not in sheet_players
+    ]
+    players = {player_id: player_view(player_id) for player_id in dict.fromkeys(player_ids)}
+    header, *rows = tournament_rows()
+    views = {player_view_name(player_id): view for player_id, view in players.items()}
+    views[PLAYERS_VIEW] = [
+        {key: players[player_id][key] for key in ["id", "name", "wins", "losses", "tournaments"]}
+        for player_id in sheet_players
+    ]
+    views[TOURNAMENTS_VIEW] = [dict(zip(header, row)) for row in rows]
+    views[ROSTERS_VIEW] = dict()
+    for tournament_id, attendees in TOURNAMENT_ATTENDEES_SHEETED.items():
+        standings = [
+            (PLAYER_TOURNAMENT_BEST_STANDING[(tournament_id, player_id)], player_id)
+            for player_id in attendees
+        ]
+        views[ROSTERS_VIEW][tournament_id] = [
+            dict(id=player_id, name=ID_TO_NAME[player_id], standing=standing)
+            for standing, player_id in sorted(standings)
+        ]
+    views[META_VIEW] = dict(
+        period=period.name,
+        start=period.start.isoformat(),
+        end=period.end.isoformat(),
+        updated_at=datetime.now(timezone("America/Los_Angeles")).isoformat(),
+        players=len(SHEET_PLAYER_IDS | WINDOW_PLAYER_IDS),
+        sets=UNIQUE_SET_COUNT,
+    )
+    return views
+
+
+def write_views_to_redis(views: dict) -> str:
+    """publish the views of this run, returning their version"""
+    version = publish_views(views)
+    logger.info(f"published {len(views)} views as version {version}")
+    return version
+
+
+def ranking_periods() -> list[RankingPeriod]:
+    """every period on the periods tab, plus rolling windows ending today"""
+    periods = [RankingPeriod(*period) for period in get_ranking_periods()]
+    today = datetime.combine(datetime.now().date(), datetime.max.time())
+    for days in ROLLING_WINDOW_DAYS:
+        periods.append(RankingPeriod(f"last {days} days", today - timedelta(days=days), today))
+    return periods
+
+
+def period_summaries(periods: list[RankingPeriod]) -> dict:
+    """{period name: records and h2hs of the sheeted players in it}"""
+    player_list = [
+        url_to_id(x[1]) for x in get_player_tags_urls_list(include_duplicates=False)
+    ]
+    return {
+        period.name: RANKING_WINDOWS.period_summary(period, player_list) for period in periods
+    }
 
-    pprint(vals)
-    tournaments_considered_sheet.update("A1", vals)
 
+def write_periods_to_redis(summaries: dict) -> None:
+    """one key per period, and the list of them"""
+    for name, summary in summaries.items():
+        setj(f"period:{name}", summary)
+    setj("periods", list(summaries))
+    logger.info(f"wrote records for {len(summaries)} ranking periods")
 
-def main():
+
+def replay_output_path(snapshot_path: str) -> str:
+    return os.path.splitext(snapshot_path)[0] + "-replay.json"
+
+
+def write_replay_output(path: str, views: dict, summaries: dict) -> None:
+    """what a snapshot replay would have published, as one local json file"""
+    output = dict(
+        sheets=get_context().doc.to_dict(),
+        views=views,
+        periods=summaries,
+        metrics=METRICS.to_dict(),
+    )
+    with open(path, "w") as f:
+        json.dump(output, f, indent=1, default=str)
+    logger.info(f"wrote the replay to {path}, nothing was published")
+
+
+def parse_state_fingerprint(ingest_start: datetime) -> str:
+    """
+    changes whenever the sets saved by an earlier run would now be ingested
+    differently: bans, combined accounts or swaps edited on the input sheet,
+    or a window that starts at another date
+    """
+    config = [
+        PARSE_STATE_VERSION,
+        sorted(get_banned_tournament_ids()),
+        get_player_swapper_dict(),
+        get_duplicate_dict_from_sheet(),
+        to_epoch(ingest_start),
+    ]
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def load_parse_state(fingerprint: str, ingest_end: datetime, sheet_player_ids: list[str]) -> bool:
+    """
+    pick up the sets ingested by the last run. returns False, leaving everything
+    empty for a full ingest, when they can't be reused
+    """
+    global SET_STORE
+    state = getj(PARSE_STATE_KEY)
+    if state is None:
+        logger.info("no saved parse state, ingesting every tournament")
+        return False
+    reason = None
+    if state["fingerprint"] != fingerprint:
+        reason = "bans, combines, swaps or the window start changed"
+    elif state["ingest_end"] > to_epoch(ingest_end):
+        reason = "the window ends earlier than it did"
+    elif set(state["sheet_players"]) - set(sheet_player_ids):
+        reason = "players were taken off the sheet"
+    if reason is not None:
+        logger.info(f"not reusing the saved parse state: {reason}")
+        return False
+    SET_STORE = SetStore.from_state(state["store"])
+    DATE_INDEX.epochs.update(state["epochs"])
+    ID_TO_NAME.update(state["names"])
+    logger.info(f"reusing {len(SET_STORE)} sets ingested by the last run")
+    return True
+
+
+def save_parse_state(fingerprint: str, ingest_end: datetime, sheet_player_ids: list[str]) -> None:
+    setj(
+        PARSE_STATE_KEY,
+        dict(
+            fingerprint=fingerprint,
+            ingest_end=to_epoch(ingest_end),
+            sheet_players=sheet_player_ids,
+            names=ID_TO_NAME,
+            epochs=DATE_INDEX.epochs,
+            store=SET_STORE.to_state(),
+        ),
+    )
+
+
+@click.command()
+@click.option(
+    "--period",
+    default=None,
+    help="publish this period from the periods tab instead of the hardcoded cut-off dates",
+)
+@click.option(
+    "--periods/--no-periods",
+    "with_periods",
+    default=True,
+    help="also compute records for every ranking period and rolling window",
+)
+@click.option(
+    "--full-refresh",
+    is_flag=True,
+    default=False,
+    help="rewrite every worksheet instead of only the cells that changed",
+)
+@click.option(
+    "--snapshot",
+    "snapshot_path",
+    default=None,
+    help=f"dry run on a scrape snapshot ('latest' for the newest in {JSON_DIR}/): read players, the input sheet and badge counts from it, and write what would be published next to it instead of to the sheet and redis",
+)
+@click.option(
+    "--profile",
+    "profile_path",
+    default=None,
+    help="run under cProfile and write the stats to this file",
+)
+@click.option(
+    "--rebuild",
+    is_flag=True,
+    default=False,
+    help="ingest every tournament again instead of only those the last run hadn't seen",
+)
+def main(period, with_periods, full_refresh, snapshot_path, profile_path, rebuild):
+    publish(period, with_periods, full_refresh, snapshot_path, profile_path, rebuild)
+
+
+def publish(
+    period: Optional[str] = None,
+    with_periods: bool = True,
+    full_refresh: bool = False,
+    snapshot_path: Optional[str] = None,
+    profile_path: Optional[str] = None,
+    rebuild: bool = False,
+) -> None:
+    """
+    one parse run, with its metrics saved. can be called again in the same
+    process: the google clients are kept, everything computed starts over
+    from the state saved by the last run
+    """
+    # replaying a snapshot is a dry run: nothing goes to the sheet or redis
+    dry_run = snapshot_path is not None
+    with recorded_run("parse", save=not dry_run), profiled(profile_path):
+        reset_run_state(dry_run)
+        run_parse(period, with_periods, full_refresh, snapshot_path, rebuild)
+
+
+def run_parse(
+    period: Optional[str],
+    with_periods: bool,
+    full_refresh: bool,
+    snapshot_path: Optional[str],
+    rebuild: bool = False,
+) -> None:
+    global RANKING_WINDOWS
     start = time.time()
-    for player_name, player_url in get_player_tags_urls_list():
-        logger.debug("parsing, player_name=" + player_name)
-        player_id = url_to_id(player_url)
-        ID_TO_NAME[player_id] = player_name
-        parse_good_player(player_id)
-        logger.info("got player " + player_name)
-
-    write_wins_and_losses_to_sheet()
-    write_h2h_to_sheet()
-    write_tournament_info_to_sheet()
+    snapshot = open_snapshot(snapshot_path) if snapshot_path else None
+    if full_refresh and snapshot is None:
+        forget_sheet_state()
+    periods = ranking_periods() if with_periods or period else []
+    current = RankingPeriod("current", CUT_OFF_DATE_START, CUT_OFF_DATE_END)
+    if period is not None:
+        matching = [p for p in periods if p.name == period]
+        if not matching:
+            raise click.BadParameter(f"unknown ranking period {period}")
+        current = matching[0]
+    # one ingest pass covers the published period and every other window
+    ingest_start = min([current.start] + [p.start for p in periods])
+    ingest_end = max([current.end] + [p.end for p in periods])
+    sheet_players = [
+        (player_name, url_to_id(player_url))
+        for player_name, player_url in get_player_tags_urls_list()
+    ]
+    sheet_player_ids = [player_id for _, player_id in sheet_players]
+    # a snapshot replay always starts from nothing, it may be older than the saved state
+    keep_state = snapshot is None
+    if keep_state:
+        fingerprint = parse_state_fingerprint(ingest_start)
+        reused = not rebuild and load_parse_state(fingerprint, ingest_end, sheet_player_ids)
+        METRICS.set("parse_state_reused", int(reused))
+    # every player's results in one round trip, but only one player's decoded at a time
+    results_keys = [f"{player_id}:results" for player_id in sheet_player_ids]
+    with METRICS.stage("load results"):
+        raw_results = r.mget(results_keys) if snapshot is None and results_keys else []
+    with METRICS.stage("ingest"):
+        for idx, (player_name, player_id) in enumerate(sheet_players):
+            if snapshot is not None:
+                results = snapshot.get(results_keys[idx])
+            else:
+                raw, raw_results[idx] = raw_results[idx], None
+                results = None if raw is None else decode(raw)
+            logger.debug("parsing, player_name=" + player_name)
+            ID_TO_NAME[player_id] = player_name
+            SHEET_PLAYER_IDS.add(player_id)
+            started = time.perf_counter()
+            parse_good_player(player_id, ingest_start, ingest_end, results)
+            METRICS.set("player_parse_seconds", time.perf_counter() - started, player=player_id)
+            logger.info("got player " + player_name)
+    if keep_state:
+        with METRICS.stage("save state"):
+            save_parse_state(fingerprint, ingest_end, sheet_player_ids)
+    with METRICS.stage("aggregate"):
+        RANKING_WINDOWS = RankingWindows(SET_STORE)
+        logger.info(f"publishing {current.name}: {current.start} to {current.end}")
+        aggregate_sets(current.start, current.end)
+    with METRICS.stage("badge counts"):
+        # one bulk lookup for everyone the sheets and views sort, every sort below is then a dict hit
+        BADGE_COUNTS.prefetch(SHEET_PLAYER_IDS | WINDOW_PLAYER_IDS)
+
+    with METRICS.stage("h2h build"):
+        h2h_players = h2h_player_list()
+        matrix = build_h2h_matrix(h2h_players)
+    with METRICS.stage("notes"):
+        wins_losses_notes = pvp_notes()
+        matrix_notes = h2h_notes(matrix)
+    with METRICS.stage("write wins and losses"):
+        write_wins_and_losses_to_sheet(wins_losses_notes)
+    with METRICS.stage("write h2h"):
+        write_h2h_to_sheet(h2h_players, matrix, matrix_notes)
+    with METRICS.stage("write tournaments"):
+        write_tournament_info_to_sheet()
+    with METRICS.stage("write views"):
+        views = build_views(current)
+        if snapshot is None:
+            write_views_to_redis(views)
+    summaries = dict()
+    if with_periods:
+        with METRICS.stage("write periods"):
+            summaries = period_summaries(periods)
+            if snapshot is None:
+                write_periods_to_redis(summaries)
     finish = time.time()
     time_taken_parse = finish - start
     # write time taken to file
     # time_taken_scrape = r.get("time_taken_scrape")
 
     write_meta_to_sheet()
-
-    # batch add notes
-    # https://github.com/burnash/gspread/pull/1189/commits/c192725dfbd2c922134cdd6de3201088acd1dfd6
+    with METRICS.stage("flush"):
+        get_context().batch.flush()
+    METRICS.set("sets", len(SET_STORE))
+    METRICS.set("window_sets", len(WINDOW_ROWS))
+    if snapshot is not None:
+        write_replay_output(replay_output_path(snapshot.path), views, summaries)
+        snapshot.close()
+
+
+def open_snapshot(path: str) -> SnapshotReader:
+    """replay a scrape snapshot: its sheet and badge counts replace the live ones"""
+    global BADGE_COUNTS
+    if path == "latest":
+        path = latest_snapshot(JSON_DIR)
+        if path is None:
+            raise click.BadParameter(f"no scrape snapshots in {JSON_DIR}/")
+    snapshot = SnapshotReader(path)
+    logger.info(f"reading {path} ({len(snapshot)} entries)")
+    sheet = snapshot.get(SHEET_KEY)
+    if sheet is not None:
+        use_sheet_snapshot(sheet)
+    # the scrape stored a count for everyone parse sorts, nothing is looked up
+    BADGE_COUNTS = BadgeCountResolver(
+        copy_dict=snapshot.get(COPY_BADGE_COUNT_KEY) or {},
+        counts=snapshot.get(BADGE_COUNTS_KEY),
+        offline=True,
+    )
+    return snapshot
 
 
 if __name__ == "__main__":
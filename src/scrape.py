@@ -1,15 +1,38 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import csv
-from datetime import timedelta
+import hashlib
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 from io import StringIO
 import json
+import os
+import random
+import threading
 import time
 from typing import Optional, DefaultDict
 import click
 import requests
+from requests.adapters import HTTPAdapter
 from loguru import logger
-from database import r, setj
-from common import id_to_url, url_to_id
+from urllib.parse import urlparse
+from metrics import METRICS, recorded_run
+from database import decode, r, getj, getj_many, setj, setj_many
+from common import id_to_profile_url, id_to_url, url_to_id
+from identity import IdentityIndex
+from jsonstream import iter_object_items
+from snapshot import (
+    BADGE_COUNTS_KEY,
+    COPY_BADGE_COUNT_KEY,
+    SHEET_KEY,
+    SnapshotWriter,
+    prune_snapshots,
+    snapshot_path,
+)
+from setstore import parse_start_time, to_epoch
+from windows import CUT_OFF_DATE_END, CUT_OFF_DATE_START
+from workqueue import LEASE_SECONDS, WorkQueue
 from collections import defaultdict
+from functools import lru_cache
 
 
 SHEET_ID = "1EQmk2ElCjlC6LiYrmqBcjxpAHL49PTgJRuOwcY1MlPY"
@@ -24,8 +47,65 @@ BANNED_TOURNAMENTS_GID = "1111402135"
 PAST_RANKING_PERIODS_GID = "841098674"
 PLAYER_SWAPPER_GID = "1035380690"
 
+# the input tabs a run reads, downloaded together into one sheet snapshot
+SNAPSHOT_TABS = {
+    "players": PLAYERS_GID,
+    "banned_tournaments": BANNED_TOURNAMENTS_GID,
+    "player_swapper": PLAYER_SWAPPER_GID,
+    "combine": COMBINE_GID,
+    "past_ranking_periods": PAST_RANKING_PERIODS_GID,
+}
+PERIOD_DATE_FORMATS = ["%Y-%m-%d", "%m/%d/%Y", "%m/%d/%y"]
+SHEET_SNAPSHOT_KEY = SHEET_KEY
+SHEET_SNAPSHOT_TTL = timedelta(
+    minutes=int(os.getenv("SHEET_SNAPSHOT_TTL_MINUTES", "60"))
+)
+# this process's copy of the sheet. it never expires, so one run never mixes two versions;
+# long-running processes call refresh_sheet_snapshot() before each run (the daemon does)
+_SHEET_SNAPSHOT = None
+_SHEET_SNAPSHOT_LOCK = threading.Lock()
+
 JSON_DIR = "jsons"
 
+# the parts of a /players/data payload that parse.py reads; everything else is dropped
+RESULTS_INFO_FIELDS = [
+    "id",
+    "start_time",
+    "online",
+    "tournament_name",
+    "event_name",
+    "attendees",
+    "location",
+]
+RESULTS_SET_FIELDS = [
+    "id",
+    "event_id",
+    "p1_id",
+    "p2_id",
+    "winner_id",
+    "p1_tag",
+    "p2_tag",
+    "p1_score",
+    "p2_score",
+    "p1_standing",
+    "p2_standing",
+    "dq",
+]
+RESULTS_CHUNK_SIZE = 64 * 1024
+
+DEFAULT_WORKERS = 8
+# scrape snapshots kept in JSON_DIR, older ones are deleted after each scrape
+KEEP_SNAPSHOTS = 12
+BADGE_COUNT_TTL = timedelta(days=3)
+# seconds between progress lines while waiting on a queued scrape
+QUEUE_PROGRESS_INTERVAL = 10
+# seconds between checks for a newly queued scrape, for a standing --worker
+QUEUE_POLL_SECONDS = 5
+
+# one keep-alive session shared by every request (and every scrape thread)
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=32))
+
 
 def get_sheet_dl(gid: str) -> str:
     return (
@@ -33,38 +113,157 @@ def get_sheet_dl(gid: str) -> str:
     )
 
 
+class TokenBucket:
+    """
+    thread-safe token bucket rate limiter.
+    refills `rate` tokens per second, holding at most `capacity`
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def try_acquire(self) -> float:
+        """take a token if one is available. returns 0 if it was taken, else the seconds until one is"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated_at) * self.rate
+            )
+            self.updated_at = now
+            if now >= self.paused_until and self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return max(self.paused_until - now, (1 - self.tokens) / self.rate)
+
+    def acquire(self) -> None:
+        """block until a token is available, then take it"""
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """stop handing out tokens for `seconds`, e.g. after the server throttled us"""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+# every pgstats request (results, profiles, badge lookups) shares this limiter
+PGSTATS_LIMITER = TokenBucket(
+    rate=float(os.getenv("PGSTATS_RATE_LIMIT", "5")),
+    capacity=float(os.getenv("PGSTATS_BURST", "10")),
+)
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+def retry_after_seconds(response: requests.Response) -> Optional[float]:
+    """parse a Retry-After header, which is either seconds or an http date"""
+    header = response.headers.get("Retry-After")
+    if not header:
+        return None
+    try:
+        return max(0.0, float(header))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff_seconds(retry: int, retry_timeout: float, max_retry_timeout: float) -> float:
+    """exponential backoff with full jitter"""
+    return random.uniform(0, min(max_retry_timeout, retry_timeout * 2**retry))
+
+
 def fetch_url_with_retry(
     url,
     max_retries=5,
     request_timeout=10,
-    retry_timeout=3,
+    retry_timeout=0.5,
+    max_retry_timeout=30,
+    limiter: Optional[TokenBucket] = None,
+    stream=False,
 ) -> Optional[requests.Response]:
     """
     Fetch the content of a URL using the requests library with retry.
 
+    Timeouts, connection errors, 429s and 5xx responses are retried with
+    exponential backoff and jitter (or the server's Retry-After). Other 4xx
+    responses are not retried.
+
     Parameters:
         url (str): The URL to fetch the content from.
         max_retries (int, optional): The maximum number of retry attempts. Default is 5.
         request_timeout (int, optional): The timeout for the request in seconds. Default is 10.
-        retry_timeout (int, optional): The timeout in seconds between retry attempts. Default is 3.
+        retry_timeout (float, optional): The base backoff in seconds, doubled every attempt. Default is 0.5.
+        max_retry_timeout (float, optional): The largest backoff in seconds. Default is 30.
+        limiter (TokenBucket, optional): A rate limiter every attempt has to pass through.
+        stream (bool, optional): Don't download the body up front (see Response.iter_content).
 
     Returns:
         str: The content of the URL if successfully fetched, or None if all retry attempts failed.
     """
+    parsed = urlparse(url)
+    endpoint = dict(host=parsed.netloc, path=parsed.path)
     for retry in range(max_retries + 1):
+        if retry:
+            METRICS.inc("http_retries_total", **endpoint)
+        if limiter is not None:
+            with METRICS.timer("rate_limit_wait_seconds", **endpoint):
+                limiter.acquire()
+        delay = None
+        started = time.perf_counter()
         try:
-            response = requests.get(url, timeout=request_timeout)
-            response.raise_for_status()  # Raise an exception for non-200 status codes
-            return response
-        except (requests.RequestException, requests.HTTPError, requests.Timeout) as e:
+            response = SESSION.get(url, timeout=request_timeout, stream=stream)
+        except requests.RequestException as e:
+            METRICS.observe(
+                "http_request_seconds", time.perf_counter() - started, status="error", **endpoint
+            )
             logger.info(f"Attempt {retry + 1}/{max_retries + 1} failed. Error: {e}")
-            if retry < max_retries:
-                logger.info(f"Retrying in {retry_timeout} seconds...")
-                time.sleep(retry_timeout)
-
+        else:
+            METRICS.observe(
+                "http_request_seconds",
+                time.perf_counter() - started,
+                status=response.status_code,
+                **endpoint,
+            )
+            if response.ok:
+                return response
+            response.close()
+            if response.status_code not in RETRYABLE_STATUS_CODES:
+                logger.error(f"{url} returned {response.status_code}, not retrying")
+                METRICS.inc("http_failures_total", **endpoint)
+                return None
+            logger.info(
+                f"Attempt {retry + 1}/{max_retries + 1} failed. Status: {response.status_code}"
+            )
+            delay = retry_after_seconds(response)
+            if delay is not None and response.status_code == 429 and limiter is not None:
+                limiter.pause(delay)
+        if retry < max_retries:
+            if delay is None:
+                delay = backoff_seconds(retry, retry_timeout, max_retry_timeout)
+            logger.info(f"Retrying in {delay:.2f} seconds...")
+            time.sleep(delay)
+
+    METRICS.inc("http_failures_total", **endpoint)
     return None  # Return None if all retry attempts fail
 
 
+def fetch_pgstats(url: str, stream=False) -> Optional[requests.Response]:
+    """fetch a pgstats api url through the shared rate limiter"""
+    return fetch_url_with_retry(url, limiter=PGSTATS_LIMITER, stream=stream)
+
+
 def get_csv(csv_dl, column_limit=None) -> list:
     resp = fetch_url_with_retry(csv_dl)
     scsv = resp.text
@@ -81,20 +280,104 @@ def get_csv(csv_dl, column_limit=None) -> list:
     return output
 
 
+def fetch_sheet_snapshot() -> dict:
+    """download every input tab once and stamp the result with a content hash"""
+    with ThreadPoolExecutor(max_workers=len(SNAPSHOT_TABS)) as pool:
+        futures = {
+            tab: pool.submit(get_csv, get_sheet_dl(gid))
+            for tab, gid in SNAPSHOT_TABS.items()
+        }
+        tabs = {tab: future.result() for tab, future in futures.items()}
+    encoded = json.dumps(tabs, sort_keys=True).encode("utf-8")
+    return dict(
+        version=hashlib.sha1(encoded).hexdigest(),
+        fetched_at=time.time(),
+        tabs=tabs,
+    )
+
+
+def refresh_sheet_snapshot() -> dict:
+    """re-download the input sheet and share it with this process and redis"""
+    snapshot = fetch_sheet_snapshot()
+    setj(SHEET_SNAPSHOT_KEY, snapshot, ex=SHEET_SNAPSHOT_TTL)
+    use_sheet_snapshot(snapshot)
+    logger.info(f"fetched sheet snapshot {snapshot['version'][:8]}")
+    return snapshot
+
+
+def use_sheet_snapshot(snapshot: dict) -> None:
+    """make this process read the input sheet from `snapshot` (e.g. one replayed from disk)"""
+    global _SHEET_SNAPSHOT
+    with _SHEET_SNAPSHOT_LOCK:
+        _SHEET_SNAPSHOT = snapshot
+
+
+def get_sheet_snapshot() -> dict:
+    """
+    the input sheet as seen by this run: the in-process copy, else the copy
+    in redis (written by the last scrape, expires after SHEET_SNAPSHOT_TTL),
+    else a fresh download. the in-process copy is kept for the life of the
+    process whatever its age, see refresh_sheet_snapshot()
+    """
+    global _SHEET_SNAPSHOT
+    with _SHEET_SNAPSHOT_LOCK:
+        if _SHEET_SNAPSHOT is not None:
+            return _SHEET_SNAPSHOT
+        snapshot = getj(SHEET_SNAPSHOT_KEY)
+        if snapshot is not None:
+            logger.info(f"using cached sheet snapshot {snapshot['version'][:8]}")
+            _SHEET_SNAPSHOT = snapshot
+            return snapshot
+    return refresh_sheet_snapshot()
+
+
+def get_sheet_rows(tab: str, column_limit=None) -> list:
+    """rows of one input tab (header included), read from the sheet snapshot"""
+    rows = get_sheet_snapshot()["tabs"][tab]
+    if column_limit is not None:
+        return [row[:column_limit] for row in rows]
+    return [list(row) for row in rows]
+
+
 def get_player_tags_urls_list(include_duplicates: bool = True, column_limit=2) -> list[tuple]:
-    dl_link = get_sheet_dl(PLAYERS_GID)
-    rows = get_csv(dl_link, column_limit=column_limit)
+    rows = get_sheet_rows("players", column_limit=column_limit)
     if not include_duplicates:
         return [row for row in rows[1:] if row[0] != "^"]
     return rows[1:]
 
 
 def get_banned_tournament_ids() -> list[str]:
-    dl_link = get_sheet_dl(BANNED_TOURNAMENTS_GID)
-    rows = get_csv(dl_link)
+    rows = get_sheet_rows("banned_tournaments")
     return [row[0] for row in rows[1:]]
 
 
+def parse_period_date(value: str) -> Optional[datetime]:
+    for date_format in PERIOD_DATE_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), date_format)
+        except ValueError:
+            continue
+    return None
+
+
+def get_ranking_periods() -> list[tuple[str, datetime, datetime]]:
+    """
+    (name, start, end) for every row of the past ranking periods tab.
+    the first column is the name, the first two cells after it that parse as dates
+    are the start and end
+    """
+    periods = []
+    for row in get_sheet_rows("past_ranking_periods")[1:]:
+        if not row or not row[0].strip():
+            continue
+        dates = [d for d in map(parse_period_date, row[1:]) if d is not None]
+        if len(dates) < 2:
+            logger.info(f"no start/end dates found for ranking period {row[0]}")
+            continue
+        periods.append((row[0].strip(), dates[0], dates[1]))
+    return periods
+
+
 def get_duplicate_dict_from_sheet() -> dict:
     duplicate_table = dict()
     rows = get_player_tags_urls_list()
@@ -112,9 +395,8 @@ def get_player_swapper_dict() -> DefaultDict[str, list[tuple[str, str]]]:
     {pg_stats_id: {tournament_id: [bracket_player_pgstats, actual_player_pgstats]}
     sometimes players enter brackets under someone else's account
     """
-    dl_link = get_sheet_dl(PLAYER_SWAPPER_GID)
     output = defaultdict(list)
-    rows = get_csv(dl_link, column_limit=4)
+    rows = get_sheet_rows("player_swapper", column_limit=4)
     for row in rows[1:]:
         tournament_id, bracket_player_pgstats, actual_player_pgstats, note = row
         brack_id = url_to_id(bracket_player_pgstats)
@@ -123,53 +405,217 @@ def get_player_swapper_dict() -> DefaultDict[str, list[tuple[str, str]]]:
     return output
 
 
-def get_and_parse_player(player_id: str) -> None:
+def get_and_parse_player(
+    player_id: str,
+    incremental: bool = False,
+    snapshot: Optional[SnapshotWriter] = None,
+) -> bool:
+    """
+    download and store a player's profile and results, in redis and in `snapshot`.
+    with `incremental`, the results are only re-downloaded when the profile
+    fingerprint changed since the last scrape. returns whether results were written
+    """
     profile_key = f"{player_id}:profile"
     results_key = f"{player_id}:results"
+    fingerprint_key = f"{player_id}:fingerprint"
+    raw_profile = fetch_player_profile_data(player_id)
+    fingerprint = profile_fingerprint(raw_profile)
+    # the profile has the badges, so sorting this player never costs another download
+    r.set(f"{player_id}:num_badges", count_badges(raw_profile), ex=BADGE_COUNT_TTL)
+    if incremental and r.exists(results_key):
+        stored = r.get(fingerprint_key)
+        if stored is not None and stored.decode() == fingerprint:
+            logger.info(f"{player_id} unchanged since last scrape")
+            if snapshot is not None:
+                copy_to_snapshot(snapshot, [player_id])
+            return False
+    profile = trim_profile(raw_profile)
     results = fetch_player_results(player_id)
-    profile = fetch_player_profile(player_id)
+    values = {profile_key: profile, results_key: results}
+    if snapshot is not None:
+        snapshot.put_many(values)
+    setj_many(values)
+    r.set(fingerprint_key, fingerprint)
+    return True
+
+
+def timed_scrape(player_id: str, *args) -> bool:
+    """get_and_parse_player, recording how long the player took"""
+    started = time.perf_counter()
+    try:
+        return get_and_parse_player(player_id, *args)
+    finally:
+        elapsed = time.perf_counter() - started
+        METRICS.set("player_scrape_seconds", elapsed, player=player_id)
+        METRICS.observe("player_scrape_seconds_distribution", elapsed)
+
+
+def copy_to_snapshot(snapshot: SnapshotWriter, player_ids: list[str]) -> None:
+    """put the profile and results already in redis for `player_ids` into `snapshot`"""
+    keys = [
+        key
+        for player_id in player_ids
+        for key in (f"{player_id}:profile", f"{player_id}:results")
+    ]
+    snapshot.put_many(
+        {key: value for key, value in zip(keys, getj_many(keys)) if value is not None}
+    )
 
-    with open(f"{JSON_DIR}/{player_id}_results.json", "w") as f:
-        json.dump(results, f, indent=2)
-    with open(f"{JSON_DIR}/{player_id}_profile.json", "w") as f:
-        json.dump(profile, f, indent=2)
 
-    setj(profile_key, profile)
-    setj(results_key, results)
+def fetch_player_profile_data(player_id: str) -> dict:
+    """the untrimmed profile, including badges and placings"""
+    response = fetch_pgstats(id_to_profile_url(player_id))
+    if response is None:
+        raise requests.RequestException(f"could not fetch the profile of {player_id}")
+    return response.json()["result"]
 
 
-def fetch_player_profile(player_id: str) -> dict:
-    data = fetch_url_with_retry(
-        f"https://api.pgstats.com/players/profile?playerId={player_id}&game=melee"
-    ).json()
-    profile = data["result"]
-    profile["num_badges"] = len(
-        [i for i in profile["badges"]["by_events"] if not i["online"]]
-    )
+def profile_fingerprint(raw_profile: dict) -> str:
+    """
+    placings and badges change whenever pgstats adds an event for the player,
+    so hashing them tells us if the (much bigger) results payload could have changed
+    """
+    relevant = [raw_profile.get("placings"), raw_profile.get("badges")]
+    encoded = json.dumps(relevant, sort_keys=True).encode("utf-8")
+    return hashlib.sha1(encoded).hexdigest()
+
+
+def count_badges(raw_profile: dict) -> int:
+    """offline events the player has a badge from, what players are sorted by"""
+    return len([i for i in raw_profile["badges"]["by_events"] if not i["online"]])
+
+
+def trim_profile(raw_profile: dict) -> dict:
+    profile = dict(raw_profile)
+    profile["num_badges"] = count_badges(raw_profile)
 
     del profile["badges"]
     del profile["placings"]
     return profile
 
 
-def fetch_player_results(player_id: str) -> dict:
-    data = fetch_url_with_retry(id_to_url(player_id))
-    results = data.json()["result"]
-    return results
+def project_tournament(tournament: dict) -> dict:
+    """keep only the tournament and set fields parse.py reads"""
+    info = tournament["info"]
+    return dict(
+        info={field: info[field] for field in RESULTS_INFO_FIELDS if field in info},
+        sets=[
+            {field: set_data[field] for field in RESULTS_SET_FIELDS if field in set_data}
+            for set_data in tournament["sets"]
+        ],
+    )
 
 
-def scrape_all_players(skip_known: bool = False):
+def fetch_player_results(player_id: str, max_attempts: int = 3) -> dict:
+    """
+    download a player's results, decoding and projecting one tournament at a time
+    as the response streams in, so the full payload is never held in memory
+    """
+    for attempt in range(1, max_attempts + 1):
+        response = fetch_pgstats(id_to_url(player_id), stream=True)
+        if response is None:
+            # fetch_pgstats has already retried (or the error isn't worth retrying) and logged why
+            raise requests.RequestException(f"could not fetch results for {player_id}")
+        try:
+            chunks = response.iter_content(chunk_size=RESULTS_CHUNK_SIZE)
+            return {
+                tournament_id: project_tournament(tournament)
+                for tournament_id, tournament in iter_object_items(chunks, ("result",))
+            }
+        except (requests.RequestException, ValueError) as e:
+            METRICS.inc("results_stream_errors_total")
+            logger.info(f"results for {player_id} broke off mid-stream ({e})")
+            if attempt == max_attempts:
+                raise
+        finally:
+            response.close()
+
+
+def scrape_all_players(
+    skip_known: bool = False,
+    workers: int = DEFAULT_WORKERS,
+    incremental: bool = False,
+    snapshot: Optional[SnapshotWriter] = None,
+):
+    """
+    scrape every player on the sheet with a pool of `workers` threads.
+    each player is written to redis (and `snapshot`) as soon as its requests finish.
+    with `incremental`, players whose profile fingerprint is unchanged are not re-downloaded
+    """
+    to_scrape = []
+    skipped = []
     for tag, pg_url in get_player_tags_urls_list():
         player_id = url_to_id(pg_url)
         if skip_known and r.exists(f"{player_id}:results"):
             logger.info(f"skipping {tag}")
+            skipped.append(player_id)
             continue
-        logger.info(f"scraping {tag}, {pg_url}")
-        get_and_parse_player(player_id)
-
-
-def write_copy_badge_count_from_sheet() -> dict:
-    r.delete("copy_badge_count_from")
+        to_scrape.append((tag, pg_url, player_id))
+    if snapshot is not None and skipped:
+        copy_to_snapshot(snapshot, skipped)
+
+    failed = []
+    updated = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {}
+        for tag, pg_url, player_id in to_scrape:
+            logger.info(f"scraping {tag}, {pg_url}")
+            future = pool.submit(timed_scrape, player_id, incremental, snapshot)
+            futures[future] = tag
+        for done, future in enumerate(as_completed(futures), start=1):
+            tag = futures[future]
+            try:
+                changed = future.result()
+            except Exception as e:
+                logger.error(f"failed to scrape {tag}: {e}")
+                METRICS.inc("players_scraped_total", result="failed")
+                failed.append(tag)
+                continue
+            METRICS.inc("players_scraped_total", result="updated" if changed else "unchanged")
+            if changed:
+                updated += 1
+            logger.info(f"scraped {tag} ({done}/{len(futures)})")
+    logger.info(f"{updated}/{len(to_scrape)} players had new results")
+    if failed:
+        logger.error(f"{len(failed)} players failed to scrape: {failed}")
+
+
+def badge_count_ids(player_ids: list[str]) -> set:
+    """
+    every id parse.py may sort by badge count: the sheeted players and everyone
+    they played at an offline, unbanned tournament in a period it can publish
+    (the cut-off dates or one from the periods tab), after swaps and combines
+    """
+    identity = IdentityIndex(
+        banned_tournament_ids=get_banned_tournament_ids(),
+        swaps=get_player_swapper_dict(),
+        duplicate_of=get_duplicate_dict_from_sheet(),
+    )
+    periods = [(CUT_OFF_DATE_START, CUT_OFF_DATE_END)] + [
+        (start, end) for _, start, end in get_ranking_periods()
+    ]
+    windows = [(to_epoch(start), to_epoch(end)) for start, end in periods]
+    ids = set(player_ids)
+    player_ids = list(dict.fromkeys(player_ids))
+    # every player's results in one round trip, decoded one player at a time
+    raw_results = r.mget([f"{player_id}:results" for player_id in player_ids]) if player_ids else []
+    for raw in raw_results:
+        for tournament in (decode(raw) if raw is not None else {}).values():
+            info = tournament["info"]
+            if info.get("online") or identity.is_banned(info["id"]):
+                continue
+            date = parse_start_time(info["start_time"])
+            if not any(start <= date <= end for start, end in windows):
+                continue
+            for set_data in tournament["sets"]:
+                for key in ["p1_id", "p2_id"]:
+                    ids.add(identity.resolve(set_data["event_id"], set_data[key]))
+    ids.discard(None)
+    ids.discard("")
+    return ids
+
+
+def copy_badge_count_from_sheet() -> dict:
     id2idmap = dict()
     rows = get_player_tags_urls_list(column_limit=3)
     for tag, url, copy_url in rows[1:]:
@@ -179,9 +625,17 @@ def write_copy_badge_count_from_sheet() -> dict:
             continue
         b = url_to_id(copy_url)
         id2idmap[a] = b
-    r.set("copy_badge_count_from", json.dumps(id2idmap), ex=timedelta(days=3))
+    return id2idmap
+
 
+def write_copy_badge_count_from_sheet() -> dict:
+    r.delete(COPY_BADGE_COUNT_KEY)
+    id2idmap = copy_badge_count_from_sheet()
+    r.set(COPY_BADGE_COUNT_KEY, json.dumps(id2idmap), ex=timedelta(days=3))
+    return id2idmap
 
+
+@lru_cache(maxsize=None)
 def improved_hash_to_float(s: str) -> float:
     # lengthen string
     s = s * 10
@@ -196,32 +650,312 @@ def improved_hash_to_float(s: str) -> float:
     normalized_value = hash_value / modulus
     return normalized_value
 
-def get_or_set_player_badge_count(player_id: str, copy_dict=None) -> float:
-    copy_dict = json.loads(r.get("copy_badge_count_from")) or dict()
-    offset = 0
-    if copy_dict is not None and player_id in copy_dict:
+def load_copy_badge_count_from() -> dict:
+    raw = r.get(COPY_BADGE_COUNT_KEY)
+    if raw is None:
+        return dict()
+    return json.loads(raw)
+
+
+def fetch_badge_count(player_id: str) -> int:
+    return count_badges(fetch_player_profile_data(player_id))
+
+
+class BadgeCountResolver:
+    """
+    badge counts used to order players, resolved in bulk.
+    prefetch() reads every cached count with one MGET and downloads the
+    missing profiles concurrently, so later lookups are dictionary hits.
+    players in the copy_badge_count_from map borrow another player's count,
+    minus a small per-player offset so the ordering stays stable.
+    an `offline` resolver only knows `counts` and sorts everyone else as 0
+    """
+
+    def __init__(
+        self,
+        copy_dict: Optional[dict] = None,
+        workers: int = DEFAULT_WORKERS,
+        counts: Optional[dict] = None,
+        offline: bool = False,
+    ):
+        self._copy_dict = copy_dict
+        self.workers = workers
+        self.counts = dict(counts or {})
+        self.offline = offline
+        self.lock = threading.Lock()
+
+    @property
+    def copy_dict(self) -> dict:
+        if self._copy_dict is None:
+            self._copy_dict = load_copy_badge_count_from()
+        return self._copy_dict
+
+    def source_id(self, player_id: str) -> str:
+        return self.copy_dict.get(player_id, player_id)
+
+    def prefetch(self, player_ids) -> None:
+        sources = sorted({self.source_id(p) for p in player_ids} - set(self.counts))
+        if not sources:
+            return
+        if self.offline:
+            logger.warning(f"no badge counts for {len(sources)} players, sorting them as 0")
+            with self.lock:
+                self.counts.update(dict.fromkeys(sources, 0.0))
+            return
+        cached = r.mget([f"{source}:num_badges" for source in sources])
+        missing = []
+        with self.lock:
+            for source, in_db in zip(sources, cached):
+                if in_db is None:
+                    missing.append(source)
+                else:
+                    self.counts[source] = float(in_db)
+        if not missing:
+            return
+        logger.info(f"fetching badge counts for {len(missing)} players")
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as pool:
+            fetched = list(pool.map(self.fetch, missing))
+        pipe = r.pipeline(transaction=False)
+        with self.lock:
+            for source, num_badges in zip(missing, fetched):
+                if num_badges is None:
+                    # sorted as 0 for this run, and asked for again next time
+                    self.counts[source] = 0.0
+                    continue
+                self.counts[source] = float(num_badges)
+                pipe.set(f"{source}:num_badges", num_badges, ex=BADGE_COUNT_TTL)
+        pipe.execute()
+
+    def fetch(self, source: str) -> Optional[int]:
+        """the badge count from pgstats, None if it couldn't be fetched"""
+        try:
+            return fetch_badge_count(source)
+        except Exception as e:
+            logger.warning(f"could not fetch the badge count of {source}, sorting it as 0: {e}")
+            METRICS.inc("badge_count_errors_total")
+            return None
+
+    def get(self, player_id: str) -> float:
+        source = self.source_id(player_id)
+        if source not in self.counts:
+            self.prefetch([player_id])
+        offset = 0
+        if source != player_id:
             offset = improved_hash_to_float(player_id)
-            player_id = copy_dict[player_id]
-    badge_key = f"{player_id}:num_badges"
-    in_db = r.get(badge_key)
-    if in_db is not None:
-        return float(in_db)
-    data = fetch_url_with_retry(
-        f"https://api.pgstats.com/players/profile?playerId={player_id}&game=melee"
-    ).json()
-    num_badges = len(
-        [i for i in data["result"]["badges"]["by_events"] if not i["online"]]
-    )
-    num_badges -= offset
-    r.set(badge_key, num_badges, ex=timedelta(days=3))
-    return num_badges
+        return self.counts[source] - offset
+
+    __call__ = get
 
 
 @click.command()
 @click.option("--skip", is_flag=True, default=False, help="skip players already in db")
-def main(skip):
-    write_copy_badge_count_from_sheet()
-    scrape_all_players(skip_known=skip)
+@click.option(
+    "--incremental",
+    is_flag=True,
+    default=False,
+    help="only re-download players whose pgstats profile changed",
+)
+@click.option(
+    "--workers",
+    default=DEFAULT_WORKERS,
+    show_default=True,
+    help="number of players to scrape concurrently",
+)
+@click.option(
+    "--snapshot/--no-snapshot",
+    "with_snapshot",
+    default=True,
+    help=f"also save the scrape to {JSON_DIR}/scrape-<time>.snap for parse.py --snapshot",
+)
+@click.option(
+    "--enqueue",
+    is_flag=True,
+    default=False,
+    help="put the players on a redis work queue for --worker processes and wait for them",
+)
+@click.option(
+    "--worker",
+    is_flag=True,
+    default=False,
+    help="scrape players from every run queued with --enqueue, waiting for the next one until stopped",
+)
+@click.option(
+    "--keep-snapshots",
+    default=KEEP_SNAPSHOTS,
+    show_default=True,
+    help=f"snapshots kept in {JSON_DIR}/, older ones are deleted after the scrape",
+)
+@click.option("--run", "run_id", default=None, help="with --worker, only work on this queued run, then exit")
+@click.option("--lease", default=LEASE_SECONDS, show_default=True, help="seconds a worker may go silent before its players are retried")
+def main(skip, incremental, workers, with_snapshot, keep_snapshots, enqueue, worker, run_id, lease):
+    if worker and not enqueue and run_id is None:
+        serve_scrape_queue(workers, lease)
+        return
+    with recorded_run("scrape"):
+        if enqueue:
+            run_queued_scrape(
+                skip,
+                incremental,
+                workers,
+                with_snapshot,
+                work=worker,
+                lease=lease,
+                keep_snapshots=keep_snapshots,
+            )
+        elif worker:
+            work_scrape_queue(run_id, workers, lease)
+        else:
+            run_scrape(skip, incremental, workers, with_snapshot, keep_snapshots)
+
+
+def run_scrape(
+    skip: bool = False,
+    incremental: bool = False,
+    workers: int = DEFAULT_WORKERS,
+    with_snapshot: bool = True,
+    keep_snapshots: int = KEEP_SNAPSHOTS,
+) -> None:
+    # always start a scrape from a fresh copy of the sheet; parse reuses it
+    with METRICS.stage("sheet"):
+        sheet_snapshot = refresh_sheet_snapshot()
+        copy_dict = write_copy_badge_count_from_sheet()
+    if not with_snapshot:
+        with METRICS.stage("players"):
+            scrape_all_players(skip_known=skip, workers=workers, incremental=incremental)
+        return
+    os.makedirs(JSON_DIR, exist_ok=True)
+    with SnapshotWriter(snapshot_path(JSON_DIR)) as snapshot:
+        with METRICS.stage("players"):
+            scrape_all_players(
+                skip_known=skip, workers=workers, incremental=incremental, snapshot=snapshot
+            )
+        # everything else parse reads, so a replay needs no sheet or badge lookups
+        with METRICS.stage("badge counts"):
+            badge_counts = BadgeCountResolver(copy_dict, workers=workers)
+            badge_counts.prefetch(
+                badge_count_ids([url_to_id(url) for _, url in get_player_tags_urls_list()])
+            )
+        snapshot.put(SHEET_KEY, sheet_snapshot)
+        snapshot.put(COPY_BADGE_COUNT_KEY, copy_dict)
+        snapshot.put(BADGE_COUNTS_KEY, badge_counts.counts)
+    logger.info(f"wrote {snapshot.path} ({len(snapshot.index)} entries)")
+    prune_old_snapshots(keep_snapshots)
+
+
+def prune_old_snapshots(keep: int) -> None:
+    for path in prune_snapshots(JSON_DIR, keep):
+        logger.info(f"deleted old snapshot {path}")
+
+
+def run_queued_scrape(
+    skip: bool = False,
+    incremental: bool = False,
+    workers: int = DEFAULT_WORKERS,
+    with_snapshot: bool = True,
+    work: bool = False,
+    lease: float = LEASE_SECONDS,
+    keep_snapshots: int = KEEP_SNAPSHOTS,
+) -> None:
+    """
+    run_scrape with the players spread over every `scrape.py --worker` process.
+    waits for the queue to drain (working on it too with `work`), then writes the snapshot from redis
+    """
+    with METRICS.stage("sheet"):
+        sheet_snapshot = refresh_sheet_snapshot()
+        copy_dict = write_copy_badge_count_from_sheet()
+    player_ids = list(dict.fromkeys(url_to_id(url) for _, url in get_player_tags_urls_list()))
+    to_scrape = [
+        player_id
+        for player_id in player_ids
+        if not (skip and r.exists(f"{player_id}:results"))
+    ]
+    queue = WorkQueue.create(to_scrape, options=dict(incremental=incremental), lease_seconds=lease)
+    with METRICS.stage("players"):
+        if work:
+            work_scrape_queue(queue.run_id, workers, lease)
+        while not queue.drained():
+            time.sleep(QUEUE_PROGRESS_INTERVAL)
+            # nobody else may be left to notice a dead worker
+            queue.reap()
+            log_queue_progress(queue)
+    progress = log_queue_progress(queue)
+    if progress["failed"]:
+        logger.error(f"{len(progress['failed'])} players failed to scrape: {progress['failed']}")
+    if not with_snapshot:
+        return
+    os.makedirs(JSON_DIR, exist_ok=True)
+    with SnapshotWriter(snapshot_path(JSON_DIR)) as snapshot:
+        copy_to_snapshot(snapshot, player_ids)
+        with METRICS.stage("badge counts"):
+            badge_counts = BadgeCountResolver(copy_dict, workers=workers)
+            badge_counts.prefetch(badge_count_ids(player_ids))
+        snapshot.put(SHEET_KEY, sheet_snapshot)
+        snapshot.put(COPY_BADGE_COUNT_KEY, copy_dict)
+        snapshot.put(BADGE_COUNTS_KEY, badge_counts.counts)
+    logger.info(f"wrote {snapshot.path} ({len(snapshot.index)} entries)")
+    prune_old_snapshots(keep_snapshots)
+
+
+def work_scrape_queue(
+    run_id: Optional[str] = None,
+    workers: int = DEFAULT_WORKERS,
+    lease: float = LEASE_SECONDS,
+) -> int:
+    """scrape players from a queued run with `workers` threads until none are left"""
+    if run_id is None:
+        queue = WorkQueue.current(lease_seconds=lease)
+        if queue is None:
+            logger.info("no queued scrape to work on")
+            return 0
+    else:
+        queue = WorkQueue(run_id, lease_seconds=lease)
+    incremental = queue.meta.get("options", dict()).get("incremental", False)
+
+    def handle(player_id: str) -> None:
+        try:
+            changed = timed_scrape(player_id, incremental)
+        except Exception:
+            METRICS.inc("players_scraped_total", result="failed")
+            raise
+        METRICS.inc("players_scraped_total", result="updated" if changed else "unchanged")
+
+    logger.info(f"working on queued scrape {queue.run_id}")
+    completed = queue.work(handle, threads=workers)
+    logger.info(f"scraped {completed} players of {queue.run_id}")
+    return completed
+
+
+def serve_scrape_queue(
+    workers: int = DEFAULT_WORKERS,
+    lease: float = LEASE_SECONDS,
+    poll: float = QUEUE_POLL_SECONDS,
+) -> None:
+    """
+    work on the current queued scrape whenever it has players left, checking
+    every `poll` seconds, until stopped. so workers can be started before the
+    enqueue and left running across runs. each run is recorded as its own scrape
+    """
+    logger.info("waiting for queued scrapes")
+    while True:
+        queue = WorkQueue.current(lease_seconds=lease)
+        if queue is not None and not queue.drained():
+            with recorded_run("scrape"):
+                work_scrape_queue(queue.run_id, workers, lease)
+            logger.info("waiting for the next queued scrape")
+        time.sleep(poll)
+
+
+def log_queue_progress(queue: WorkQueue) -> dict:
+    progress = queue.progress()
+    logger.info(
+        f"{queue.run_id}: {progress['done']}/{progress['total']} done, {progress['leased']} in progress, "
+        f"{progress['pending']} pending, {len(progress['failed'])} failed, {len(progress['workers'])} workers"
+    )
+    METRICS.set("queue_players", progress["pending"], state="pending")
+    METRICS.set("queue_players", progress["leased"], state="leased")
+    METRICS.set("queue_players", progress["done"], state="done")
+    METRICS.set("queue_players", len(progress["failed"]), state="failed")
+    return progress
 
 
 if __name__ == "__main__":
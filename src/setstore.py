@@ -0,0 +1,258 @@
+"""
+canonical table of every set the parse has seen.
+
+player and tournament ids are interned to small integers and each set is a
+row across parallel typed arrays, so the whole history of a run costs a few
+bytes per set instead of a dict per set
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from typing import Iterator, Optional
+
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+# stands in for a missing (None) score
+NO_SCORE = -(2**31)
+
+# bits of the `seen` column: which side(s) of the set were in a sheeted player's results
+WINNER_SEEN = 1
+LOSER_SEEN = 2
+
+
+class Interner:
+    """maps strings to dense integers and back"""
+
+    def __init__(self):
+        self.ids = []
+        self.index = dict()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, idx: int) -> str:
+        return self.ids[idx]
+
+    def __contains__(self, id_: str) -> bool:
+        return id_ in self.index
+
+    def intern(self, id_: str) -> int:
+        idx = self.index.get(id_)
+        if idx is None:
+            idx = self.index[id_] = len(self.ids)
+            self.ids.append(id_)
+        return idx
+
+    def get(self, id_: str) -> Optional[int]:
+        return self.index.get(id_)
+
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_epoch(date: datetime) -> int:
+    """naive datetime -> epoch seconds, treating it as utc like pgstats' start times"""
+    return int((date - EPOCH).total_seconds())
+
+
+def parse_start_time(start_time: str) -> int:
+    """pgstats start_time string -> epoch seconds"""
+    return to_epoch(datetime.strptime(start_time, DATE_FORMAT))
+
+
+class DateIndex:
+    """
+    tournament start times parsed once per tournament (not once per attendee),
+    and each player's tournaments sorted by them so a window is a pair of bisects
+    """
+
+    def __init__(self):
+        # tournament id -> epoch seconds
+        self.epochs = dict()
+        # player id -> (sorted dates, tournament ids in the same order)
+        self.players = dict()
+
+    def epoch(self, info: dict) -> int:
+        date = self.epochs.get(info["id"])
+        if date is None:
+            date = self.epochs[info["id"]] = parse_start_time(info["start_time"])
+        return date
+
+    def index_player(self, player_id: str, player_tournaments: dict) -> None:
+        """sort a results payload by date, ties kept in payload order"""
+        dated = [
+            (self.epoch(tournament["info"]), tournament_id)
+            for tournament_id, tournament in player_tournaments.items()
+        ]
+        dated.sort(key=lambda pair: pair[0])
+        self.players[player_id] = (
+            [date for date, _ in dated],
+            [tournament_id for _, tournament_id in dated],
+        )
+
+    def between(self, player_id: str, start: int, end: int) -> list[str]:
+        """ids of the player's tournaments with start <= date <= end, oldest first"""
+        dates, tournament_ids = self.players.get(player_id, ([], []))
+        return tournament_ids[bisect_left(dates, start) : bisect_right(dates, end)]
+
+
+class SetStore:
+    """
+    every set from every ingested results payload, stored once.
+    sets are keyed by (tournament id, set id), so a set between two sheeted
+    players that appears in both of their results is only kept once.
+    the `seen` column remembers which side(s) of the set were sheeted
+    players whose results contained it
+    """
+
+    # typed columns, saved and restored as plain lists by to_state/from_state
+    COLUMNS = {
+        "tournament_dates": "q",
+        "tournament": "i",
+        "date": "q",
+        "winner": "i",
+        "loser": "i",
+        "winner_score": "i",
+        "loser_score": "i",
+        "winner_standing": "i",
+        "loser_standing": "i",
+        "dq": "b",
+        "seen": "b",
+    }
+
+    def __init__(self):
+        self.players = Interner()
+        self.tournaments = Interner()
+        # per tournament, indexed by interned tournament id
+        self.tournament_infos = []
+        self.tournament_dates = array("q")
+        # per set
+        self.keys = dict()
+        self.tournament = array("i")
+        self.date = array("q")
+        self.winner = array("i")
+        self.loser = array("i")
+        self.winner_score = array("i")
+        self.loser_score = array("i")
+        self.winner_standing = array("i")
+        self.loser_standing = array("i")
+        self.dq = array("b")
+        self.seen = array("b")
+        # interned player -> interned tournaments they attended
+        self.player_tournaments = dict()
+
+    def __len__(self) -> int:
+        return len(self.tournament)
+
+    def __contains__(self, key: tuple) -> bool:
+        return key in self.keys
+
+    def attended(self, player_id: str, tournament_id: str) -> bool:
+        """whether a tournament was already ingested from `player_id`'s results"""
+        player = self.players.get(player_id)
+        t_idx = self.tournaments.get(tournament_id)
+        if player is None or t_idx is None:
+            return False
+        return t_idx in self.player_tournaments.get(player, ())
+
+    def add_tournament(self, player_id: str, info: dict, date: Optional[int] = None) -> bool:
+        """
+        record that `player_id` attended a tournament. returns whether this is new.
+        `date` is the start time in epoch seconds, parsed from the info if not given
+        """
+        t_idx = self.tournaments.get(info["id"])
+        if t_idx is None:
+            t_idx = self.tournaments.intern(info["id"])
+            self.tournament_infos.append(info)
+            if date is None:
+                date = parse_start_time(info["start_time"])
+            self.tournament_dates.append(date)
+        attended = self.player_tournaments.setdefault(self.players.intern(player_id), set())
+        seen = t_idx in attended
+        attended.add(t_idx)
+        return not seen
+
+    def add_set(self, key: tuple, set_data: dict, player_id: str) -> bool:
+        """
+        store a set (if it isn't stored already) as seen by `player_id`.
+        `set_data` only needs to be valid the first time a key is added.
+        returns False if `player_id` didn't play in the set
+        """
+        row = self.keys.get(key)
+        if row is None:
+            row = self.keys[key] = len(self.tournament)
+            self._append(key[0], set_data)
+        player = self.players.get(player_id)
+        if player == self.winner[row]:
+            self.seen[row] |= WINNER_SEEN
+        elif player == self.loser[row]:
+            self.seen[row] |= LOSER_SEEN
+        else:
+            return False
+        return True
+
+    def _append(self, tournament_id: str, set_data: dict) -> None:
+        t_idx = self.tournaments.intern(tournament_id)
+        winner_id = set_data["winner_id"]
+        loser_id = set_data["p2_id"] if set_data["p1_id"] == winner_id else set_data["p1_id"]
+        if set_data["p1_score"] is None or set_data["p2_score"] is None:
+            winner_score, loser_score = NO_SCORE, NO_SCORE
+        else:
+            winner_score = max(set_data["p1_score"], set_data["p2_score"])
+            loser_score = min(set_data["p1_score"], set_data["p2_score"])
+        if set_data["p1_id"] == winner_id:
+            winner_standing, loser_standing = set_data["p1_standing"], set_data["p2_standing"]
+        else:
+            winner_standing, loser_standing = set_data["p2_standing"], set_data["p1_standing"]
+        self.tournament.append(t_idx)
+        self.date.append(self.tournament_dates[t_idx])
+        self.winner.append(self.players.intern(winner_id))
+        self.loser.append(self.players.intern(loser_id))
+        self.winner_score.append(winner_score)
+        self.loser_score.append(loser_score)
+        self.winner_standing.append(winner_standing)
+        self.loser_standing.append(loser_standing)
+        self.dq.append(bool(set_data["dq"]))
+        self.seen.append(0)
+
+    def by_date(self) -> Iterator[int]:
+        """row numbers ordered by tournament start time, then ingest order"""
+        date = self.date
+        return iter(sorted(range(len(date)), key=date.__getitem__))
+
+    def tournament_info(self, row: int) -> dict:
+        return self.tournament_infos[self.tournament[row]]
+
+    def tournament_id(self, row: int) -> str:
+        return self.tournaments[self.tournament[row]]
+
+    def to_state(self) -> dict:
+        """everything in the store as lists and dicts, for any redis codec"""
+        state = dict(
+            players=self.players.ids,
+            tournaments=self.tournaments.ids,
+            tournament_infos=self.tournament_infos,
+            # in row order, like the columns
+            keys=[list(key) for key in self.keys],
+            player_tournaments=[
+                [player, sorted(attended)] for player, attended in self.player_tournaments.items()
+            ],
+        )
+        for name in self.COLUMNS:
+            state[name] = getattr(self, name).tolist()
+        return state
+
+    @classmethod
+    def from_state(cls, state: dict) -> "SetStore":
+        store = cls()
+        for id_ in state["players"]:
+            store.players.intern(id_)
+        for id_ in state["tournaments"]:
+            store.tournaments.intern(id_)
+        store.tournament_infos = state["tournament_infos"]
+        store.keys = {tuple(key): row for row, key in enumerate(state["keys"])}
+        store.player_tournaments = {
+            player: set(attended) for player, attended in state["player_tournaments"]
+        }
+        for name, typecode in cls.COLUMNS.items():
+            setattr(store, name, array(typecode, state[name]))
+        return store
@@ -0,0 +1,348 @@
+"""
+write grids, notes and formatting to google sheets in as few api calls as possible.
+
+the last grid and notes written to each worksheet are kept in redis. when they
+are known, only changed cells and notes are pushed; otherwise (first run, or
+after forget_sheet_state) the worksheet is cleared and fully rewritten.
+everything is queued on a SheetBatch and sent by flush() as one
+spreadsheets.batchUpdate plus one values.batchUpdate
+"""
+from typing import Iterable, Optional
+
+from gspread.utils import a1_range_to_grid_range, a1_to_rowcol, absolute_range_name, rowcol_to_a1
+from loguru import logger
+
+from database import getj, r, setj
+from metrics import METRICS
+
+STATE_KEY_PREFIX = "sheet_state"
+
+
+def state_key(title: str) -> str:
+    return f"{STATE_KEY_PREFIX}:{title}"
+
+
+def forget_sheet_state() -> None:
+    """make the next write to every worksheet a full rewrite"""
+    keys = list(r.scan_iter(f"{STATE_KEY_PREFIX}:*"))
+    if keys:
+        r.delete(*keys)
+
+
+def grid_to_cells(grid: list[list]) -> dict:
+    """{"row,col": value} (0-indexed) of every non-empty cell"""
+    return {
+        f"{y},{x}": value
+        for y, row in enumerate(grid)
+        for x, value in enumerate(row)
+        if value not in ("", None)
+    }
+
+
+def changed_ranges(old_cells: dict, new_cells: dict) -> list[dict]:
+    """
+    value updates turning `old_cells` into `new_cells`, with horizontally
+    adjacent changed cells merged into one range
+    """
+    changed = dict()
+    for key in old_cells.keys() | new_cells.keys():
+        value = new_cells.get(key, "")
+        if old_cells.get(key, "") != value:
+            y, x = map(int, key.split(","))
+            changed[(y, x)] = value
+    updates = []
+    run = []
+    for y, x in sorted(changed):
+        if run and (y != run[0][0] or x != run[-1][1] + 1):
+            updates.append(run_to_update(run, changed))
+            run = []
+        run.append((y, x))
+    if run:
+        updates.append(run_to_update(run, changed))
+    return updates
+
+
+def run_to_update(run: list[tuple[int, int]], changed: dict) -> dict:
+    (y, x0), (_, x1) = run[0], run[-1]
+    a1 = rowcol_to_a1(y + 1, x0 + 1)
+    if x1 != x0:
+        a1 += ":" + rowcol_to_a1(y + 1, x1 + 1)
+    return {"range": a1, "values": [[changed[cell] for cell in run]]}
+
+
+def changed_notes(old_notes: dict, new_notes: dict) -> dict:
+    """{a1: note} to send, with "" clearing notes that went away"""
+    return {
+        a1: new_notes.get(a1, "")
+        for a1 in old_notes.keys() | new_notes.keys()
+        if old_notes.get(a1, "") != new_notes.get(a1, "")
+    }
+
+
+class LocalWorksheet:
+    def __init__(self, title: str, sheet_id: int):
+        self.title = title
+        self.id = sheet_id
+        self.cells = dict()
+        self.notes = dict()
+
+
+class LocalSpreadsheet:
+    """
+    takes the batch writes of a gspread.Spreadsheet and keeps the resulting
+    cells and notes in memory, for runs that must not touch the real sheet
+    """
+
+    def __init__(self, titles: Iterable[str] = ()):
+        self.sheets = dict()
+        self.calls = 0
+        self.requests = 0
+        self.cells = 0
+        for title in titles:
+            self.add_worksheet(title, rows=0, cols=0)
+
+    def worksheets(self) -> list:
+        return list(self.sheets.values())
+
+    def add_worksheet(self, title: str, rows: int, cols: int) -> LocalWorksheet:
+        self.sheets[title] = LocalWorksheet(title, len(self.sheets))
+        return self.sheets[title]
+
+    def worksheet(self, title: str) -> LocalWorksheet:
+        return self.sheets[title]
+
+    def by_id(self, sheet_id: int) -> LocalWorksheet:
+        return next(sheet for sheet in self.sheets.values() if sheet.id == sheet_id)
+
+    def fetch_sheet_metadata(self, params=None) -> dict:
+        self.calls += 1
+        return {"sheets": [{"properties": {"sheetId": s.id}} for s in self.sheets.values()]}
+
+    def batch_update(self, body: dict) -> None:
+        self.calls += 1
+        self.requests += len(body["requests"])
+        for request in body["requests"]:
+            update = request.get("updateCells")
+            if update is None:
+                continue
+            sheet = self.by_id(update["range"]["sheetId"])
+            if "rows" in update:
+                a1 = rowcol_to_a1(
+                    update["range"]["startRowIndex"] + 1, update["range"]["startColumnIndex"] + 1
+                )
+                sheet.notes[a1] = update["rows"][0]["values"][0]["note"]
+            elif update["fields"] == "note":
+                sheet.notes.clear()
+            else:
+                sheet.cells.clear()
+
+    def values_batch_update(self, params=None, body=None) -> None:
+        self.calls += 1
+        for data in body["data"]:
+            title, a1 = data["range"].rsplit("!", 1)
+            sheet = self.sheets[title.strip("'")]
+            row, col = a1_to_rowcol(a1.split(":")[0])
+            for y, values in enumerate(data["values"]):
+                self.cells += len(values)
+                for x, value in enumerate(values):
+                    sheet.cells[f"{row - 1 + y},{col - 1 + x}"] = value
+
+    def to_dict(self) -> dict:
+        """{title: {"cells": {"row,col": value}, "notes": {a1: note}}}, empty cells and notes left out"""
+        return {
+            title: dict(
+                cells={k: v for k, v in sheet.cells.items() if v not in ("", None)},
+                notes={k: v for k, v in sheet.notes.items() if v},
+            )
+            for title, sheet in self.sheets.items()
+        }
+
+
+class SheetBatch:
+    """
+    queues every write to one spreadsheet until flush(). with `saved_state`
+    off, the redis state is neither read nor written and every grid is written in full
+    """
+
+    def __init__(self, spreadsheet, saved_state: bool = True):
+        self.spreadsheet = spreadsheet
+        self.saved_state = saved_state
+        self.requests = []
+        # sent on their own, so a bad note can't take the values and formats down with it
+        self.note_requests = []
+        self.values = []
+        self.rules = dict()
+        self.states = dict()
+
+    def update(self, cur_sheet, a1: str, values: list[list]) -> None:
+        self.values.append(
+            {"range": absolute_range_name(cur_sheet.title, a1), "values": values}
+        )
+
+    def clear(self, cur_sheet) -> None:
+        self.requests.append(
+            {
+                "updateCells": {
+                    "range": {"sheetId": cur_sheet.id},
+                    "fields": "userEnteredValue",
+                }
+            }
+        )
+
+    def clear_notes(self, cur_sheet) -> None:
+        """updateCells on the whole sheet with no data clears every note"""
+        self.note_requests.append(
+            {"updateCells": {"range": {"sheetId": cur_sheet.id}, "fields": "note"}}
+        )
+
+    def update_notes(self, cur_sheet, notes: dict) -> None:
+        for a1, note in notes.items():
+            self.note_requests.append(
+                {
+                    "updateCells": {
+                        "range": a1_range_to_grid_range(a1, cur_sheet.id),
+                        "fields": "note",
+                        "rows": [{"values": [{"note": note}]}],
+                    }
+                }
+            )
+
+    def format(self, cur_sheet, a1: str, cell_format: dict) -> None:
+        self.requests.append(
+            {
+                "repeatCell": {
+                    "range": a1_range_to_grid_range(a1, cur_sheet.id),
+                    "cell": {"userEnteredFormat": cell_format},
+                    "fields": f"userEnteredFormat({','.join(cell_format)})",
+                }
+            }
+        )
+
+    def set_column_width(self, cur_sheet, columns: str, width: int) -> None:
+        grid_range = a1_range_to_grid_range(columns, cur_sheet.id)
+        self.requests.append(
+            {
+                "updateDimensionProperties": {
+                    "range": {
+                        "sheetId": cur_sheet.id,
+                        "dimension": "COLUMNS",
+                        "startIndex": grid_range["startColumnIndex"],
+                        "endIndex": grid_range["endColumnIndex"],
+                    },
+                    "properties": {"pixelSize": width},
+                    "fields": "pixelSize",
+                }
+            }
+        )
+
+    def freeze(self, cur_sheet, rows: int = 0, cols: int = 0) -> None:
+        self.requests.append(
+            {
+                "updateSheetProperties": {
+                    "properties": {
+                        "sheetId": cur_sheet.id,
+                        "gridProperties": {
+                            "frozenRowCount": rows,
+                            "frozenColumnCount": cols,
+                        },
+                    },
+                    "fields": "gridProperties(frozenRowCount,frozenColumnCount)",
+                }
+            }
+        )
+
+    def set_conditional_format_rules(self, cur_sheet, rules: list) -> None:
+        """replace every conditional format rule on the sheet with `rules`"""
+        self.rules[cur_sheet.id] = [rule.to_props() for rule in rules]
+
+    def write_grid(self, cur_sheet, grid: list[list], notes: Optional[dict] = None) -> None:
+        """queue `grid` (from A1) and `notes`, only the difference if the last write is known"""
+        notes = {a1: note for a1, note in (notes or {}).items() if note}
+        new_state = dict(cells=grid_to_cells(grid), notes=notes)
+        old_state = getj(state_key(cur_sheet.title)) if self.saved_state else None
+        if old_state is None:
+            logger.info(f"no saved state for {cur_sheet.title}, rewriting it fully")
+            self.clear(cur_sheet)
+            self.update(cur_sheet, "A1", grid)
+            self.clear_notes(cur_sheet)
+            self.update_notes(cur_sheet, notes)
+            cells_written = sum(len(row) for row in grid)
+            notes_written = len(notes)
+        else:
+            updates = changed_ranges(old_state["cells"], new_state["cells"])
+            note_updates = changed_notes(old_state["notes"], notes)
+            logger.info(
+                f"{cur_sheet.title}: {len(updates)} changed ranges, {len(note_updates)} changed notes"
+            )
+            for update in updates:
+                self.update(cur_sheet, update["range"], update["values"])
+            self.update_notes(cur_sheet, note_updates)
+            cells_written = sum(len(update["values"][0]) for update in updates)
+            notes_written = len(note_updates)
+        METRICS.inc("sheet_cells_written_total", cells_written, sheet=cur_sheet.title)
+        METRICS.inc("sheet_notes_written_total", notes_written, sheet=cur_sheet.title)
+        # only saved once flush() has sent it
+        if self.saved_state:
+            self.states[cur_sheet.title] = new_state
+
+    def conditional_format_requests(self) -> list[dict]:
+        if not self.rules:
+            return []
+        with self.api_call("fetch_sheet_metadata"):
+            metadata = self.spreadsheet.fetch_sheet_metadata(
+                {"fields": "sheets(properties.sheetId,conditionalFormats)"}
+            )
+        existing = {
+            sheet["properties"]["sheetId"]: len(sheet.get("conditionalFormats", []))
+            for sheet in metadata["sheets"]
+        }
+        requests = []
+        for sheet_id, rules in self.rules.items():
+            for _ in range(existing.get(sheet_id, 0)):
+                requests.append(
+                    {"deleteConditionalFormatRule": {"sheetId": sheet_id, "index": 0}}
+                )
+            for index, rule in enumerate(rules):
+                requests.append({"addConditionalFormatRule": {"rule": rule, "index": index}})
+        return requests
+
+    def api_call(self, call: str):
+        METRICS.inc("sheets_api_calls_total", call=call)
+        return METRICS.timer("sheets_api_seconds", call=call)
+
+    def flush(self) -> None:
+        """
+        send everything queued: one batchUpdate, one values batchUpdate, then the
+        notes in a batchUpdate of their own. a failed note batch is logged and
+        the run goes on, without saving the sheet state so the next run retries it
+        """
+        requests = self.requests + self.conditional_format_requests()
+        logger.info(
+            f"flushing {len(requests)} sheet requests, {len(self.values)} value ranges "
+            f"and {len(self.note_requests)} note requests"
+        )
+        METRICS.inc("sheet_requests_total", len(requests) + len(self.note_requests))
+        METRICS.inc("sheet_value_ranges_total", len(self.values))
+        if requests:
+            with self.api_call("batch_update"):
+                self.spreadsheet.batch_update({"requests": requests})
+        if self.values:
+            with self.api_call("values_batch_update"):
+                self.spreadsheet.values_batch_update(
+                    body={"valueInputOption": "RAW", "data": self.values}
+                )
+        notes_sent = True
+        if self.note_requests:
+            try:
+                with self.api_call("batch_update"):
+                    self.spreadsheet.batch_update({"requests": self.note_requests})
+            except Exception as e:
+                # the batch is atomic: none of the notes changed, the last saved state still holds
+                logger.error(f"could not write {len(self.note_requests)} note requests: {e}")
+                METRICS.inc("sheet_note_errors_total")
+                notes_sent = False
+        if notes_sent:
+            for title, state in self.states.items():
+                setj(state_key(title), state)
+        self.requests, self.note_requests, self.values = [], [], []
+        self.rules, self.states = dict(), dict()
@@ -0,0 +1,157 @@
+"""
+a scrape, frozen into one file.
+
+the file maps the same keys the scraper writes to redis ("{id}:results",
+"{id}:profile", the sheet snapshot, badge counts) to values encoded with
+database.encode. it is laid out as
+
+    MAGIC | value | value | ... | index | index offset (8 bytes, little endian) | MAGIC
+
+where the index is an encoded {key: [offset, length]}. readers mmap the file
+and only decode the values they ask for, so parse can replay a scrape with
+no network and no redis
+"""
+import mmap
+import os
+import struct
+import threading
+from datetime import datetime, timezone
+from typing import Iterable, Optional
+
+from database import decode, encode
+
+MAGIC = b"NCPRSNP1"
+FOOTER = struct.Struct("<Q")
+SNAPSHOT_SUFFIX = ".snap"
+
+# keys that aren't per player
+SHEET_KEY = "sheet_snapshot"
+COPY_BADGE_COUNT_KEY = "copy_badge_count_from"
+BADGE_COUNTS_KEY = "badge_counts"
+
+
+def snapshot_path(directory: str) -> str:
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    return os.path.join(directory, f"scrape-{stamp}{SNAPSHOT_SUFFIX}")
+
+
+def list_snapshots(directory: str) -> list[str]:
+    """finished snapshots in `directory`, oldest first"""
+    names = sorted(
+        name
+        for name in os.listdir(directory)
+        if name.startswith("scrape-") and name.endswith(SNAPSHOT_SUFFIX)
+    )
+    return [os.path.join(directory, name) for name in names]
+
+
+def latest_snapshot(directory: str) -> Optional[str]:
+    """the newest finished snapshot in `directory`, if any"""
+    snapshots = list_snapshots(directory)
+    return snapshots[-1] if snapshots else None
+
+
+def prune_snapshots(directory: str, keep: int) -> list[str]:
+    """delete all but the newest `keep` snapshots, returning the deleted paths"""
+    snapshots = list_snapshots(directory)
+    stale = snapshots[: max(0, len(snapshots) - keep)]
+    for path in stale:
+        os.remove(path)
+    return stale
+
+
+class SnapshotWriter:
+    """
+    appends values to a snapshot from any number of threads.
+    the file only appears at `path` once close() has written the index
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.partial_path = path + ".part"
+        self.file = open(self.partial_path, "wb")
+        self.file.write(MAGIC)
+        self.index = dict()
+        self.lock = threading.Lock()
+
+    def put(self, key: str, value) -> None:
+        data = encode(value)
+        with self.lock:
+            self.index[key] = [self.file.tell(), len(data)]
+            self.file.write(data)
+
+    def put_many(self, values: dict) -> None:
+        for key, value in values.items():
+            self.put(key, value)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.index
+
+    def close(self) -> None:
+        with self.lock:
+            index_offset = self.file.tell()
+            self.file.write(encode(self.index))
+            self.file.write(FOOTER.pack(index_offset) + MAGIC)
+            self.file.close()
+        os.replace(self.partial_path, self.path)
+
+    def discard(self) -> None:
+        self.file.close()
+        os.remove(self.partial_path)
+
+    def __enter__(self) -> "SnapshotWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+class SnapshotReader:
+    """random access to the values of a finished snapshot"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        footer_size = FOOTER.size + len(MAGIC)
+        if (
+            len(self.mm) < len(MAGIC) + footer_size
+            or self.mm[: len(MAGIC)] != MAGIC
+            or self.mm[-len(MAGIC) :] != MAGIC
+        ):
+            self.mm.close()
+            raise ValueError(f"{path} is not a finished scrape snapshot")
+        (index_offset,) = FOOTER.unpack(self.mm[-footer_size : -len(MAGIC)])
+        self.index = decode(self.mm[index_offset : len(self.mm) - footer_size])
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.index
+
+    def keys(self) -> list[str]:
+        return list(self.index)
+
+    def get(self, key: str):
+        """the decoded value for `key`, None if it isn't in the snapshot"""
+        location = self.index.get(key)
+        if location is None:
+            return None
+        offset, length = location
+        return decode(self.mm[offset : offset + length])
+
+    def get_many(self, keys: Iterable[str]) -> list:
+        return [self.get(key) for key in keys]
+
+    def close(self) -> None:
+        self.mm.close()
+
+    def __enter__(self) -> "SnapshotReader":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
@@ -0,0 +1,208 @@
+"""
+pgstats-shaped players, results and profiles, made up at any scale.
+
+a SyntheticWorld is a pool of players (the first `sheet_players` of them on the
+input sheet), tournaments between them, and the sheet tabs that go with it:
+alt accounts listed under "^" rows, player swaps and banned tournaments.
+the same seed always gives the same world
+"""
+import random
+from datetime import datetime, timedelta
+from typing import Optional
+
+PGSTATS_PLAYER_URL = "https://www.pgstats.com/melee/player/{tag}?id={player_id}"
+SCORES = [(3, 0), (3, 1), (3, 2), (2, 0), (2, 1), (2, 0), (2, 1)]
+# unreported scores and dqs, as (winner score, loser score)
+NO_SCORE = (None, None)
+DQ_SCORE = (0, -1)
+CITIES = [("San Francisco", "CA"), ("San Jose", "CA"), ("Sacramento", "CA"), ("Berkeley", "CA")]
+
+
+class SyntheticWorld:
+    def __init__(
+        self,
+        players: int = 400,
+        sheet_players: int = 100,
+        tournaments: int = 300,
+        entrants: int = 48,
+        sets_per_tournament: int = 60,
+        combine_rate: float = 0.05,
+        swap_rate: float = 0.02,
+        ban_rate: float = 0.01,
+        online_rate: float = 0.05,
+        start: datetime = datetime(2023, 1, 1),
+        end: datetime = datetime(2024, 7, 1),
+        seed: int = 0,
+    ):
+        self.random = random.Random(seed)
+        self.start, self.end = start, end
+        self.player_ids = [str(1000 + i) for i in range(players)]
+        self.sheet_ids = self.player_ids[:sheet_players]
+        self.tags = {player_id: f"player{player_id}" for player_id in self.player_ids}
+        self.skill = {player_id: self.random.random() for player_id in self.player_ids}
+        # main account -> alt account it sometimes enters brackets with
+        self.alts = {
+            player_id: f"{player_id}alt"
+            for player_id in self.sheet_ids
+            if self.random.random() < combine_rate
+        }
+        for main_id, alt_id in self.alts.items():
+            self.tags[alt_id] = self.tags[main_id]
+        self.tournaments = dict()
+        self.swaps = []
+        self.banned = []
+        for t in range(tournaments):
+            info, sets = self.make_tournament(
+                str(500000 + t), min(entrants, players), sets_per_tournament, online_rate
+            )
+            self.tournaments[info["id"]] = (info, sets)
+            if self.random.random() < swap_rate and sets:
+                # someone played this bracket on another player's account
+                bracket_id = self.random.choice(sets)["p1_id"]
+                self.swaps.append((info["id"], bracket_id, self.random.choice(self.player_ids)))
+            if self.random.random() < ban_rate:
+                self.banned.append(info["id"])
+        self.results_by_player = self.index_results()
+
+    def make_tournament(
+        self, tournament_id: str, entrants: int, sets_per_tournament: int, online_rate: float
+    ) -> tuple[dict, list]:
+        rand = self.random
+        span = int((self.end - self.start).total_seconds())
+        start_time = self.start + timedelta(seconds=rand.randrange(span))
+        city, state = rand.choice(CITIES)
+        info = dict(
+            id=tournament_id,
+            start_time=start_time.strftime("%Y-%m-%dT%H:%M:%S"),
+            online=rand.random() < online_rate,
+            tournament_name=f"Synthetic Weekly {tournament_id}",
+            event_name="Melee Singles",
+            attendees=entrants,
+            location=dict(city=city, state=state, country="US"),
+        )
+        field = [self.entry_id(player_id) for player_id in rand.sample(self.player_ids, entrants)]
+        standings = dict(zip(field, rand.sample(range(1, entrants + 1), entrants)))
+        sets = []
+        for k in range(sets_per_tournament):
+            p1, p2 = rand.sample(field, 2)
+            s1, s2 = self.skill[self.main_id(p1)], self.skill[self.main_id(p2)]
+            winner = p1 if rand.random() < 0.5 + (s1 - s2) / 2 else p2
+            roll = rand.random()
+            if roll < 0.01:
+                win_score, lose_score = NO_SCORE
+            elif roll < 0.03:
+                win_score, lose_score = DQ_SCORE
+            else:
+                win_score, lose_score = rand.choice(SCORES)
+            p1_score, p2_score = (
+                (win_score, lose_score) if winner == p1 else (lose_score, win_score)
+            )
+            sets.append(
+                dict(
+                    id=int(tournament_id) * 1000 + k,
+                    event_id=tournament_id,
+                    p1_id=p1,
+                    p2_id=p2,
+                    winner_id=winner,
+                    p1_tag=self.tags[p1],
+                    p2_tag=self.tags[p2],
+                    p1_score=p1_score,
+                    p2_score=p2_score,
+                    p1_standing=standings[p1],
+                    p2_standing=standings[p2],
+                    dq=(win_score, lose_score) == DQ_SCORE,
+                )
+            )
+        return info, sets
+
+    def entry_id(self, player_id: str) -> str:
+        """the account a player enters a bracket with"""
+        if player_id in self.alts and self.random.random() < 0.3:
+            return self.alts[player_id]
+        return player_id
+
+    def main_id(self, player_id: str) -> str:
+        return player_id[: -len("alt")] if player_id.endswith("alt") else player_id
+
+    def index_results(self) -> dict:
+        """player id (accounts separately) -> pgstats results payload"""
+        results = dict()
+        for tournament_id, (info, sets) in self.tournaments.items():
+            for set_data in sets:
+                for key in ("p1_id", "p2_id"):
+                    tournament = results.setdefault(set_data[key], dict()).setdefault(
+                        tournament_id, dict(info=info, sets=[])
+                    )
+                    tournament["sets"].append(set_data)
+        return results
+
+    @property
+    def scraped_ids(self) -> list[str]:
+        """every account the scraper downloads: sheeted players and their alts"""
+        ids = []
+        for player_id in self.sheet_ids:
+            ids.append(player_id)
+            if player_id in self.alts:
+                ids.append(self.alts[player_id])
+        return ids
+
+    def results(self, player_id: str) -> dict:
+        return self.results_by_player.get(player_id, dict())
+
+    def profile(self, player_id: str) -> Optional[dict]:
+        """an untrimmed /players/profile result"""
+        if player_id not in self.tags:
+            return None
+        results = self.results(player_id)
+        badges = [
+            dict(tournament_id=tournament_id, online=tournament["info"]["online"])
+            for tournament_id, tournament in results.items()
+            if self.skill[self.main_id(player_id)] > 0.5
+        ]
+        placings = [
+            dict(tournament_id=tournament_id, standing=tournament["sets"][0]["p1_standing"])
+            for tournament_id, tournament in results.items()
+        ]
+        return dict(
+            id=player_id,
+            tag=self.tags[player_id],
+            badges=dict(by_events=badges),
+            placings=placings,
+        )
+
+    def badge_counts(self) -> dict:
+        """offline badges of every account, alts included"""
+        return {
+            player_id: float(len([b for b in profile["badges"]["by_events"] if not b["online"]]))
+            for player_id in self.tags
+            for profile in [self.profile(player_id)]
+        }
+
+    def player_url(self, player_id: str) -> str:
+        return PGSTATS_PLAYER_URL.format(tag=self.tags[player_id], player_id=player_id)
+
+    def sheet_tabs(self) -> dict:
+        """the input sheet tabs, as scrape.fetch_sheet_snapshot reads them"""
+        players = [["tag", "pgstats url", "copy badge count from"]]
+        for player_id in self.sheet_ids:
+            players.append([self.tags[player_id], self.player_url(player_id), ""])
+            if player_id in self.alts:
+                players.append(["^", self.player_url(self.alts[player_id]), ""])
+        swapper = [["tournament id", "bracket player", "actual player", "note"]]
+        for tournament_id, bracket_id, actual_id in self.swaps:
+            swapper.append(
+                [tournament_id, f"?id={bracket_id}", self.player_url(actual_id), "synthetic"]
+            )
+        return dict(
+            players=players,
+            banned_tournaments=[["tournament id"]] + [[t] for t in self.banned],
+            player_swapper=swapper,
+            combine=[["combine"]],
+            past_ranking_periods=[
+                ["name", "start", "end"],
+                ["synthetic", self.start.strftime("%Y-%m-%d"), self.end.strftime("%Y-%m-%d")],
+            ],
+        )
+
+    def sheet_snapshot(self) -> dict:
+        return dict(version="synthetic", fetched_at=0, tabs=self.sheet_tabs())
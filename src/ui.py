@@ -1,11 +1,112 @@
-# make a streamlit site
+"""
+a read-only dashboard over the views parse.py publishes to redis.
+
+    pip install streamlit
+    streamlit run src/ui.py
+
+pages never touch the google sheet. each view is read from redis once per
+parse run and then served from streamlit's cache, which is keyed by the view
+version, so a new run shows up on the next page load
+"""
 import streamlit as st
 
-input_player = st.text_input(
-    "input player", "https://www.pgstats.com/melee/player/Kevbot?id=S12293"
+from views import (
+    META_VIEW,
+    PLAYERS_VIEW,
+    TOURNAMENTS_VIEW,
+    current_version,
+    load_view,
+    player_view_name,
 )
-st.write("Current PGStats link is", input_player)
 
-operation = st.radio("What's your favorite movie genre", ("add", "remove", "combine"))
+PAGES = ["head to head", "player", "tournaments considered"]
+
+
+@st.cache_data(max_entries=1024, show_spinner=False)
+def cached_view(version: str, name: str):
+    """one view of one run. runs never change once published, so nothing here goes stale"""
+    return load_view(version, name)
+
+
+def opponent_rows(view: dict, opponent_ids: list[str]) -> list[dict]:
+    rows = []
+    for opponent_id in opponent_ids:
+        opponent = view["opponents"][opponent_id]
+        won_games, lost_games = opponent["games"]
+        rows.append(
+            dict(
+                opponent=opponent["name"],
+                record=f"{opponent['wins']}-{opponent['losses']}",
+                games=f"{won_games}-{lost_games}",
+            )
+        )
+    return rows
+
+
+def h2h_page(version: str, players: list[dict]) -> None:
+    names = {player["id"]: player["name"] for player in players}
+    player_ids = list(names)
+    left, right = st.columns(2)
+    player_id = left.selectbox("player", player_ids, format_func=names.get)
+    opponent_id = right.selectbox(
+        "opponent", player_ids, index=min(1, len(player_ids) - 1), format_func=names.get
+    )
+    view = cached_view(version, player_view_name(player_id))
+    record = view["opponents"].get(opponent_id) if view else None
+    if record is None:
+        st.info(f"{names[player_id]} and {names[opponent_id]} haven't played this period")
+        return
+    won_games, lost_games = record["games"]
+    st.subheader(f"{names[player_id]} vs {names[opponent_id]}: {record['wins']}-{record['losses']}")
+    st.write(f"game count: {won_games}-{lost_games} in {record['wins'] + record['losses']} sets")
+    st.table([dict(set=line) for line in record["history"]])
+
+
+def player_page(version: str, players: list[dict]) -> None:
+    names = {player["id"]: player["name"] for player in players}
+    player_id = st.selectbox("player", list(names), format_func=names.get)
+    view = cached_view(version, player_view_name(player_id))
+    if view is None:
+        st.info(f"no sets for {names[player_id]} this period")
+        return
+    st.subheader(f"{view['name']} ({view['wins'] + view['losses']}s | {view['tournaments']}t)")
+    wins, losses = st.columns(2)
+    wins.markdown(f"**wins** ({view['wins']})")
+    wins.dataframe(opponent_rows(view, view["beat"]), hide_index=True, use_container_width=True)
+    losses.markdown(f"**losses** ({view['losses']})")
+    losses.dataframe(opponent_rows(view, view["lost_to"]), hide_index=True, use_container_width=True)
+
+
+def tournaments_page(version: str) -> None:
+    tournaments = cached_view(version, TOURNAMENTS_VIEW)
+    st.dataframe(tournaments, hide_index=True, use_container_width=True)
+
+
+def main():
+    st.set_page_config(page_title="norcal melee pr data", layout="wide")
+    version = current_version()
+    if version is None:
+        st.warning("nothing published yet, run python src/parse.py first")
+        st.stop()
+    meta = cached_view(version, META_VIEW)
+    players = cached_view(version, PLAYERS_VIEW)
+    if meta is None or players is None:
+        st.warning(f"the views of run {version} are gone, nothing published since they expired")
+        st.stop()
+
+    st.sidebar.title("norcal melee pr data")
+    page = st.sidebar.radio("page", PAGES)
+    st.sidebar.caption(
+        f"{meta['period']}: {meta['start'][:10]} to {meta['end'][:10]}, "
+        f"{meta['sets']} sets between {meta['players']} players. "
+        f"updated {meta['updated_at'][:16].replace('T', ' ')}"
+    )
+    if page == "head to head":
+        h2h_page(version, players)
+    elif page == "player":
+        player_page(version, players)
+    else:
+        tournaments_page(version)
+
 
-st.table([1, 2, 3, 4])
+main()
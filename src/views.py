@@ -0,0 +1,59 @@
+"""
+precomputed, read-only views of a parse run, for the dashboard and the api.
+
+parse.py writes every view of a run under view:{version}:{name} and only then
+points view:version at it, so a reader never mixes two runs. readers cache
+by version: one GET of view:version tells them whether anything changed
+"""
+import time
+import uuid
+from datetime import timedelta
+from typing import Optional
+
+from database import getj, getj_many, r, setj_many
+
+VIEW_KEY_PREFIX = "view"
+VIEW_VERSION_KEY = f"{VIEW_KEY_PREFIX}:version"
+# long enough that a reader still on the previous run can finish with it
+VIEW_TTL = timedelta(days=3)
+
+# names of the views one run writes, besides one "player:{id}" per player
+PLAYERS_VIEW = "players"
+TOURNAMENTS_VIEW = "tournaments"
+# tournament id -> the sheeted players there, best placing first
+ROSTERS_VIEW = "rosters"
+META_VIEW = "meta"
+
+
+def new_version() -> str:
+    return time.strftime("%Y%m%dT%H%M%S", time.gmtime()) + f"-{uuid.uuid4().hex[:6]}"
+
+
+def view_key(version: str, name: str) -> str:
+    return f"{VIEW_KEY_PREFIX}:{version}:{name}"
+
+
+def player_view_name(player_id: str) -> str:
+    return f"player:{player_id}"
+
+
+def publish_views(views: dict, version: Optional[str] = None) -> str:
+    """write {name: view} as a new version, then make it the current one"""
+    version = version or new_version()
+    setj_many({view_key(version, name): view for name, view in views.items()}, ex=VIEW_TTL)
+    # expires with the views, so it never points at a run that is gone
+    r.set(VIEW_VERSION_KEY, version, ex=VIEW_TTL)
+    return version
+
+
+def current_version() -> Optional[str]:
+    version = r.get(VIEW_VERSION_KEY)
+    return None if version is None else version.decode()
+
+
+def load_view(version: str, name: str):
+    return getj(view_key(version, name))
+
+
+def load_views(version: str, names: list[str]) -> dict:
+    return dict(zip(names, getj_many([view_key(version, name) for name in names])))
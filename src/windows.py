@@ -0,0 +1,105 @@
+"""
+answer win/loss and h2h questions for any date window from one pass over the set store
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import datetime
+from typing import NamedTuple
+
+from setstore import LOSER_SEEN, WINNER_SEEN, SetStore, to_epoch
+
+# the ranking period published to the sheet, unless parse.py is given --period
+CUT_OFF_DATE_START = datetime(2024, 1, 1)
+CUT_OFF_DATE_END = datetime(2024, 7, 1)
+
+
+class RankingPeriod(NamedTuple):
+    name: str
+    start: datetime
+    end: datetime
+
+
+def count_between(dates: array, start: int, end: int) -> int:
+    """how many of the sorted `dates` fall in [start, end]"""
+    return bisect_right(dates, end) - bisect_left(dates, start)
+
+
+class RankingWindows:
+    """
+    sets sorted by date once, plus per-player and per-pair sorted date lists
+    of every counted win and loss. any window query is then a pair of bisects.
+    like the wins/losses sheets, a win only counts if the winner's results
+    contained the set (and a loss if the loser's did), and dqs never count
+    """
+
+    def __init__(self, store: SetStore):
+        self.store = store
+        self.order = array("i", sorted(range(len(store)), key=store.date.__getitem__))
+        self.dates = array("q", (store.date[row] for row in self.order))
+        self.win_dates = defaultdict(lambda: array("q"))
+        self.loss_dates = defaultdict(lambda: array("q"))
+        self.player_win_dates = defaultdict(lambda: array("q"))
+        self.player_loss_dates = defaultdict(lambda: array("q"))
+        self.opponents = defaultdict(set)
+        for row, date in zip(self.order, self.dates):
+            if store.dq[row]:
+                continue
+            winner, loser, seen = store.winner[row], store.loser[row], store.seen[row]
+            if seen & WINNER_SEEN:
+                self.win_dates[(winner, loser)].append(date)
+                self.player_win_dates[winner].append(date)
+                self.opponents[winner].add(loser)
+            if seen & LOSER_SEEN:
+                self.loss_dates[(loser, winner)].append(date)
+                self.player_loss_dates[loser].append(date)
+                self.opponents[loser].add(winner)
+
+    def rows_between(self, start: datetime, end: datetime) -> array:
+        """store rows (dqs included) whose tournament starts in [start, end], by date"""
+        lo = bisect_left(self.dates, to_epoch(start))
+        hi = bisect_right(self.dates, to_epoch(end))
+        return self.order[lo:hi]
+
+    def record(self, player_id: str, start: datetime, end: datetime) -> tuple[int, int]:
+        """(wins, losses) of a player in the window"""
+        player = self.store.players.get(player_id)
+        start, end = to_epoch(start), to_epoch(end)
+        return (
+            count_between(self.player_win_dates.get(player, ()), start, end),
+            count_between(self.player_loss_dates.get(player, ()), start, end),
+        )
+
+    def h2h(
+        self, player_id: str, opponent_id: str, start: datetime, end: datetime
+    ) -> tuple[int, int]:
+        """(wins, losses) of a player against one opponent in the window"""
+        key = (self.store.players.get(player_id), self.store.players.get(opponent_id))
+        start, end = to_epoch(start), to_epoch(end)
+        return (
+            count_between(self.win_dates.get(key, ()), start, end),
+            count_between(self.loss_dates.get(key, ()), start, end),
+        )
+
+    def period_summary(self, period: RankingPeriod, player_ids: list[str]) -> dict:
+        """records and non-empty h2hs between `player_ids` for one period, json-ready"""
+        players = self.store.players
+        wanted = {players.get(p) for p in player_ids} - {None}
+        records = dict()
+        h2h = []
+        for player_id in player_ids:
+            wins, losses = self.record(player_id, period.start, period.end)
+            records[player_id] = dict(wins=wins, losses=losses)
+            player = players.get(player_id)
+            for opponent in sorted(self.opponents.get(player, set()) & wanted):
+                opponent_id = players[opponent]
+                wins, losses = self.h2h(player_id, opponent_id, period.start, period.end)
+                if wins or losses:
+                    h2h.append([player_id, opponent_id, wins, losses])
+        return dict(
+            name=period.name,
+            start=period.start.isoformat(),
+            end=period.end.isoformat(),
+            records=records,
+            h2h=h2h,
+        )
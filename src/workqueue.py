@@ -0,0 +1,246 @@
+"""
+a redis work queue that any number of processes, on any number of machines, can drain.
+
+a run is a fixed set of items (player ids for the scraper). workers claim
+an item by moving it from the run's pending list into its lease zset, scored
+by when the lease runs out, and keep renewing the lease while they work on it.
+an item whose lease ran out (the worker died or hung) is put back by reap(),
+and an item that failed `max_attempts` times is parked in the failed hash.
+all keys live under queue:{run id}: and expire RUN_TTL after they were last written
+"""
+import socket
+import threading
+import time
+import uuid
+from typing import Callable, Iterable, Optional
+
+import redis
+from loguru import logger
+
+from database import encode, getj, r
+
+QUEUE_KEY_PREFIX = "queue"
+CURRENT_RUN_KEY = f"{QUEUE_KEY_PREFIX}:current"
+# seconds
+LEASE_SECONDS = 120
+MAX_ATTEMPTS = 3
+# runs (and their keys) are dropped after this long
+RUN_TTL = 3 * 24 * 60 * 60
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{uuid.uuid4().hex[:8]}"
+
+
+class WorkQueue:
+    def __init__(self, run_id: str, lease_seconds: float = LEASE_SECONDS, max_attempts: int = MAX_ATTEMPTS):
+        self.run_id = run_id
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    def key(self, name: str) -> str:
+        return f"{QUEUE_KEY_PREFIX}:{self.run_id}:{name}"
+
+    @classmethod
+    def create(cls, items: Iterable[str], options: Optional[dict] = None, **kwargs) -> "WorkQueue":
+        """start a new run over `items` and make it the current one"""
+        run_id = time.strftime("%Y%m%dT%H%M%S", time.gmtime()) + f"-{uuid.uuid4().hex[:6]}"
+        queue = cls(run_id, **kwargs)
+        items = list(dict.fromkeys(items))
+        meta = dict(total=len(items), created_at=time.time(), options=options or dict())
+        pipe = r.pipeline()
+        if items:
+            pipe.sadd(queue.key("items"), *items)
+            pipe.rpush(queue.key("pending"), *items)
+            queue.expire(pipe, "items", "pending")
+        pipe.set(queue.key("meta"), encode(meta), ex=RUN_TTL)
+        pipe.set(CURRENT_RUN_KEY, run_id, ex=RUN_TTL)
+        pipe.execute()
+        logger.info(f"queued {len(items)} items as run {run_id}")
+        return queue
+
+    @classmethod
+    def current(cls, **kwargs) -> Optional["WorkQueue"]:
+        run_id = r.get(CURRENT_RUN_KEY)
+        if run_id is None:
+            return None
+        return cls(run_id.decode(), **kwargs)
+
+    def expire(self, pipe, *names: str) -> None:
+        """queue up a RUN_TTL expiry on each of the run's `names` keys, along with the writes to them"""
+        for name in names:
+            pipe.expire(self.key(name), RUN_TTL)
+
+    @property
+    def meta(self) -> dict:
+        return getj(self.key("meta")) or dict()
+
+    def claim(self, worker: str) -> Optional[str]:
+        """lease the next pending item to `worker`, None when nothing is pending"""
+
+        def move(pipe) -> Optional[str]:
+            item = pipe.lindex(self.key("pending"), 0)
+            if item is None:
+                return None
+            pipe.multi()
+            pipe.lpop(self.key("pending"))
+            pipe.zadd(self.key("leases"), {item: time.time() + self.lease_seconds})
+            pipe.hset(self.key("owners"), item, worker)
+            pipe.hincrby(self.key("attempts"), item, 1)
+            self.expire(pipe, "leases", "owners", "attempts")
+            return item.decode()
+
+        # the pending list is watched, so two workers never lease the same item
+        return r.transaction(move, self.key("pending"), value_from_callable=True)
+
+    def renew(self, worker: str, items: Iterable[str]) -> None:
+        """push back the leases `worker` still holds and record that it is alive"""
+        items = list(items)
+        pipe = r.pipeline()
+        if items:
+            owners = r.hmget(self.key("owners"), items)
+            held = {
+                item: time.time() + self.lease_seconds
+                for item, owner in zip(items, owners)
+                if owner is not None and owner.decode() == worker
+            }
+            if held:
+                # xx: a lease reap() already took back stays taken back
+                pipe.zadd(self.key("leases"), held, xx=True)
+        pipe.hset(self.key("workers"), worker, time.time())
+        self.expire(pipe, "workers")
+        pipe.execute()
+
+    def complete(self, item: str) -> None:
+        pipe = r.pipeline()
+        pipe.zrem(self.key("leases"), item)
+        pipe.hdel(self.key("owners"), item)
+        # in case it was reaped and requeued while this worker was still on it
+        pipe.lrem(self.key("pending"), 0, item)
+        pipe.sadd(self.key("done"), item)
+        self.expire(pipe, "done")
+        pipe.execute()
+
+    def fail(self, item: str, error: str) -> bool:
+        """give the item up, retrying it unless it ran out of attempts. returns whether it was requeued"""
+        if not r.zrem(self.key("leases"), item):
+            # reaped already, and requeued or failed there
+            return False
+        r.hdel(self.key("owners"), item)
+        return self.requeue_or_park(item, error)
+
+    def requeue_or_park(self, item: str, error: str) -> bool:
+        attempts = int(r.hget(self.key("attempts"), item) or 0)
+        pipe = r.pipeline()
+        if attempts < self.max_attempts:
+            pipe.rpush(self.key("pending"), item)
+            self.expire(pipe, "pending")
+        else:
+            pipe.hset(self.key("failed"), item, error)
+            self.expire(pipe, "failed")
+        pipe.execute()
+        return attempts < self.max_attempts
+
+    def reap(self) -> list[str]:
+        """take back the items whose lease ran out, returning them"""
+        expired = r.zrangebyscore(self.key("leases"), 0, time.time())
+        reaped = []
+        for item in expired:
+            # only one of the workers reaping at the same time gets each item
+            if not r.zrem(self.key("leases"), item):
+                continue
+            item = item.decode()
+            owner = r.hget(self.key("owners"), item)
+            r.hdel(self.key("owners"), item)
+            owner = owner.decode() if owner else "?"
+            logger.warning(f"lease on {item} held by {owner} ran out")
+            self.requeue_or_park(item, f"lease held by {owner} ran out")
+            reaped.append(item)
+        return reaped
+
+    def drained(self) -> bool:
+        """nothing pending and nothing leased: every item is done or failed"""
+        pipe = r.pipeline(transaction=False)
+        pipe.llen(self.key("pending"))
+        pipe.zcard(self.key("leases"))
+        pending, leased = pipe.execute()
+        return pending == 0 and leased == 0
+
+    def progress(self) -> dict:
+        pipe = r.pipeline(transaction=False)
+        pipe.llen(self.key("pending"))
+        pipe.zcard(self.key("leases"))
+        pipe.scard(self.key("done"))
+        pipe.hgetall(self.key("failed"))
+        pipe.hgetall(self.key("workers"))
+        pending, leased, done, failed, workers = pipe.execute()
+        now = time.time()
+        return dict(
+            run=self.run_id,
+            total=self.meta.get("total", 0),
+            pending=pending,
+            leased=leased,
+            done=done,
+            failed={k.decode(): v.decode() for k, v in failed.items()},
+            # seconds since each worker last renewed its leases
+            workers={k.decode(): round(now - float(v), 1) for k, v in workers.items()},
+        )
+
+    def work(self, handle: Callable[[str], None], worker: Optional[str] = None, threads: int = 1) -> int:
+        """
+        claim and `handle` items with `threads` threads until the run is drained.
+        an exception from `handle` counts as a failed attempt. returns how many items this worker completed
+        """
+        worker = worker or worker_name()
+        held = set()
+        lock = threading.Lock()
+        stop = threading.Event()
+        completed = [0]
+
+        def heartbeat() -> None:
+            while not stop.wait(self.lease_seconds / 3):
+                with lock:
+                    items = list(held)
+                try:
+                    self.renew(worker, items)
+                except redis.RedisError as e:
+                    logger.error(f"could not renew leases: {e}")
+
+        def loop() -> None:
+            while not stop.is_set():
+                item = self.claim(worker)
+                if item is None:
+                    self.reap()
+                    if self.drained():
+                        return
+                    # others are still on the last items; one of them may die
+                    time.sleep(min(5, self.lease_seconds / 3))
+                    continue
+                with lock:
+                    held.add(item)
+                try:
+                    handle(item)
+                except Exception as e:
+                    requeued = self.fail(item, str(e))
+                    logger.error(f"{worker} failed {item} ({'retrying' if requeued else 'giving up'}): {e}")
+                else:
+                    self.complete(item)
+                    with lock:
+                        completed[0] += 1
+                finally:
+                    with lock:
+                        held.discard(item)
+
+        self.renew(worker, [])
+        beat = threading.Thread(target=heartbeat, daemon=True)
+        beat.start()
+        pool = [threading.Thread(target=loop) for _ in range(max(1, threads))]
+        try:
+            for thread in pool:
+                thread.start()
+            for thread in pool:
+                thread.join()
+        finally:
+            stop.set()
+            r.hdel(self.key("workers"), worker)
+        return completed[0]